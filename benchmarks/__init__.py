@@ -0,0 +1 @@
+"""Benchmarks of warc-migrator."""
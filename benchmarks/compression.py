@@ -0,0 +1,117 @@
+"""
+Compare the compression levels and deflate backends of the WARC output.
+
+The records of the test corpus in tests/data are compressed record by
+record, as done by the migrator, with each installed backend and the given
+compression levels. Run with::
+
+    python -m benchmarks.compression [--size MB] [--level N ...] [--json]
+"""
+import glob
+import json
+import os
+import time
+from io import BytesIO
+
+import click
+from warcio.archiveiterator import ArchiveIterator
+from warcio.warcwriter import WARCWriter
+
+from warc_migrator.compression import (BACKENDS, compress_member,
+                                       resolve_backend)
+
+CORPUS = os.path.join(os.path.dirname(__file__), "..", "tests", "data")
+
+
+def load_corpus(corpus_dir=CORPUS):
+    """
+    Serialize the records of the WARC files in the corpus uncompressed.
+
+    :corpus_dir: Directory of the corpus
+    :returns: List of serialized records
+    """
+    records = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.warc*"))):
+        with open(path, "rb") as warc_file:
+            try:
+                for record in ArchiveIterator(warc_file, arc2warc=False,
+                                              verify_http=False):
+                    buff = BytesIO()
+                    WARCWriter(buff, gzip=False).write_record(record)
+                    records.append(buff.getvalue())
+            except Exception:  # pylint: disable=broad-except
+                continue  # Files which Warcio can not read as such
+    return records
+
+
+def _installed(backend):
+    """
+    Check whether a deflate backend is installed.
+
+    :backend: Deflate backend name
+    :returns: True if the backend can be used
+    """
+    try:
+        return resolve_backend(backend) == backend
+    except ValueError:
+        return False
+
+
+def run_benchmark(records, size, levels):
+    """
+    Compress the records with each installed backend and level.
+
+    :records: List of serialized records
+    :size: Amount of data to compress per setting, in bytes
+    :levels: Compression levels to compare
+    :returns: List of result dicts
+    """
+    corpus_size = sum(len(record) for record in records)
+    rounds = max(1, size // corpus_size)
+    backends = [backend for backend in BACKENDS
+                if backend != "auto" and _installed(backend)]
+    results = []
+    for backend in backends:
+        for level in levels:
+            compressed = 0
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for record in records:
+                    compressed += len(compress_member(record, level, backend))
+            elapsed = time.perf_counter() - start
+            results.append({
+                "backend": backend,
+                "level": level,
+                "bytes_in": corpus_size * rounds,
+                "bytes_out": compressed,
+                "ratio": compressed / (corpus_size * rounds),
+                "seconds": elapsed,
+                "mb_per_s": corpus_size * rounds / elapsed / 1e6})
+    return results
+
+
+@click.command()
+@click.option("--size", type=int, default=32, show_default=True,
+              help="Megabytes to compress per setting.")
+@click.option("--level", "levels", type=click.IntRange(0, 9), multiple=True,
+              default=(1, 6, 9), show_default=True,
+              help="Compression level to compare.")
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the results as JSON.")
+def main(size, levels, as_json):
+    """
+    Benchmark the compression settings on the test corpus.
+    """
+    results = run_benchmark(load_corpus(), size * 1000000, levels)
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    click.echo("%-8s %5s %10s %8s" % ("backend", "level", "MB/s", "ratio"))
+    for result in results:
+        click.echo("%-8s %5d %10.1f %8.3f" % (
+            result["backend"], result["level"], result["mb_per_s"],
+            result["ratio"]))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
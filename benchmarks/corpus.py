@@ -0,0 +1,300 @@
+"""
+Generate a synthetic corpus of ARC and WARC files for the benchmarks.
+
+The files have a given number of HTTP response records of a given size, and
+the same seed always produces the same files. Every tenth record has a
+non-ASCII status line. Run with::
+
+    python -m benchmarks.corpus DIRECTORY [--records N] [--size BYTES]
+"""
+import datetime
+import json
+import os
+import random
+import uuid
+import zlib
+
+import click
+
+from warc_migrator.compression import compress_member, make_compressor
+
+FORMATS = ("arc-1.0", "arc-1.1", "warc-0.17", "warc-0.18")
+COMPRESSIONS = ("none", "multi-member", "single-member")
+# The corpus of the benchmarks, as (format, compression) pairs. ARC files
+# compressed as a single gzip member are not supported by the migrator.
+DEFAULT_LAYOUTS = (
+    ("arc-1.0", "none"), ("arc-1.1", "none"), ("arc-1.1", "multi-member"),
+    ("warc-0.17", "none"), ("warc-0.18", "none"),
+    ("warc-0.18", "multi-member"), ("warc-0.18", "single-member"))
+NON_ASCII_INTERVAL = 10  # Every 10th record has a non-ASCII status line
+BASE_TIMESTAMP = 1623780000  # 2021-06-15T18:00:00Z
+WORDS = (b"archive web record crawl harvest page link image text html "
+         b"server response content digest payload header metadata "
+         b"preservation migration format").split()
+ARC_FIELDS = b"URL IP-address Archive-date Content-type Archive-length\n"
+ARC_METADATA = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    b'<arcmetadata xmlns:dc="http://purl.org/dc/elements/1.1/" '
+    b'xmlns:arc="http://archive.org/arc/1.0/">\n'
+    b'<arc:software>warc-migrator benchmarks</arc:software>\n'
+    b'<arc:hostname>localhost</arc:hostname>\n'
+    b'<dc:description>Synthetic benchmark corpus</dc:description>\n'
+    b'%s</arcmetadata>\n')
+
+
+def file_name(file_format, compression):
+    """
+    Resolve the name of a corpus file.
+
+    :file_format: One of FORMATS
+    :compression: One of COMPRESSIONS
+    :returns: File name, e.g. warc-0.18-multi-member.warc.gz
+    """
+    extension = "." + file_format.split("-")[0]
+    if compression != "none":
+        return "%s-%s%s.gz" % (file_format, compression, extension)
+    return file_format + extension
+
+
+def _timestamp(index, separators=True):
+    """
+    Resolve the capture time of a record.
+
+    :index: Record number
+    :separators: True for the WARC date format, False for the ARC format
+    :returns: Timestamp as bytes
+    """
+    date = datetime.datetime.utcfromtimestamp(BASE_TIMESTAMP + index)
+    return date.strftime("%Y-%m-%dT%H:%M:%SZ" if separators
+                         else "%Y%m%d%H%M%S").encode("ascii")
+
+
+def _text_block(rng):
+    """
+    Create a block of text with about the compression ratio of HTML.
+
+    :rng: Random number generator
+    :returns: 64 KiB of text as bytes
+    """
+    words = []
+    length = 0
+    while length < 64 * 1024:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return b" ".join(words)[:64 * 1024]
+
+
+def http_response(rng, block, index, size):
+    """
+    Create an HTTP response with a body of the given size.
+
+    :rng: Random number generator
+    :block: Text block from which the body is sliced
+    :index: Record number
+    :size: Size of the body in bytes
+    :returns: HTTP response as bytes
+    """
+    status = b"200 OK"
+    if index % NON_ASCII_INTERVAL == NON_ASCII_INTERVAL - 1:
+        status = "200 Hyvä tulos".encode("utf-8")
+    body = bytearray()
+    while len(body) < size:
+        start = rng.randrange(len(block))
+        body += block[start:start + size - len(body)]
+    return b"".join([
+        b"HTTP/1.1 ", status, b"\r\n",
+        b"Date: ", _timestamp(index), b"\r\n",
+        b"Server: Benchmark Server\r\n",
+        b"Content-Length: %d\r\n" % size,
+        b"Content-Type: text/html; charset=UTF-8\r\n",
+        b"Connection: close\r\n\r\n", bytes(body)])
+
+
+def arc_metadata(rng, size=0):
+    """
+    Create the XML metadata of an ARC 1.1 file header.
+
+    :rng: Random number generator
+    :size: Approximate size in bytes of the additional dc:subject fields,
+           each of about 80 bytes
+    :returns: XML metadata as bytes
+    """
+    fields = []
+    length = 0
+    while length < size:
+        words = b" ".join(rng.choice(WORDS) for _ in range(8))
+        field = b"<dc:subject>%s</dc:subject>\n" % words
+        fields.append(field)
+        length += len(field)
+    return ARC_METADATA % b"".join(fields)
+
+
+def _arc_records(rng, name, version, records, size, metadata_size=0):
+    """
+    Serialize the records of an ARC file.
+
+    :rng: Random number generator
+    :name: File name
+    :version: "1.0" or "1.1"
+    :records: Number of records after the file header
+    :size: Size of the HTTP response bodies
+    :metadata_size: Approximate size of additional XML metadata of ARC 1.1
+                    file header in bytes
+    :returns: Generator of serialized records
+    """
+    header = b"1 %s Benchmark\n" % version.split(".")[1].encode("ascii") + \
+        ARC_FIELDS
+    if version == "1.1":
+        header += arc_metadata(rng, metadata_size)
+    yield b"filedesc://%s 0.0.0.0 %s text/plain %d\n%s\n" % (
+        name.encode("ascii"), _timestamp(0, False), len(header), header)
+
+    block = _text_block(rng)
+    for index in range(records):
+        content = http_response(rng, block, index, size)
+        yield b"http://example.com/%d.html 192.0.2.1 %s text/html %d\n" \
+            b"%s\n" % (index, _timestamp(index, False), len(content), content)
+
+
+def _warc_record(version, headers, content):
+    """
+    Serialize a WARC record.
+
+    :version: "0.17" or "0.18"
+    :headers: List of (name, value) tuples as bytes
+    :content: Record block
+    :returns: Serialized record
+    """
+    lines = [b"WARC/" + version.encode("ascii")]
+    lines += [name + b": " + value for name, value in headers]
+    lines.append(b"Content-Length: %d" % len(content))
+    return b"\r\n".join(lines) + b"\r\n\r\n" + content + b"\r\n\r\n"
+
+
+def _warc_records(rng, name, version, records, size, metadata_size=0):
+    """
+    Serialize the records of a WARC file.
+
+    :rng: Random number generator
+    :name: File name
+    :version: "0.17" or "0.18"
+    :records: Number of records after the warcinfo record
+    :size: Size of the HTTP response bodies
+    :metadata_size: Not used, WARC files have no XML metadata
+    :returns: Generator of serialized records
+    """
+    # pylint: disable=unused-argument
+    def record_id():
+        return b"<urn:uuid:%s>" % str(
+            uuid.UUID(int=rng.getrandbits(128))).encode("ascii")
+
+    warcinfo_id = record_id()
+    yield _warc_record(version, [
+        (b"WARC-Type", b"warcinfo"),
+        (b"WARC-Record-ID", warcinfo_id),
+        (b"WARC-Date", _timestamp(0)),
+        (b"WARC-Filename", name.encode("ascii")),
+        (b"Content-Type", b"application/warc-fields")],
+        b"software: warc-migrator benchmarks\r\n"
+        b"format: WARC File Format %s\r\n" % version.encode("ascii"))
+
+    block = _text_block(rng)
+    for index in range(records):
+        yield _warc_record(version, [
+            (b"WARC-Type", b"response"),
+            (b"WARC-Record-ID", record_id()),
+            (b"WARC-Target-URI", b"http://example.com/%d.html" % index),
+            (b"WARC-Warcinfo-ID", warcinfo_id),
+            (b"WARC-Date", _timestamp(index)),
+            (b"Content-Type", b"application/http; msgtype=response")],
+            http_response(rng, block, index, size))
+
+
+def write_file(path, file_format, compression="none", records=1000,
+               size=10000, seed=0, metadata_size=0):
+    """
+    Write a synthetic ARC or WARC file.
+
+    :path: File path
+    :file_format: One of FORMATS
+    :compression: "none", "multi-member" for one gzip member per record or
+                  "single-member" for one gzip member for the whole file
+    :records: Number of records after the file header or warcinfo record
+    :size: Size of the HTTP response bodies in bytes
+    :seed: Seed of the random content
+    :metadata_size: Approximate size of additional XML metadata in the file
+                    header of ARC 1.1 files in bytes
+    :returns: Number of uncompressed bytes written
+    """
+    if file_format not in FORMATS:
+        raise ValueError("Unknown format %s." % file_format)
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unknown compression %s." % compression)
+    rng = random.Random(seed)
+    kind, version = file_format.split("-")
+    serialize = _arc_records if kind == "arc" else _warc_records
+    compressor = make_compressor() if compression == "single-member" \
+        else None
+
+    written = 0
+    with open(path, "wb") as out:
+        for record in serialize(rng, os.path.basename(path), version,
+                                records, size, metadata_size):
+            written += len(record)
+            if compression == "multi-member":
+                out.write(compress_member(record))
+            elif compressor is not None:
+                out.write(compressor.compress(record))
+            else:
+                out.write(record)
+        if compressor is not None:
+            out.write(compressor.flush(zlib.Z_FINISH))
+    return written
+
+
+def generate_corpus(directory, records=1000, size=10000, seed=0,
+                    layouts=DEFAULT_LAYOUTS):
+    """
+    Write the corpus files into a directory.
+
+    :directory: Target directory
+    :records: Number of records per file
+    :size: Size of the HTTP response bodies in bytes
+    :seed: Seed of the random content
+    :layouts: List of (format, compression) pairs
+    :returns: List of dicts describing the files
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    corpus = []
+    for file_format, compression in layouts:
+        path = os.path.join(directory, file_name(file_format, compression))
+        written = write_file(path, file_format, compression, records, size,
+                             seed)
+        corpus.append({"path": path, "format": file_format,
+                       "compression": compression,
+                       "records": records + 1, "bytes": written,
+                       "file_bytes": os.path.getsize(path)})
+    return corpus
+
+
+@click.command()
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--records", type=click.IntRange(min=1), default=1000,
+              show_default=True, help="Number of records per file.")
+@click.option("--size", type=click.IntRange(min=0), default=10000,
+              show_default=True,
+              help="Size of the HTTP response bodies in bytes.")
+@click.option("--seed", type=int, default=0, show_default=True,
+              help="Seed of the random content.")
+def main(directory, records, size, seed):
+    """
+    Write the synthetic benchmark corpus into DIRECTORY.
+    """
+    click.echo(json.dumps(generate_corpus(directory, records, size, seed),
+                          indent=2))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
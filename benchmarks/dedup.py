@@ -0,0 +1,112 @@
+"""
+Measure the deduplication of repeated payloads with a digest index.
+
+A WARC 0.18 file of the synthetic corpus is migrated into a digest index,
+and then migrated again with and without the index, like a repeated crawl
+of an unchanged site. With the index, the responses are written as revisit
+records without their payloads. Run with::
+
+    python -m benchmarks.dedup [--records N] [--size BYTES] [--json]
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import click
+
+from benchmarks.corpus import file_name, write_file
+from benchmarks.migration import time_stage
+from warc_migrator.dedup import DigestIndex
+from warc_migrator.migrator import WarcMigrator
+
+
+def _migrate(path, target, index_path):
+    """
+    Migrate a WARC file.
+
+    :path: Source file path
+    :target: Target file path, overwritten
+    :index_path: Digest index file path, None for no deduplication
+    :returns: Count of written records
+    """
+    if index_path is None:
+        return WarcMigrator(path, target, {}).migrate_warc()
+    dedup = DigestIndex(index_path)
+    try:
+        # The index is not committed, so every repeat finds the same
+        # records in it
+        return WarcMigrator(path, target, {}, dedup=dedup).migrate_warc()
+    finally:
+        dedup.close()
+
+
+def run_benchmark(work_dir, records, size, repeat=1):
+    """
+    Time the migration of a repeated crawl with and without the digest
+    index of the first crawl.
+
+    :work_dir: Directory for the corpus, index and migrated files
+    :records: Number of records in the file
+    :size: Size of the HTTP response bodies in bytes
+    :repeat: Number of repeats, the best is reported
+    :returns: Result dict
+    """
+    source = os.path.join(work_dir, file_name("warc-0.18", "multi-member"))
+    write_file(source, "warc-0.18", "multi-member", records, size)
+    index_path = os.path.join(work_dir, "digests.sqlite")
+    target = os.path.join(work_dir, "migrated.warc.gz")
+    dedup = DigestIndex(index_path)
+    try:
+        WarcMigrator(source, target, {}, dedup=dedup).migrate_warc()
+        dedup.commit()
+    finally:
+        dedup.close()
+
+    result = {"bytes": os.path.getsize(source)}
+    for key, path in (("stored", None), ("deduplicated", index_path)):
+        seconds, cpu_seconds, _ = time_stage(
+            lambda path=path: _migrate(source, target, path), repeat)
+        result[key + "_seconds"] = seconds
+        result[key + "_cpu_seconds"] = cpu_seconds
+        result[key + "_target_bytes"] = os.path.getsize(target)
+    result["speedup"] = result["stored_seconds"] / \
+        result["deduplicated_seconds"]
+    result["size_ratio"] = result["deduplicated_target_bytes"] / \
+        result["stored_target_bytes"]
+    return result
+
+
+@click.command()
+@click.option("--records", type=click.IntRange(min=1), default=2000,
+              show_default=True, help="Number of records in the file.")
+@click.option("--size", type=click.IntRange(min=1), default=10000,
+              show_default=True,
+              help="Size of the HTTP response bodies in bytes.")
+@click.option("--repeat", type=click.IntRange(min=1), default=3,
+              show_default=True,
+              help="Number of repeats, the best is reported.")
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the results as JSON.")
+def main(records, size, repeat, as_json):
+    """
+    Benchmark the deduplication of a repeated crawl.
+    """
+    work_dir = tempfile.mkdtemp(prefix="warc-migrator.")
+    try:
+        result = run_benchmark(work_dir, records, size, repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+    click.echo("%10s %12s %8s %11s" % ("stored", "deduplicated", "speedup",
+                                       "size ratio"))
+    click.echo("%9.2fs %11.2fs %7.2fx %11.3f" % (
+        result["stored_seconds"], result["deduplicated_seconds"],
+        result["speedup"], result["size_ratio"]))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
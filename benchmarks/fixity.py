@@ -0,0 +1,125 @@
+"""
+Measure the fixity digests computed in the migration pass against separate
+passes over the source and target files after the migration.
+
+A file of the synthetic corpus is migrated without digests, with MD5 and
+SHA-256 digests of the source and target files computed afterwards from the
+files, and with the same digests computed by the migration from the bytes
+it reads and writes. The separate passes read the files from the page
+cache here, so on a cold cache or slow storage they cost more. Run with::
+
+    python -m benchmarks.fixity [--records N] [--size BYTES] [--json]
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import click
+
+from benchmarks.corpus import DEFAULT_LAYOUTS, file_name, write_file
+from benchmarks.migration import time_stage
+from warc_migrator.fixity import FIXITY_ALGORITHMS, file_digests
+from warc_migrator.migrator import WarcMigrator, is_arc
+
+
+def _migrate(path, target, mode):
+    """
+    Migrate a file.
+
+    :path: Source file path
+    :target: Target file path, overwritten
+    :mode: "plain" for no digests, "separate" to compute the digests from
+           the files after the migration, "inline" to compute them in the
+           migration
+    :returns: Dict of the file paths and their digests, None for no
+              digests
+    """
+    fixity = FIXITY_ALGORITHMS if mode == "inline" else None
+    migrator = WarcMigrator(path, target, {}, fixity=fixity)
+    if is_arc(path):
+        migrator.migrate_arc()
+    else:
+        migrator.migrate_warc()
+    if mode == "separate":
+        return {file_path: file_digests(file_path, FIXITY_ALGORITHMS)
+                for file_path in [path] + migrator.parts}
+    return migrator.fixity_digests()
+
+
+def run_benchmark(work_dir, records, size, repeat=1,
+                  layouts=DEFAULT_LAYOUTS):
+    """
+    Time the migration of the corpus files without digests, with digests
+    computed in separate passes, and with digests computed in the
+    migration.
+
+    :work_dir: Directory for the corpus and migrated files
+    :records: Number of records per file
+    :size: Size of the HTTP response bodies in bytes
+    :repeat: Number of repeats, the best is reported
+    :layouts: Tuples of the file format and compression of the files
+    :returns: List of result dicts, one per file
+    """
+    results = []
+    target = os.path.join(work_dir, "migrated.warc.gz")
+    for file_format, compression in layouts:
+        source = os.path.join(work_dir, file_name(file_format, compression))
+        write_file(source, file_format, compression, records, size)
+        result = {"format": file_format, "compression": compression,
+                  "bytes": os.path.getsize(source)}
+        for mode in ("plain", "separate", "inline"):
+            seconds, cpu_seconds, digests = time_stage(
+                lambda mode=mode: _migrate(source, target, mode), repeat)
+            result[mode + "_seconds"] = seconds
+            result[mode + "_cpu_seconds"] = cpu_seconds
+        # The files of the last inline migration are still there
+        if any(file_digests(path, FIXITY_ALGORITHMS) != file_fixity
+               for path, file_fixity in digests.items()):
+            raise ValueError("Wrong digests of %s." % source)
+        result["overhead"] = result["inline_seconds"] / \
+            result["plain_seconds"] - 1
+        result["speedup"] = result["separate_seconds"] / \
+            result["inline_seconds"]
+        results.append(result)
+        os.remove(source)
+    return results
+
+
+@click.command()
+@click.option("--records", type=click.IntRange(min=1), default=2000,
+              show_default=True, help="Number of records per file.")
+@click.option("--size", type=click.IntRange(min=1), default=10000,
+              show_default=True,
+              help="Size of the HTTP response bodies in bytes.")
+@click.option("--repeat", type=click.IntRange(min=1), default=3,
+              show_default=True,
+              help="Number of repeats, the best is reported.")
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the results as JSON.")
+def main(records, size, repeat, as_json):
+    """
+    Benchmark the fixity digests of the migration.
+    """
+    work_dir = tempfile.mkdtemp(prefix="warc-migrator.")
+    try:
+        results = run_benchmark(work_dir, records, size, repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    click.echo("%-10s %-13s %8s %9s %8s %9s %8s" % (
+        "format", "compression", "plain", "separate", "inline", "overhead",
+        "speedup"))
+    for result in results:
+        click.echo("%-10s %-13s %7.2fs %8.2fs %7.2fs %8.1f%% %7.2fx" % (
+            result["format"], result["compression"],
+            result["plain_seconds"], result["separate_seconds"],
+            result["inline_seconds"], 100 * result["overhead"],
+            result["speedup"]))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
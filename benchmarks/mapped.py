@@ -0,0 +1,110 @@
+"""
+Measure the memory-mapped input of uncompressed ARC sources.
+
+Uncompressed ARC files with large records are migrated with WarcMigrator,
+reading the source through a buffered file and from a memory map. With the
+map, the content of ARC records larger than the spool size is served from
+the map instead of being copied twice through temporary files. The target
+is not compressed by default, so that the compression does not hide the
+input path. Run with::
+
+    python -m benchmarks.mapped [--records N] [--size BYTES] [--level 0-9]
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import click
+
+from benchmarks.corpus import file_name, write_file
+from benchmarks.migration import time_stage
+from warc_migrator.migrator import WarcMigrator
+
+FORMATS = ("arc-1.0", "arc-1.1")
+
+
+def _migrate(path, target, mmap, level):
+    """
+    Migrate an ARC file of the corpus.
+
+    :path: Source file path
+    :target: Target file path, overwritten
+    :mmap: True to read the source from a memory map
+    :level: Compression level of the target
+    :returns: Count of written records
+    """
+    migrator = WarcMigrator(path, target, {}, mmap=mmap,
+                            compression_level=level)
+    return migrator.migrate_arc()
+
+
+def run_benchmark(work_dir, records, size, level=0, repeat=1):
+    """
+    Time the migration of uncompressed ARC files with and without the
+    memory map.
+
+    :work_dir: Directory for the corpus and migrated files
+    :records: Number of records per file
+    :size: Size of the HTTP response bodies in bytes
+    :level: Compression level of the targets
+    :repeat: Number of repeats, the best is reported
+    :returns: List of result dicts
+    """
+    results = []
+    target = os.path.join(work_dir, "migrated.warc.gz")
+    for file_format in FORMATS:
+        path = os.path.join(work_dir, file_name(file_format, "none"))
+        source_bytes = write_file(path, file_format, "none", records, size)
+        result = {"format": file_format, "bytes": source_bytes}
+        for mmap in (False, True):
+            seconds, cpu_seconds, _ = time_stage(
+                lambda mmap=mmap: _migrate(path, target, mmap, level), repeat)
+            key = "mmap" if mmap else "buffered"
+            result[key + "_seconds"] = seconds
+            result[key + "_cpu_seconds"] = cpu_seconds
+            result[key + "_mb_per_s"] = source_bytes / seconds / 1e6
+        result["speedup"] = result["buffered_seconds"] / \
+            result["mmap_seconds"]
+        results.append(result)
+        os.remove(path)
+        os.remove(target)
+    return results
+
+
+@click.command()
+@click.option("--records", type=click.IntRange(min=1), default=20,
+              show_default=True, help="Number of records per file.")
+@click.option("--size", type=click.IntRange(min=0), default=8000000,
+              show_default=True,
+              help="Size of the HTTP response bodies in bytes.")
+@click.option("--level", type=click.IntRange(0, 9), default=0,
+              show_default=True, help="Compression level of the targets.")
+@click.option("--repeat", type=click.IntRange(min=1), default=3,
+              show_default=True,
+              help="Number of repeats, the best is reported.")
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the results as JSON.")
+def main(records, size, level, repeat, as_json):
+    """
+    Benchmark the memory-mapped input of uncompressed sources.
+    """
+    work_dir = tempfile.mkdtemp(prefix="warc-migrator.")
+    try:
+        results = run_benchmark(work_dir, records, size, level, repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    click.echo("%-10s %10s %10s %8s" % ("format", "buffered", "mmap",
+                                        "speedup"))
+    for result in results:
+        click.echo("%-10s %9.1fs %9.1fs %7.2fx" % (
+            result["format"], result["buffered_seconds"],
+            result["mmap_seconds"], result["speedup"]))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
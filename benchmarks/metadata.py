@@ -0,0 +1,102 @@
+"""
+Measure how the fixing of ARC file headers scales with the size of their XML
+metadata.
+
+ARC 1.1 files with one record and XML metadata of the given sizes are
+converted to WARC once, and the fixing of the converted records with
+WarcFixer.fix_warc_migrated() is timed. The metadata is turned into the
+warcinfo and metadata records, so with linear scaling the time per MB of
+metadata stays about the same for all sizes. Run with::
+
+    python -m benchmarks.metadata [--size MB ...] [--repeat N] [--json]
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import click
+
+from benchmarks.corpus import write_file
+from benchmarks.migration import time_stage
+from warc_migrator.migrator import convert
+from warc_migrator.warc_fixer import WarcFixer
+
+DEFAULT_SIZES = (1, 2, 4, 8, 16)  # Metadata sizes in MB
+
+
+def _fix(converted):
+    """
+    Fix a converted WARC file into a temporary file.
+
+    :converted: Path of the converted WARC file
+    :returns: Count of written records
+    """
+    with open(converted, "rb") as source, \
+            tempfile.TemporaryFile(prefix="warc-migrator.") as target:
+        return WarcFixer({}, "benchmark.warc.gz").fix_warc_migrated(source,
+                                                                   target)
+
+
+def run_benchmark(sizes, work_dir, repeat=1):
+    """
+    Time the fixing of ARC file headers with metadata of the given sizes.
+
+    :sizes: Metadata sizes in MB
+    :work_dir: Directory for the ARC and converted WARC files
+    :repeat: Number of repeats of each size, the best is reported
+    :returns: List of result dicts
+    """
+    results = []
+    for size in sizes:
+        arc_path = os.path.join(work_dir, "metadata-%d.arc" % size)
+        converted = arc_path + ".warc"
+        write_file(arc_path, "arc-1.1", records=1, size=100,
+                   metadata_size=size * 1000000)
+        with open(converted, "wb") as out:
+            convert(arc_path, out)
+        metadata_bytes = os.path.getsize(arc_path)
+        os.remove(arc_path)
+
+        seconds, cpu_seconds, _ = time_stage(lambda: _fix(converted), repeat)
+        os.remove(converted)
+        results.append({"metadata_mb": size,
+                        "bytes": metadata_bytes,
+                        "seconds": seconds,
+                        "cpu_seconds": cpu_seconds,
+                        "seconds_per_mb": seconds / size})
+    return results
+
+
+@click.command()
+@click.option("--size", "sizes", type=click.IntRange(min=1), multiple=True,
+              default=DEFAULT_SIZES, show_default=True,
+              help="Size of the XML metadata in MB, can be given multiple "
+                   "times.")
+@click.option("--repeat", type=click.IntRange(min=1), default=3,
+              show_default=True,
+              help="Number of repeats of each size, the best is reported.")
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the results as JSON.")
+def main(sizes, repeat, as_json):
+    """
+    Benchmark the scaling of ARC header fixing with the metadata size.
+    """
+    work_dir = tempfile.mkdtemp(prefix="warc-migrator.")
+    try:
+        results = run_benchmark(sizes, work_dir, repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    click.echo("%8s %10s %10s" % ("MB", "seconds", "s/MB"))
+    for result in results:
+        click.echo("%8d %10.3f %10.3f" % (
+            result["metadata_mb"], result["seconds"],
+            result["seconds_per_mb"]))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,226 @@
+"""
+Measure the throughput of the migration stages on a synthetic corpus.
+
+The ARC files of the corpus are migrated with WarcMigrator.migrate_arc(),
+the WARC files with WarcMigrator.migrate_warc(), the gzip compressed WARC
+files are recompressed with recompress_warc(), and the migrated files are
+validated with validate_warc() and run_validation(). Each stage is timed
+separately, and the best time of the repeats is reported in MB/s of
+uncompressed source data and in records/s. A failing stage is reported
+with its error. Run with::
+
+    python -m benchmarks.migration [--records N] [--size BYTES] [--output FILE]
+
+With --pipeline, the files are migrated in the pipeline of reader, fixer
+and writer threads.
+
+The results are written as JSON, so that they can be tracked over time.
+"""
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+
+import warc_migrator
+from benchmarks.corpus import DEFAULT_LAYOUTS, generate_corpus
+from warc_migrator.migrator import WarcMigrator, run_validation
+from warc_migrator.validator import validate_warc
+from warc_migrator.warc_fixer import recompress_warc
+
+# External validation tools of run_validation() and their commands
+VALIDATION_TOOLS = (("warctools", "warcvalid"), ("warcio", "warcio"))
+
+
+def time_stage(function, repeat):
+    """
+    Time a stage of the migration.
+
+    :function: Function running the stage, called once per repeat
+    :repeat: Number of repeats
+    :returns: Tuple of the best wall clock time and the CPU time of the
+              same run in seconds, and the result of the function
+    """
+    best = None
+    for _ in range(repeat):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        result = function()
+        elapsed = (time.perf_counter() - start,
+                   time.process_time() - start_cpu)
+        if best is None or elapsed[0] < best[0]:
+            best = elapsed
+    return best[0], best[1], result
+
+
+def run_stage(stage, source, function, repeat, records=None):
+    """
+    Time a stage of the migration and create its result dict. A failing
+    stage is reported with the error instead of the timings.
+
+    :stage: Name of the stage
+    :source: Corpus file dict, see corpus.generate_corpus()
+    :function: Function running the stage, returning the number of
+               processed records or None
+    :repeat: Number of repeats
+    :records: Number of processed records, if not returned by the function
+    :returns: Result dict
+    """
+    result = {"stage": stage,
+              "source": os.path.basename(source["path"]),
+              "format": source["format"],
+              "compression": source["compression"],
+              "bytes": source["bytes"],
+              "records": records,
+              "seconds": None,
+              "cpu_seconds": None,
+              "mb_per_s": None,
+              "records_per_s": None,
+              "error": None}
+    try:
+        seconds, cpu_seconds, count = time_stage(function, repeat)
+    except Exception as error:  # pylint: disable=broad-except
+        result["error"] = "%s: %s" % (type(error).__name__, error)
+        return result
+
+    if records is None:
+        result["records"] = records = count
+    result.update({"seconds": seconds,
+                   "cpu_seconds": cpu_seconds,
+                   "mb_per_s": source["bytes"] / seconds / 1e6,
+                   "records_per_s": records / seconds})
+    return result
+
+
+def _migrate(source, target, pipeline=False):
+    """
+    Migrate a corpus file.
+
+    :source: Corpus file dict
+    :target: Target file path, overwritten
+    :pipeline: True to migrate in the pipeline
+    :returns: Count of written records
+    """
+    migrator = WarcMigrator(source["path"], target, {}, pipeline=pipeline)
+    if source["format"].startswith("arc"):
+        return migrator.migrate_arc()
+    return migrator.migrate_warc()
+
+
+def _recompress(source):
+    """
+    Recompress a gzip compressed corpus file into a temporary file.
+
+    :source: Corpus file dict
+    """
+    with open(source["path"], "rb") as warc, \
+            tempfile.TemporaryFile(prefix="warc-migrator.") as target:
+        recompress_warc(warc, target)
+
+
+def run_benchmark(corpus, work_dir, repeat=1, pipeline=False):
+    """
+    Time the migration stages on the corpus files.
+
+    :corpus: List of corpus file dicts, see corpus.generate_corpus()
+    :work_dir: Directory for the migrated files
+    :repeat: Number of repeats of each stage
+    :pipeline: True to migrate in the pipeline
+    :returns: List of result dicts
+    """
+    tools = [tool for tool, command in VALIDATION_TOOLS
+             if shutil.which(command)]
+    results = []
+    for source in corpus:
+        target = os.path.join(
+            work_dir, os.path.basename(source["path"]) + ".migrated.warc.gz")
+        stage = "migrate_arc" if source["format"].startswith("arc") \
+            else "migrate_warc"
+        result = run_stage(
+            stage, source,
+            lambda source=source, target=target: _migrate(source, target,
+                                                          pipeline),
+            repeat)
+        results.append(result)
+        if source["format"].startswith("warc") and \
+                source["compression"] != "none":
+            results.append(run_stage(
+                "recompress_warc", source,
+                lambda source=source: _recompress(source), repeat,
+                records=source["records"]))
+        if result["error"] is not None:
+            continue
+
+        results.append(run_stage(
+            "validate_warc", source,
+            lambda target=target: validate_warc(target), repeat,
+            records=result["records"]))
+        for tool in tools:
+            results.append(run_stage(
+                "run_validation:" + tool, source,
+                lambda tool=tool, target=target: run_validation(tool,
+                                                                target),
+                repeat, records=result["records"]))
+        os.remove(target)
+    return results
+
+
+def environment():
+    """
+    Describe the environment of the benchmark run.
+
+    :returns: Dict of the versions of the software and the platform
+    """
+    return {"warc_migrator": warc_migrator.__version__,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count()}
+
+
+@click.command()
+@click.option("--records", type=click.IntRange(min=1), default=1000,
+              show_default=True, help="Number of records per corpus file.")
+@click.option("--size", type=click.IntRange(min=0), default=10000,
+              show_default=True,
+              help="Size of the HTTP response bodies in bytes.")
+@click.option("--seed", type=int, default=0, show_default=True,
+              help="Seed of the random content of the corpus.")
+@click.option("--repeat", type=click.IntRange(min=1), default=3,
+              show_default=True,
+              help="Number of repeats of each stage, the best is reported.")
+@click.option("--pipeline", is_flag=True, default=False,
+              help="Migrate the files in the pipeline of reader, fixer and "
+                   "writer threads.")
+@click.option("--output", type=click.Path(dir_okay=False), default=None,
+              help="Write the results as JSON into the given file instead "
+                   "of printing them.")
+def main(records, size, seed, repeat, pipeline, output):
+    """
+    Benchmark the migration stages on a synthetic corpus.
+    """
+    work_dir = tempfile.mkdtemp(prefix="warc-migrator.")
+    try:
+        corpus = generate_corpus(os.path.join(work_dir, "corpus"), records,
+                                 size, seed, DEFAULT_LAYOUTS)
+        report = {"environment": environment(),
+                  "settings": {"records": records, "size": size,
+                               "seed": seed, "repeat": repeat,
+                               "pipeline": pipeline},
+                  "results": run_benchmark(corpus, work_dir, repeat,
+                                           pipeline)}
+    finally:
+        shutil.rmtree(work_dir)
+
+    if output:
+        with open(output, "w") as out:
+            json.dump(report, out, indent=2)
+        return
+    click.echo(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,100 @@
+"""
+Measure the copying of unchanged gzip members of WARC 1.0 sources.
+
+A WARC 0.18 file of the synthetic corpus, compressed record by record, is
+migrated to WARC 1.0, and the result is migrated again as the source, with
+and without option passthrough. Without it every record is decompressed,
+fixed and recompressed, with it only the warcinfo record is, and the gzip
+members of the other records are copied as they are. Run with::
+
+    python -m benchmarks.passthrough [--records N] [--size BYTES] [--json]
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import click
+
+from benchmarks.corpus import file_name, write_file
+from benchmarks.migration import time_stage
+from warc_migrator.migrator import WarcMigrator
+
+
+def _migrate(path, target, passthrough):
+    """
+    Migrate a WARC file.
+
+    :path: Source file path
+    :target: Target file path, overwritten
+    :passthrough: True to copy the gzip members of unchanged records
+    :returns: Count of written records
+    """
+    return WarcMigrator(path, target, {},
+                        passthrough=passthrough).migrate_warc()
+
+
+def run_benchmark(work_dir, records, size, repeat=1):
+    """
+    Time the migration of a WARC 1.0 file with and without copying the
+    gzip members.
+
+    :work_dir: Directory for the corpus and migrated files
+    :records: Number of records in the file
+    :size: Size of the HTTP response bodies in bytes
+    :repeat: Number of repeats, the best is reported
+    :returns: Result dict
+    """
+    corpus = os.path.join(work_dir, file_name("warc-0.18", "multi-member"))
+    write_file(corpus, "warc-0.18", "multi-member", records, size)
+    source = os.path.join(work_dir, "warc-1.0.warc.gz")
+    WarcMigrator(corpus, source, {}).migrate_warc()
+    target = os.path.join(work_dir, "migrated.warc.gz")
+
+    result = {"bytes": os.path.getsize(source)}
+    for passthrough in (False, True):
+        seconds, cpu_seconds, _ = time_stage(
+            lambda passthrough=passthrough: _migrate(source, target,
+                                                     passthrough),
+            repeat)
+        key = "passthrough" if passthrough else "recompressed"
+        result[key + "_seconds"] = seconds
+        result[key + "_cpu_seconds"] = cpu_seconds
+        result[key + "_mb_per_s"] = result["bytes"] / seconds / 1e6
+    result["speedup"] = result["recompressed_seconds"] / \
+        result["passthrough_seconds"]
+    return result
+
+
+@click.command()
+@click.option("--records", type=click.IntRange(min=1), default=2000,
+              show_default=True, help="Number of records in the file.")
+@click.option("--size", type=click.IntRange(min=0), default=10000,
+              show_default=True,
+              help="Size of the HTTP response bodies in bytes.")
+@click.option("--repeat", type=click.IntRange(min=1), default=3,
+              show_default=True,
+              help="Number of repeats, the best is reported.")
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the results as JSON.")
+def main(records, size, repeat, as_json):
+    """
+    Benchmark the copying of the gzip members of a WARC 1.0 file.
+    """
+    work_dir = tempfile.mkdtemp(prefix="warc-migrator.")
+    try:
+        result = run_benchmark(work_dir, records, size, repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if as_json:
+        click.echo(json.dumps(result, indent=2))
+        return
+    click.echo("%12s %12s %8s" % ("recompressed", "passthrough", "speedup"))
+    click.echo("%11.2fs %11.2fs %7.2fx" % (
+        result["recompressed_seconds"], result["passthrough_seconds"],
+        result["speedup"]))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
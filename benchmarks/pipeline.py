@@ -0,0 +1,172 @@
+"""
+Measure the pipeline of reader, fixer and writer threads on slow storage.
+
+WARC 0.18 files of the synthetic corpus are fixed with WarcFixer, with and
+without the pipeline, while the source and the target are throttled to the
+given bandwidth, like files on network-attached storage. Without the
+pipeline the time of the I/O adds up to the time of the migration, with the
+pipeline it overlaps the migration. A bandwidth of 0 measures the pipeline
+on local files without throttling. Run with::
+
+    python -m benchmarks.pipeline [--bandwidth MB/s] [--jobs N] [--json]
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import click
+from warcio.bufferedreaders import DecompressingBufferedReader
+
+from benchmarks.corpus import file_name, write_file
+from benchmarks.migration import time_stage
+from warc_migrator.warc_fixer import WarcFixer
+
+COMPRESSIONS = ("none", "multi-member", "single-member")
+
+
+class ThrottledFile:
+    """
+    File whose reads and writes are throttled to a given bandwidth.
+    """
+
+    def __init__(self, fileobj, bandwidth):
+        """
+        Initialize file.
+
+        :fileobj: Underlying file handler
+        :bandwidth: Bandwidth in bytes per second, 0 for no throttling
+        """
+        self.fileobj = fileobj
+        self.bandwidth = bandwidth
+
+    def _wait(self, size):
+        """
+        Wait for the transfer of the given number of bytes.
+        """
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+    def read(self, size=-1):
+        """
+        Read bytes.
+        """
+        data = self.fileobj.read(size)
+        self._wait(len(data))
+        return data
+
+    def write(self, data):
+        """
+        Write bytes.
+        """
+        self._wait(len(data))
+        return self.fileobj.write(data)
+
+    def flush(self):
+        """
+        Flush the underlying file.
+        """
+        self.fileobj.flush()
+
+
+def _fix(path, compression, bandwidth, pipeline, jobs):
+    """
+    Fix a WARC file into a temporary file, as WarcMigrator.migrate_warc()
+    does.
+
+    :path: Source file path
+    :compression: Compression of the source
+    :bandwidth: Bandwidth of the source and the target in bytes per second
+    :pipeline: True to fix in the pipeline
+    :jobs: Number of compression threads
+    :returns: Count of written records
+    """
+    with open(path, "rb") as source_file, \
+            tempfile.TemporaryFile(prefix="warc-migrator.") as target:
+        source = ThrottledFile(source_file, bandwidth)
+        if compression == "single-member" or \
+                (compression == "multi-member" and pipeline):
+            source = DecompressingBufferedReader(source,
+                                                 read_all_members=True)
+        warc_fixer = WarcFixer({}, "benchmark.warc.gz", jobs=jobs,
+                               pipeline=pipeline)
+        return warc_fixer.fix_warc_original(
+            source, ThrottledFile(target, bandwidth))
+
+
+def run_benchmark(work_dir, records, size, bandwidth, jobs=1, repeat=1):
+    """
+    Time the fixing of WARC files with and without the pipeline.
+
+    :work_dir: Directory for the corpus files
+    :records: Number of records per file
+    :size: Size of the HTTP response bodies in bytes
+    :bandwidth: Bandwidth of the source and the target in MB/s, 0 for no
+                throttling
+    :jobs: Number of compression threads
+    :repeat: Number of repeats, the best is reported
+    :returns: List of result dicts
+    """
+    results = []
+    for compression in COMPRESSIONS:
+        path = os.path.join(work_dir, file_name("warc-0.18", compression))
+        source_bytes = write_file(path, "warc-0.18", compression, records,
+                                  size)
+        result = {"compression": compression, "bytes": source_bytes}
+        for pipeline in (False, True):
+            seconds, cpu_seconds, _ = time_stage(
+                lambda pipeline=pipeline: _fix(
+                    path, compression, bandwidth * 1e6, pipeline, jobs),
+                repeat)
+            key = "pipeline" if pipeline else "sequential"
+            result[key + "_seconds"] = seconds
+            result[key + "_cpu_seconds"] = cpu_seconds
+        result["speedup"] = result["sequential_seconds"] / \
+            result["pipeline_seconds"]
+        results.append(result)
+        os.remove(path)
+    return results
+
+
+@click.command()
+@click.option("--records", type=click.IntRange(min=1), default=1000,
+              show_default=True, help="Number of records per file.")
+@click.option("--size", type=click.IntRange(min=0), default=10000,
+              show_default=True,
+              help="Size of the HTTP response bodies in bytes.")
+@click.option("--bandwidth", type=click.FloatRange(min=0), default=50.0,
+              show_default=True,
+              help="Bandwidth of the source and the target in MB/s, 0 for "
+                   "no throttling.")
+@click.option("--jobs", type=click.IntRange(min=1), default=1,
+              show_default=True, help="Number of compression threads.")
+@click.option("--repeat", type=click.IntRange(min=1), default=3,
+              show_default=True,
+              help="Number of repeats, the best is reported.")
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the results as JSON.")
+def main(records, size, bandwidth, jobs, repeat, as_json):
+    """
+    Benchmark the pipeline on throttled storage.
+    """
+    work_dir = tempfile.mkdtemp(prefix="warc-migrator.")
+    try:
+        results = run_benchmark(work_dir, records, size, bandwidth, jobs,
+                                repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    click.echo("%-14s %12s %12s %8s" % ("compression", "sequential",
+                                          "pipeline", "speedup"))
+    for result in results:
+        click.echo("%-14s %11.2fs %11.2fs %7.2fx" % (
+            result["compression"], result["sequential_seconds"],
+            result["pipeline_seconds"], result["speedup"]))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
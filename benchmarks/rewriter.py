@@ -0,0 +1,114 @@
+"""
+Measure the rewriting of the WARC headers of data records as bytes.
+
+WARC 0.18 files with many small records are fixed with WarcFixer, parsing
+every record with Warcio and rewriting the headers of the data records as
+bytes. The per-record overhead dominates with small records, so the records
+are small by default, and the target is not compressed by default, so that
+the compression does not hide it. Run with::
+
+    python -m benchmarks.rewriter [--records N] [--size BYTES] [--level 0-9]
+"""
+import json
+import os
+import shutil
+import tempfile
+
+import click
+
+from benchmarks.corpus import file_name, write_file
+from benchmarks.migration import time_stage
+from warc_migrator.warc_fixer import WarcFixer
+
+LAYOUTS = (("warc-0.18", "none"), ("warc-0.18", "multi-member"))
+
+
+def _fix(path, target, rewrite, level):
+    """
+    Fix a corpus file.
+
+    :path: Source file path
+    :target: Target file path, overwritten
+    :rewrite: True to rewrite the headers of the data records as bytes
+    :level: Compression level of the target
+    :returns: Count of written records
+    """
+    fixer = WarcFixer({}, os.path.basename(target), compression_level=level,
+                      rewrite=rewrite)
+    with open(path, "rb") as source, open(target, "wb") as target_handler:
+        return fixer.fix_warc_original(source, target_handler)
+
+
+def run_benchmark(work_dir, records, size, level=0, repeat=1):
+    """
+    Time the fixing of WARC files with and without rewriting the headers
+    as bytes.
+
+    :work_dir: Directory for the corpus and fixed files
+    :records: Number of records per file
+    :size: Size of the HTTP response bodies in bytes
+    :level: Compression level of the targets
+    :repeat: Number of repeats, the best is reported
+    :returns: List of result dicts
+    """
+    results = []
+    target = os.path.join(work_dir, "fixed.warc.gz")
+    for file_format, compression in LAYOUTS:
+        path = os.path.join(work_dir, file_name(file_format, compression))
+        source_bytes = write_file(path, file_format, compression, records,
+                                  size)
+        result = {"format": file_format, "compression": compression,
+                  "bytes": source_bytes}
+        for rewrite in (False, True):
+            seconds, cpu_seconds, _ = time_stage(
+                lambda rewrite=rewrite: _fix(path, target, rewrite, level),
+                repeat)
+            key = "rewritten" if rewrite else "parsed"
+            result[key + "_seconds"] = seconds
+            result[key + "_cpu_seconds"] = cpu_seconds
+            result[key + "_records_per_s"] = (records + 1) / seconds
+        result["speedup"] = result["parsed_seconds"] / \
+            result["rewritten_seconds"]
+        results.append(result)
+        os.remove(path)
+        os.remove(target)
+    return results
+
+
+@click.command()
+@click.option("--records", type=click.IntRange(min=1), default=20000,
+              show_default=True, help="Number of records per file.")
+@click.option("--size", type=click.IntRange(min=0), default=200,
+              show_default=True,
+              help="Size of the HTTP response bodies in bytes.")
+@click.option("--level", type=click.IntRange(0, 9), default=0,
+              show_default=True, help="Compression level of the targets.")
+@click.option("--repeat", type=click.IntRange(min=1), default=3,
+              show_default=True,
+              help="Number of repeats, the best is reported.")
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the results as JSON.")
+def main(records, size, level, repeat, as_json):
+    """
+    Benchmark the rewriting of the WARC headers of data records as bytes.
+    """
+    work_dir = tempfile.mkdtemp(prefix="warc-migrator.")
+    try:
+        results = run_benchmark(work_dir, records, size, level, repeat)
+    finally:
+        shutil.rmtree(work_dir)
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    click.echo("%-24s %10s %10s %8s" % ("source", "parsed", "rewritten",
+                                        "speedup"))
+    for result in results:
+        click.echo("%-24s %9.2fs %9.2fs %7.2fx" % (
+            "%s %s" % (result["format"], result["compression"]),
+            result["parsed_seconds"], result["rewritten_seconds"],
+            result["speedup"]))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,123 @@
+"""
+Measure the start-up time of the command line tools.
+
+Each module is imported in a fresh interpreter, and the import time and the
+heavy packages loaded by the import (Warctools and lxml, which are needed
+only for ARC files, XML metadata and in-process validation) are reported.
+The whole `warc-migrator --help` command is timed against an empty
+interpreter. Run with::
+
+    python -m benchmarks.startup [--repeat N] [--json]
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import click
+
+MODULES = ("warc_migrator.migrator", "warc_migrator.batch",
+           "warc_migrator.service")
+HEAVY_PACKAGES = ("hanzo", "lxml")
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, sorted(name for name in sys.modules
+                                  if name.split(".")[0] in {packages!r})]))
+"""
+
+
+def import_time(module, repeat=5):
+    """
+    Time the import of a module in fresh interpreters.
+
+    :module: Module name
+    :repeat: Number of interpreters, the best time is reported
+    :returns: Tuple of the best import time in seconds and the sorted list
+              of the heavy modules loaded by the import
+    """
+    best = None
+    loaded = None
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c",
+             _IMPORT_SCRIPT.format(module=module, packages=HEAVY_PACKAGES)],
+            cwd=ROOT)
+        seconds, loaded = json.loads(output.decode("utf-8"))
+        if best is None or seconds < best:
+            best = seconds
+    return best, loaded
+
+
+def command_time(args, repeat=5):
+    """
+    Time a command run in a fresh interpreter.
+
+    :args: Arguments of the interpreter
+    :repeat: Number of runs, the best time is reported
+    :returns: Best wall clock time in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable] + list(args), cwd=ROOT,
+                              stdout=subprocess.DEVNULL)
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+
+def run_benchmark(repeat=5):
+    """
+    Time the imports of the command line modules and the help command.
+
+    :repeat: Number of runs of each measurement
+    :returns: List of result dicts
+    """
+    results = []
+    for module in MODULES:
+        seconds, loaded = import_time(module, repeat)
+        results.append({"name": "import " + module, "seconds": seconds,
+                        "heavy_modules": loaded})
+    interpreter = command_time(["-c", "pass"], repeat)
+    results.append({"name": "python -c pass", "seconds": interpreter,
+                    "heavy_modules": []})
+    results.append({
+        "name": "warc-migrator --help",
+        "seconds": command_time(["-m", "warc_migrator.migrator", "--help"],
+                                repeat),
+        "heavy_modules": None})
+    return results
+
+
+@click.command()
+@click.option("--repeat", type=click.IntRange(min=1), default=5,
+              show_default=True,
+              help="Number of runs of each measurement, the best is "
+                   "reported.")
+@click.option("--json", "as_json", is_flag=True,
+              help="Print the results as JSON.")
+def main(repeat, as_json):
+    """
+    Benchmark the start-up time of the command line tools.
+    """
+    results = run_benchmark(repeat)
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    click.echo("%-32s %8s  %s" % ("", "ms", "heavy modules"))
+    for result in results:
+        heavy = result["heavy_modules"]
+        click.echo("%-32s %8.1f  %s" % (
+            result["name"], result["seconds"] * 1000,
+            "-" if heavy is None else len(heavy)))
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable=no-value-for-parameter
@@ -4,19 +4,24 @@ from warc_migrator import __version__
 
 setup(
     name='warc_migrator',
-    packages=find_packages(exclude=['tests', 'tests.*']),
+    packages=find_packages(exclude=['tests', 'tests.*',
+                                    'benchmarks', 'benchmarks.*']),
     include_package_data=True,
     version=__version__,
     install_requires=[
         "click",
-        "warcio",
+        # rewriter.RecordReader extends private methods of ArchiveIterator
+        "warcio==1.8.1",
         "warctools",
         "lxml",
         "xml_helpers@git+https://gitlab.ci.csc.fi/dpres/xml-helpers.git"
         "@develop#egg=xml_helpers"
     ],
     entry_points={'console_scripts': [
-        'warc-migrator=warc_migrator.migrator:warc_migrator_cli']},
+        'warc-migrator=warc_migrator.migrator:warc_migrator_cli',
+        'warc-migrator-batch=warc_migrator.batch:warc_migrator_batch_cli',
+        'warc-migrator-service='
+        'warc_migrator.service:warc_migrator_service_cli']},
     zip_safe=False,
     tests_require=['pytest'],
     test_suite='tests')
@@ -0,0 +1,86 @@
+"""
+Test the conversion of ARC records with bounded memory use.
+"""
+import gzip
+import re
+from io import BytesIO
+
+import pytest
+from hanzo.arc2warc import ArcTransformer, is_http_response
+from hanzo.warctools.mixed import MixedRecord
+
+from warc_migrator.arc_transformer import (SpoolingArcTransformer,
+                                           spooled_http_response)
+
+# Headers which contain timestamps or identifiers derived from them
+VOLATILE = re.compile(rb"(WARC-Date|WARC-Record-ID|WARC-Warcinfo-ID|"
+                      rb"WARC-Concurrent-To): [^\r]*")
+
+GZIPPED = gzip.compress(b"a" * 100000)
+HTTP_CONTENTS = [
+    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" +
+    b"3e8\r\n" + b"x" * 1000 + b"\r\n0\r\n\r\n",
+    b"HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: %d"
+    b"\r\n\r\n" % len(GZIPPED) + GZIPPED,
+    b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n" + b"y" * 1000,
+    b"HTTP/1.1 200 OK\r\nContent-Length: 1000\r\n\r\n" + b"y" * 1000,
+    b"HTTP/1.1 200 OK\r\n\r\n" + b"z" * 1000,
+    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n",
+    b"not http" * 1000,
+]
+
+
+def _convert(path, transformer):
+    """
+    Convert an ARC file and return the result without volatile headers.
+    """
+    out = BytesIO()
+    handler = MixedRecord.open_archive(filename=path, gzip="auto")
+    try:
+        for record in handler:
+            for warcrecord in transformer.convert(record):
+                warcrecord.write_to(out, gzip=False)
+    finally:
+        handler.close()
+    return VOLATILE.sub(b"", out.getvalue())
+
+
+def _write_arc(path):
+    """
+    Write an ARC file with HTTP records of different kinds.
+    """
+    filedesc = b"1 0 Test\nURL IP-address Archive-date Content-type " \
+               b"Archive-length\n"
+    with open(path, "wb") as out:
+        out.write(b"filedesc://test.arc 0.0.0.0 20210615181500 text/plain "
+                  b"%d\n" % len(filedesc) + filedesc + b"\n")
+        for i, content in enumerate(HTTP_CONTENTS):
+            out.write(b"http://localhost/%d 127.0.0.1 20210615181300 "
+                      b"text/html %d\n" % (i, len(content)) + content +
+                      b"\n")
+
+
+@pytest.mark.parametrize(
+    "infile", ["tests/data/valid_1.0.arc", "tests/data/valid_1.1.arc",
+               "tests/data/invalid_1.0_missing_length.arc", None]
+)
+@pytest.mark.parametrize("spool_size", [0, 100])
+def test_spooling_arc_transformer(infile, spool_size, tmpdir):
+    """
+    Test that the records converted via spooled files are identical with
+    the records of Warctools' ArcTransformer.
+    """
+    if infile is None:
+        infile = str(tmpdir.join("test.arc"))
+        _write_arc(infile)
+    assert _convert(infile, SpoolingArcTransformer(spool_size)) == \
+        _convert(infile, ArcTransformer())
+
+
+@pytest.mark.parametrize("content", HTTP_CONTENTS)
+def test_spooled_http_response(content):
+    """
+    Test that the response detection gives the same result as Warctools.
+    """
+    spool = BytesIO(content)
+    assert spooled_http_response(spool) == is_http_response(content)
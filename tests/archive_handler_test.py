@@ -1,9 +1,13 @@
 """
 Test the methods of ArchiveHandler
 """
+import base64
+import hashlib
+import io
+
 from warcio.statusandheaders import StatusAndHeaders
 
-from warc_migrator.archive_handler import ArchiveHandler
+from warc_migrator.archive_handler import ArchiveHandler, ChunkStream
 
 
 def test_archive_handler():
@@ -59,3 +63,55 @@ def test_make_warcinfo_payload():
     archive.warcinfo = {"info1": ["infovalue1"], "info2": ["infovalue2"]}
     payload = archive._make_warcinfo_payload()
     assert payload == b"info1: infovalue1\r\ninfo2: infovalue2\r\n"
+
+
+def test_chunk_stream():
+    """
+    Test reading and seeking a payload collected as chunks.
+    """
+    chunks = [b"abc", b"defg", b"h"]
+    stream = ChunkStream(chunks)
+    assert stream.length == 8
+    assert stream.read(10) is chunks[0]
+    assert stream.read(2) == b"de"
+    assert stream.read(10) == b"fg"
+    assert stream.tell() == 7
+    assert stream.read() == b"h"
+    assert stream.read(10) == b""
+
+    assert stream.seek(-3, io.SEEK_END) == 5
+    assert stream.read() == b"fgh"
+    stream.seek(1)
+    buff = bytearray(5)
+    assert stream.readinto(buff) == 2
+    assert bytes(buff[:2]) == b"bc"
+    stream.seek(0)
+    assert stream.readline() == b"abcdefgh"
+    assert ChunkStream([]).read() == b""
+
+
+def test_create_info_record_chunks():
+    """
+    Test that a metadata record is created from the metadata chunks, and
+    that the digests of the given header are replaced.
+    """
+    archive = ArchiveHandler()
+    for index in range(1000):
+        archive.append_metadata(b"<line>%d</line>\n" % index)
+    archive.append_metadata(b"")
+    assert len(archive.metadata_chunks) == 1000
+    headers = StatusAndHeaders(
+        "WARC/0.17", [("WARC-Type", "metadata"),
+                      ("WARC-Block-Digest", "sha1:stale"),
+                      ("WARC-Payload-Digest", "sha1:stale"),
+                      ("Content-Type", "text/xml")])
+    archive.create_info_record(headers, "metadata")
+
+    record = archive.metadata_record
+    digest = base64.b32encode(
+        hashlib.sha1(archive.metadata).digest()).decode("ascii")
+    assert record.length == len(archive.metadata)
+    assert record.content_type == "text/xml"
+    assert headers.get_header("WARC-Block-Digest") is None
+    assert headers.get_header("WARC-Payload-Digest") == "sha1:" + digest
+    assert record.raw_stream.read() == archive.metadata
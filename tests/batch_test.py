@@ -0,0 +1,158 @@
+"""
+Test the batch migration.
+"""
+import csv
+import json
+import os
+import shutil
+
+from click.testing import CliRunner
+
+from warc_migrator import batch
+from warc_migrator.batch import (collect_sources, migrate_batch, target_name,
+                                 warc_migrator_batch_cli)
+
+
+def _make_sources(tmpdir):
+    """
+    Copy a valid ARC, a valid WARC and an empty file into a source directory.
+    """
+    source_dir = tmpdir.mkdir("sources")
+    for name in ("valid_1.0.arc", "valid_0.17.warc"):
+        shutil.copy(os.path.join("tests/data", name), str(source_dir))
+    source_dir.join("empty.arc").write("")
+    return source_dir
+
+
+def test_collect_sources(tmpdir):
+    """
+    Test resolving sources from a directory, glob pattern and manifest file.
+    """
+    source_dir = _make_sources(tmpdir)
+    expected = [str(source_dir.join(name)) for name in
+                ("empty.arc", "valid_0.17.warc", "valid_1.0.arc")]
+
+    assert collect_sources(str(source_dir)) == expected
+    assert collect_sources(str(source_dir.join("*.arc"))) == \
+        [expected[0], expected[2]]
+
+    manifest = source_dir.join("manifest.txt")
+    manifest.write("# comment\nvalid_1.0.arc\n\n%s\n" % expected[1])
+    assert collect_sources(str(manifest)) == [expected[2], expected[1]]
+
+
+def test_target_name():
+    """
+    Test the target file names of the batch.
+    """
+    assert target_name("a/b.arc") == "b.warc.gz"
+    assert target_name("a/b.arc.gz") == "b.warc.gz"
+    assert target_name("a/b.warc") == "b.warc.gz"
+    assert target_name("a/b.warc.gz") == "b.warc.gz"
+    assert target_name("a/b.data") == "b.data.warc.gz"
+
+
+def test_migrate_batch(tmpdir):
+    """
+    Test that a batch is migrated and failing files are reported without
+    stopping the migration of the other files.
+    """
+    source_dir = _make_sources(tmpdir)
+    target_dir = tmpdir.mkdir("targets")
+    sources = collect_sources(str(source_dir))
+    sources.append(str(source_dir.join("valid_1.0.arc")))
+
+    report = migrate_batch(sources, str(target_dir), (("k1", "v1"),),
+                           workers=2)
+
+    assert [result["source"] for result in report] == sources
+    assert "Empty source file" in report[0]["error"]
+    assert report[1]["count"] == 2
+    assert report[1]["error"] is None
+    assert report[2]["count"] == 4
+    assert report[2]["error"] is None
+    assert "shared with another source" in report[3]["error"]
+    assert target_dir.join("valid_0.17.warc.gz").isfile()
+    assert target_dir.join("valid_1.0.warc.gz").isfile()
+
+
+def test_migrate_batch_worker_crash(tmpdir, monkeypatch):
+    """
+    Test that the files migrated before a worker process died are
+    reported, and the other files are reported with an error.
+    """
+    migrate_to_warc = batch.migrate_to_warc
+
+    def _crash(source_path, *args, **kwargs):
+        if source_path.endswith("valid_1.0.arc"):
+            os._exit(1)  # pylint: disable=protected-access
+        return migrate_to_warc(source_path, *args, **kwargs)
+
+    # The worker processes are forked with the patched function
+    monkeypatch.setattr(batch, "migrate_to_warc", _crash)
+    source_dir = tmpdir.mkdir("sources")
+    for name in ("valid_0.17.warc", "valid_1.0.arc"):
+        shutil.copy(os.path.join("tests/data", name), str(source_dir))
+    report_path = tmpdir / "report.json"
+    result = CliRunner().invoke(
+        warc_migrator_batch_cli,
+        [str(source_dir), str(tmpdir / "targets"), "--workers", "1",
+         "--report", str(report_path)])
+
+    assert result.exit_code == 1
+    assert "Migrated 1 of 2 files." in result.output
+    report = json.loads(report_path.read())
+    assert report[0]["count"] == 2
+    assert report[0]["error"] is None
+    assert report[1]["count"] is None
+    assert "Worker processes failed" in report[1]["error"]
+
+
+def test_batch_cli(tmpdir):
+    """
+    Test the command line interface of the batch migration.
+    """
+    source_dir = _make_sources(tmpdir)
+    target_dir = tmpdir / "targets"
+    report_path = tmpdir / "report.json"
+    result = CliRunner().invoke(
+        warc_migrator_batch_cli,
+        [str(source_dir), str(target_dir), "--workers", "2",
+         "--report", str(report_path)])
+
+    assert result.exit_code == 1
+    assert "Migrated 2 of 3 files." in result.output
+    assert "valid_1.0.warc.gz with 4 records." in result.output
+    assert len(json.loads(report_path.read())) == 3
+
+
+def test_batch_cli_scan(tmpdir):
+    """
+    Test the scan of a batch into a CSV inventory, without a target
+    directory.
+    """
+    source_dir = _make_sources(tmpdir)
+    report_path = tmpdir / "inventory.csv"
+    result = CliRunner().invoke(
+        warc_migrator_batch_cli,
+        [str(source_dir), "--scan", "--report", str(report_path),
+         "--report-format", "csv"])
+
+    assert result.exit_code == 1
+    assert "valid_1.0.arc: ARC 1.0, uncompressed, 3 records" in \
+        result.output
+    assert "Scanned 2 of 3 files" in result.output
+    with open(str(report_path), newline="") as report_file:
+        inventory = list(csv.DictReader(report_file))
+    assert [row["version"] for row in inventory] == ["", "0.17", "1.0"]
+    assert inventory[1]["records"] == "2"
+
+
+def test_batch_cli_missing_target(tmpdir):
+    """
+    Test that the target directory is required without --scan.
+    """
+    result = CliRunner().invoke(warc_migrator_batch_cli,
+                                [str(_make_sources(tmpdir))])
+    assert result.exit_code == 2
+    assert "TARGET_DIR" in result.output
@@ -0,0 +1,209 @@
+"""
+Test resuming an interrupted migration from a checkpoint.
+"""
+import io
+import os
+
+import pytest
+from hanzo.arc2warc import ArcTransformer
+from warcio.archiveiterator import ArchiveIterator
+
+from warc_migrator import checkpoint as checkpoint_module
+from warc_migrator.checkpoint import Checkpoint
+from warc_migrator.compression import CompressingWARCWriter
+from warc_migrator.migrator import migrate_to_warc
+from warc_migrator.validator import validate_warc
+from warc_migrator.warc_fixer import part_name
+
+
+class Interrupted(Exception):
+    """
+    Simulated interruption of the migration.
+    """
+
+
+def _interrupt_after(monkeypatch, records):
+    """
+    Interrupt the migration after the given number of written records, and
+    leave a partially written member at the end of the target.
+    """
+    add_index = CompressingWARCWriter._add_index
+
+    def _add_index(self, entry, length):
+        add_index(self, entry, length)
+        if self.records == records:
+            self.out.write(b"\x1f\x8b partial member")
+            self.out.flush()
+            raise Interrupted()
+
+    monkeypatch.setattr(CompressingWARCWriter, "_add_index", _add_index)
+
+
+def _records(path):
+    """
+    Read the types, target URIs and warcinfo references of the records.
+    """
+    with open(path, "rb") as warc:
+        return [(record.rec_type,
+                 record.rec_headers.get_header("WARC-Target-URI"),
+                 record.rec_headers.get_header("WARC-Record-ID"),
+                 record.rec_headers.get_header("WARC-Warcinfo-ID"))
+                for record in ArchiveIterator(warc)]
+
+
+@pytest.mark.parametrize(["source", "interrupt"], [
+    ("valid_1.1.arc", 1), ("valid_1.1.arc", 2), ("valid_1.1.arc", 3),
+    ("valid_0.17.warc", 1)])
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_resume(source, interrupt, jobs, tmpdir, monkeypatch):
+    """
+    Test that a resumed migration results in the same records as an
+    uninterrupted migration.
+    """
+    source = os.path.join("tests/data", source)
+    expected = str(tmpdir.join("expected.warc.gz"))
+    count = migrate_to_warc(source, expected, ()).count
+    assert interrupt < count
+
+    target = str(tmpdir.join("warc.warc.gz"))
+    with monkeypatch.context() as patch:
+        _interrupt_after(patch, interrupt)
+        # The record IDs of the converted warcinfo records depend on the
+        # time of the conversion
+        make_uuid = ArcTransformer.make_warc_uuid
+        patch.setattr(ArcTransformer, "make_warc_uuid", staticmethod(
+            lambda text: make_uuid(text + b"-interrupted")))
+        with pytest.raises(Interrupted):
+            migrate_to_warc(source, target, (), jobs=jobs,
+                            checkpoint_interval=1)
+    assert os.path.exists(target + ".checkpoint")
+
+    with pytest.raises(OSError):
+        migrate_to_warc(source, target, ())
+    result = migrate_to_warc(source, target, (), jobs=jobs, resume=True,
+                             index="cdxj")
+    assert result.count == count
+    assert not os.path.exists(target + ".checkpoint")
+    assert validate_warc(target) == count
+
+    records = _records(target)
+    assert [record[:2] for record in records] == \
+        [record[:2] for record in _records(expected)]
+    warcinfo_id = records[0][2]
+    assert all(record[3] in (None, warcinfo_id) for record in records)
+    with open(target, "rb") as warc:
+        for record in ArchiveIterator(warc):
+            assert record.rec_headers.get_header(
+                "WARC-Concurrent-To") in (None, warcinfo_id)
+    with open(target + ".cdxj", "r") as index:
+        assert len(index.readlines()) == \
+            len([record for record in records
+                 if record[0] in ("response", "resource")])
+
+
+def test_resume_without_journal(tmpdir):
+    """
+    Test that a target without a checkpoint journal is not overwritten.
+    """
+    target = tmpdir.join("warc.warc.gz")
+    target.write_binary(b"data")
+    with pytest.raises(OSError):
+        migrate_to_warc("tests/data/valid_0.17.warc", str(target), (),
+                        resume=True)
+    assert target.read_binary() == b"data"
+
+
+def test_resume_changed_source(tmpdir):
+    """
+    Test that the migration is not resumed if the source has changed.
+    """
+    source = tmpdir.join("source.warc")
+    source.write_binary(open("tests/data/valid_0.17.warc", "rb").read())
+    target = str(tmpdir.join("warc.warc.gz"))
+    checkpoint = Checkpoint(target + ".checkpoint", str(source), interval=0)
+    checkpoint.reset()
+    checkpoint.update(open(target, "wb"), 1, 100)
+    source.write_binary(b"changed")
+    with pytest.raises(ValueError):
+        migrate_to_warc(str(source), target, (), resume=True)
+
+
+@pytest.mark.parametrize("source", ["valid_1.1.arc", "valid_1.0.warc.gz"])
+@pytest.mark.parametrize("interrupt", [2, 3, 4, 5])
+def test_resume_parts(source, interrupt, tmpdir, monkeypatch):
+    """
+    Test resuming a migration rolled over to part files.
+    """
+    source = os.path.join("tests/data", source)
+    expected = migrate_to_warc(source, str(tmpdir.join("expected.warc.gz")),
+                               (), max_size=1)
+
+    target = str(tmpdir.join("warc.warc.gz"))
+    with monkeypatch.context() as patch:
+        _interrupt_after(patch, interrupt)
+        with pytest.raises(Interrupted):
+            migrate_to_warc(source, target, (), max_size=1,
+                            checkpoint_interval=1)
+
+    result = migrate_to_warc(source, target, (), max_size=1, resume=True,
+                             index="cdxj")
+    assert result.count == expected.count
+    assert [os.path.basename(path) for path in result.parts] == \
+        [os.path.basename(path).replace("expected", "warc")
+         for path in expected.parts]
+    assert not os.path.exists(part_name(target, len(result.parts)))
+    for path, expected_path in zip(result.parts, expected.parts):
+        assert validate_warc(path)
+        records = _records(path)
+        assert [record[:2] for record in records] == \
+            [record[:2] for record in _records(expected_path)]
+        warcinfo_id = records[0][2]
+        assert all(record[3] in (None, warcinfo_id) for record in records)
+
+
+def test_checkpoint_sync(tmpdir):
+    """
+    Test that a checkpoint is not written if the target can not be flushed
+    to disk.
+    """
+    source = "tests/data/valid_0.17.warc"
+    checkpoint = Checkpoint(str(tmpdir.join("journal")), source, interval=0)
+    checkpoint.reset()
+    with pytest.raises(OSError):
+        checkpoint.update(io.BytesIO(), 1, 100)
+    assert tmpdir.join("journal").read() == ""
+
+
+@pytest.mark.parametrize("validation", ["internal", "inline"])
+def test_checkpoint_sync_target(validation, tmpdir, monkeypatch):
+    """
+    Test that the target is flushed to disk before the checkpoints, also
+    when it is verified while it is written.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    synced = []
+    monkeypatch.setattr(checkpoint_module.os, "fsync",
+                        lambda fd: synced.append(os.fstat(fd).st_ino))
+    migrate_to_warc("tests/data/valid_1.1.arc", target, (),
+                    validation=validation, checkpoint_interval=1)
+    assert os.stat(target).st_ino in synced
+
+
+def test_resume_short_target(tmpdir, monkeypatch):
+    """
+    Test that a target shorter than the last checkpoint is not resumed, so
+    that it is not padded with zeros.
+    """
+    source = "tests/data/valid_1.1.arc"
+    target = str(tmpdir.join("warc.warc.gz"))
+    with monkeypatch.context() as patch:
+        _interrupt_after(patch, 3)
+        with pytest.raises(Interrupted):
+            migrate_to_warc(source, target, (), checkpoint_interval=1)
+    offset = Checkpoint(target + ".checkpoint", source).load()["offset"]
+    with open(target, "r+b") as target_handler:
+        target_handler.truncate(offset - 1)
+
+    with pytest.raises(ValueError):
+        migrate_to_warc(source, target, (), resume=True)
+    assert os.path.getsize(target) == offset - 1
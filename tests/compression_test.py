@@ -0,0 +1,267 @@
+"""
+Test the compression of WARC records.
+"""
+import gzip
+from io import BytesIO
+
+import pytest
+from click.testing import CliRunner
+from warcio.archiveiterator import ArchiveIterator
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+from warc_migrator import compression
+from warc_migrator.compression import (BACKENDS, CompressingWARCWriter,
+                                       compress_member, find_member,
+                                       make_compressor, member_ranges,
+                                       resolve_backend, sniff_compression)
+from warc_migrator.migrator import warc_migrator_cli
+from warc_migrator.pipeline import PipelinedWARCWriter
+
+
+def _write_records(writer, count=20):
+    """
+    Write records with fixed headers and payloads of varying sizes.
+    """
+    for i in range(count):
+        headers = StatusAndHeaders("", [
+            ("WARC-Type", "resource"),
+            ("WARC-Record-ID", "<urn:uuid:%08d-0000-0000-0000-000000000000>"
+             % i),
+            ("WARC-Date", "2021-06-15T18:15:00Z"),
+            ("WARC-Target-URI", "file:///%d.txt" % i)], protocol="WARC/1.0")
+        payload = (b"payload %d " % i) * (i * 1000)
+        record = writer.create_warc_record(
+            "file:///%d.txt" % i, "resource", payload=BytesIO(payload),
+            length=len(payload), warc_headers=headers)
+        writer.write_record(record)
+
+
+def test_compress_member():
+    """
+    Test that a compressed member is a single gzip member.
+    """
+    member = compress_member(b"WARC/1.0\r\n")
+    assert gzip.decompress(member) == b"WARC/1.0\r\n"
+
+
+@pytest.mark.parametrize("jobs", [1, 2, 4])
+def test_compressing_writer(jobs):
+    """
+    Test that the output is identical with Warcio's gzipping writer
+    regardless of the number of compression threads.
+    """
+    expected = BytesIO()
+    _write_records(WARCWriter(expected, gzip=True, warc_version="1.0"))
+
+    out = BytesIO()
+    writer = CompressingWARCWriter(out, jobs=jobs, warc_version="1.0")
+    _write_records(writer)
+    writer.close()
+
+    assert out.getvalue() == expected.getvalue()
+    out.seek(0)
+    assert len(list(ArchiveIterator(out))) == 20
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("level", [0, 1, 6, 9])
+def test_compression_settings(backend, level):
+    """
+    Test that all the compression settings produce a valid gzip member.
+    """
+    data = b"WARC/1.0\r\n" * 1000
+    member = compress_member(data, level, backend)
+    assert gzip.decompress(member) == data
+    assert resolve_backend(backend) in ("zlib", "zlib-ng", "isal")
+
+
+def test_missing_backend(monkeypatch, tmpdir):
+    """
+    Test that a missing optional backend is an error when it is named
+    explicitly, and that only "auto" falls back to zlib.
+    """
+    monkeypatch.setattr(compression, "_import_backend", lambda module: None)
+    assert resolve_backend("auto") == "zlib"
+    assert resolve_backend("zlib") == "zlib"
+    for backend in ("isal", "zlib-ng"):
+        with pytest.raises(ValueError) as err:
+            resolve_backend(backend)
+        assert "not installed" in str(err.value)
+        with pytest.raises(ValueError):
+            CompressingWARCWriter(BytesIO(), backend=backend)
+
+    result = CliRunner().invoke(warc_migrator_cli, [
+        "tests/data/valid_0.17.warc", str(tmpdir.join("warc.warc.gz")),
+        "--compression-backend", "isal"])
+    assert result.exit_code == 2
+    assert "Compression backend isal is not installed." in result.output
+    assert not tmpdir.join("warc.warc.gz").exists()
+
+
+def test_compression_level():
+    """
+    Test that the compression level affects the result.
+    """
+    words = [b"alpha", b"beta", b"gamma", b"delta", b"epsilon", b"zeta"]
+    data = b" ".join(words[(i * i) % 7 % 6] for i in range(100000))
+    assert len(compress_member(data, 1)) > len(compress_member(data, 9))
+    assert len(compress_member(data, 0)) > len(data)
+
+
+def test_invalid_compression_settings():
+    """
+    Test that invalid settings are rejected.
+    """
+    with pytest.raises(ValueError):
+        resolve_backend("lzma")
+    with pytest.raises(ValueError):
+        make_compressor(10)
+    with pytest.raises(ValueError):
+        CompressingWARCWriter(BytesIO(), level=-1)
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_compressing_writer_settings(jobs):
+    """
+    Test the writer with a non-default compression level and backend.
+    """
+    out = BytesIO()
+    writer = CompressingWARCWriter(out, jobs=jobs, level=1, backend="auto",
+                                   warc_version="1.0")
+    _write_records(writer)
+    writer.close()
+    out.seek(0)
+    assert len(list(ArchiveIterator(out))) == 20
+
+
+@pytest.mark.parametrize(
+    ["infile", "layout"],
+    [
+        ("valid_1.0.warc.gz", "multi-member"),
+        ("invalid_0.17_incorrectly_compressed.warc.gz", "single-member"),
+        ("valid_0.17.warc", "uncompressed"),
+        ("valid_1.0.arc", "uncompressed"),
+    ]
+)
+def test_sniff_compression(infile, layout):
+    """
+    Test resolving the compression layout from the start of the file.
+    """
+    with open("tests/data/" + infile, "rb") as source:
+        assert sniff_compression(source) == layout
+        assert source.tell() == 0
+
+
+def test_sniff_compression_large():
+    """
+    Test resolving the compression layout of files with a first record
+    spanning several read blocks.
+    """
+    out = BytesIO()
+    writer = WARCWriter(out, gzip=False, warc_version="1.0")
+    _write_records(writer, count=100)
+    content = out.getvalue()
+
+    assert sniff_compression(BytesIO(gzip.compress(content))) == \
+        "single-member"
+    out = BytesIO()
+    writer = CompressingWARCWriter(out, warc_version="1.0")
+    _write_records(writer, count=100)
+    assert sniff_compression(BytesIO(out.getvalue())) == "multi-member"
+
+
+def test_compressing_writer_spool(tmpdir):
+    """
+    Test that records larger than the spool size are buffered in temporary
+    files without changing the output.
+    """
+    expected = BytesIO()
+    _write_records(WARCWriter(expected, gzip=True, warc_version="1.0"))
+
+    out = BytesIO()
+    writer = CompressingWARCWriter(out, jobs=4, spool_size=1024,
+                                   warc_version="1.0")
+    assert writer._create_temp_file()._max_size == 1024
+    _write_records(writer)
+    writer.close()
+    assert out.getvalue() == expected.getvalue()
+
+
+@pytest.mark.parametrize("size", [1, 50000, 10 ** 9])
+@pytest.mark.parametrize("garbage", [b"", b"not gzip"])
+def test_member_ranges(size, garbage):
+    """
+    Test cutting a multi-member gzip file at member boundaries.
+    """
+    out = BytesIO()
+    _write_records(CompressingWARCWriter(out, warc_version="1.0"))
+    records = ArchiveIterator(BytesIO(out.getvalue()))
+    offsets = [records.get_record_offset() for _ in records] + \
+        [len(out.getvalue())]
+    content = out.getvalue() + garbage
+
+    ranges = list(member_ranges(BytesIO(content), offsets[1], len(content),
+                                size))
+    assert ranges[0][0] == offsets[1]
+    assert ranges[-1][1] == len(content)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert start in offsets
+    for start, end in ranges[:-1]:
+        assert end - start >= size
+    if size == 1:
+        assert len(ranges) == len(offsets) - 2
+
+
+def test_member_ranges_stored_member():
+    """
+    Test that a gzip member stored uncompressed inside a record is found as
+    a member when the file is cut into ranges.
+    """
+    inner = BytesIO()
+    _write_records(CompressingWARCWriter(inner, warc_version="1.0"), 1)
+    out = BytesIO()
+    writer = CompressingWARCWriter(out, level=0, warc_version="1.0")
+    writer.write_record(writer.create_warc_record(
+        "http://example.com/inner.warc.gz", "resource",
+        payload=BytesIO(b"x" * 100 + inner.getvalue() + b"x" * 100),
+        warc_content_type="application/warc"))
+    _write_records(writer, 2)
+    writer.close()
+    content = BytesIO(out.getvalue())
+    records = ArchiveIterator(content)
+    offsets = [0]
+    for _ in records:
+        records.read_to_end()
+        offsets.append(records.get_record_offset() +
+                       records.get_record_length())
+    inner_offset = out.getvalue().find(inner.getvalue())
+
+    assert len(offsets) == 4
+    assert find_member(content, 1, offsets[-1]) == inner_offset
+    assert find_member(content, inner_offset + 1, offsets[-1]) == \
+        offsets[1]
+    assert list(member_ranges(content, 0, offsets[-1], 1)) == [
+        (0, inner_offset), (inner_offset, offsets[1]),
+        (offsets[1], offsets[2]), (offsets[2], offsets[3])]
+
+
+@pytest.mark.parametrize("jobs", [1, 2, 4])
+def test_pipelined_writer(jobs):
+    """
+    Test that the output is identical with the compressing writer.
+    """
+    expected = BytesIO()
+    writer = CompressingWARCWriter(expected, jobs=jobs, warc_version="1.0")
+    _write_records(writer)
+    writer.close()
+
+    out = BytesIO()
+    writer = PipelinedWARCWriter(out, jobs=jobs, warc_version="1.0")
+    _write_records(writer)
+    assert writer.reached(1)
+    assert not writer.reached(len(expected.getvalue()) + 1)
+    writer.close()
+    assert out.getvalue() == expected.getvalue()
+    assert writer.records == 20
@@ -0,0 +1,56 @@
+"""
+Test the synthetic corpus of the benchmarks.
+"""
+import pytest
+from warcio.archiveiterator import ArchiveIterator
+
+from benchmarks.corpus import DEFAULT_LAYOUTS, generate_corpus, write_file
+from warc_migrator.migrator import migrate_to_warc
+
+
+def test_generate_corpus(tmpdir):
+    """
+    Test that the corpus files are migrated with all their records,
+    including the records with non-ASCII status lines.
+    """
+    corpus = generate_corpus(str(tmpdir.join("corpus")), records=20,
+                             size=100)
+    assert len(corpus) == len(DEFAULT_LAYOUTS)
+    for source in corpus:
+        target = str(tmpdir.join(source["format"] + source["compression"] +
+                                 ".warc.gz"))
+        count = migrate_to_warc(source["path"], target, ()).count
+        # ARC files have also the migrated metadata record
+        assert count == source["records"] + \
+            source["format"].startswith("arc")
+
+        with open(target, "rb") as warc:
+            statuslines = [record.http_headers.statusline
+                           for record in ArchiveIterator(warc)
+                           if record.rec_type == "response"]
+        assert len(statuslines) == 20
+        assert statuslines.count("200 Hyv\u00e4 tulos") == 2
+
+
+def test_write_file_reproducible(tmpdir):
+    """
+    Test that the same seed produces the same file.
+    """
+    paths = [str(tmpdir.mkdir(str(number)).join("warc.warc.gz"))
+             for number in range(3)]
+    for path, seed in zip(paths, [1, 1, 2]):
+        write_file(path, "warc-0.18", "multi-member", records=5, size=1000,
+                   seed=seed)
+    contents = [open(path, "rb").read() for path in paths]
+    assert contents[0] == contents[1]
+    assert contents[0] != contents[2]
+
+
+def test_write_file_invalid(tmpdir):
+    """
+    Test that unknown formats and compressions are rejected.
+    """
+    with pytest.raises(ValueError):
+        write_file(str(tmpdir.join("x")), "warc-1.0")
+    with pytest.raises(ValueError):
+        write_file(str(tmpdir.join("x")), "warc-0.18", "bzip2")
@@ -0,0 +1,276 @@
+"""
+Test the deduplication of response records with a digest index.
+"""
+import io
+import os
+
+import pytest
+from warcio.archiveiterator import ArchiveIterator
+
+from warc_migrator.batch import migrate_batch
+from warc_migrator.compression import CompressingWARCWriter
+from warc_migrator.dedup import DigestIndex
+from warc_migrator.metrics import Metrics
+from warc_migrator.migrator import migrate_to_warc
+from warc_migrator.validator import validate_warc
+from warc_migrator.warc_fixer import WarcFixer
+
+
+def _response(uri, body, record_id):
+    """
+    Serialize a WARC 0.18 HTTP response record.
+    """
+    block = (b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n"
+             b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+    return (b"WARC/0.18\r\nWARC-Type: response\r\n"
+            b"WARC-Record-ID: <urn:uuid:%s>\r\n"
+            b"WARC-Target-URI: %s\r\n"
+            b"WARC-Date: 2020-01-01T00:00:00Z\r\n"
+            b"Content-Type: application/http; msgtype=response\r\n"
+            b"Content-Length: %d\r\n\r\n%s\r\n\r\n" % (
+                record_id, uri, len(block), block))
+
+
+def _warc(*responses):
+    """
+    Serialize a WARC 0.18 file with a warcinfo record and the given
+    responses.
+    """
+    fields = b"software: test\r\nformat: WARC File Format 0.18\r\n"
+    warcinfo = (b"WARC/0.18\r\nWARC-Type: warcinfo\r\n"
+                b"WARC-Record-ID: <urn:uuid:0>\r\n"
+                b"WARC-Date: 2020-01-01T00:00:00Z\r\n"
+                b"Content-Type: application/warc-fields\r\n"
+                b"Content-Length: %d\r\n\r\n%s\r\n\r\n" % (
+                    len(fields), fields))
+    return warcinfo + b"".join(responses)
+
+
+def test_digest_index(tmpdir):
+    """
+    Test that the records are found in the index while they are pending,
+    and by other migrations only after they have been committed.
+    """
+    path = str(tmpdir.join("digests.sqlite"))
+    index = DigestIndex(path)
+    other = DigestIndex(path)
+    index.add("sha1:A", "<urn:uuid:1>", "http://a/", "2020", "a.warc.gz")
+    index.add("sha1:A", "<urn:uuid:2>", "http://b/", "2021", "a.warc.gz")
+    assert index.lookup("sha1:A") == ("<urn:uuid:1>", "http://a/", "2020")
+    assert index.lookup("sha1:A", "<urn:uuid:1>") is None
+    assert other.lookup("sha1:A") is None
+
+    index.commit()
+    other.add("sha1:B", "<urn:uuid:3>", "http://c/", "2020", "b.warc.gz")
+    assert other.lookup("sha1:A") == ("<urn:uuid:1>", "http://a/", "2020")
+    other.close()
+    index.close()
+
+    # The pending records of the closed index are discarded
+    index = DigestIndex(path)
+    assert index.lookup("sha1:A") is not None
+    assert index.lookup("sha1:B") is None
+    index.close()
+
+
+@pytest.mark.parametrize("rewrite", [True, False])
+def test_fix_warc_dedup(tmpdir, rewrite):
+    """
+    Test that a response with the payload of an earlier response is
+    written as a revisit record referring to it, with only the HTTP
+    headers in its block, and that empty payloads are not deduplicated.
+    """
+    source = _warc(_response(b"http://a/", b"same", b"1"),
+                   _response(b"http://b/", b"same", b"2"),
+                   _response(b"http://c/", b"", b"3"),
+                   _response(b"http://d/", b"", b"4"))
+    target = str(tmpdir.join("target.warc.gz"))
+    metrics = Metrics()
+    index = DigestIndex(str(tmpdir.join("digests.sqlite")))
+    warc_fixer = WarcFixer({}, "target.warc.gz", metrics=metrics,
+                           rewrite=rewrite, dedup=index)
+    with open(target, "wb") as target_handler:
+        assert warc_fixer.fix_warc_original(io.BytesIO(source),
+                                            target_handler) == 5
+    index.close()
+    assert validate_warc(target) == 5
+    assert "warc_migrator_deduplicated_records_total 1" in metrics.render()
+
+    with open(target, "rb") as target_handler:
+        records = [(record.rec_type, record.rec_headers,
+                    record.content_stream().read())
+                   for record in ArchiveIterator(target_handler)]
+    assert [rec_type for rec_type, _, _ in records] == [
+        "warcinfo", "response", "revisit", "response", "response"]
+    _, original, _ = records[1]
+    _, revisit, payload = records[2]
+    assert payload == b""
+    assert revisit.get_header("WARC-Record-ID") == "<urn:uuid:2>"
+    assert revisit.get_header("WARC-Profile") == \
+        "http://netpreserve.org/warc/1.0/revisit/identical-payload-digest"
+    assert revisit.get_header("WARC-Refers-To") == "<urn:uuid:1>"
+    assert revisit.get_header("WARC-Refers-To-Target-URI") == "http://a/"
+    assert revisit.get_header("WARC-Refers-To-Date") == \
+        "2020-01-01T00:00:00Z"
+    assert revisit.get_header("WARC-Payload-Digest") == \
+        original.get_header("WARC-Payload-Digest")
+
+
+@pytest.mark.parametrize("validation", ["internal", "inline"])
+def test_migrate_dedup_index(tmpdir, validation):
+    """
+    Test that the responses of a migration refer to the records of an
+    earlier migration with the same index.
+    """
+    index = str(tmpdir.join("digests.sqlite"))
+    for name in ("first", "second"):
+        tmpdir.join(name + ".warc").write_binary(
+            _warc(_response(b"http://a/", b"same", b"1" + name.encode())))
+        migrate_to_warc(str(tmpdir.join(name + ".warc")),
+                        str(tmpdir.join(name + ".warc.gz")), [],
+                        validation=validation, dedup_index=index)
+
+    with open(str(tmpdir.join("second.warc.gz")), "rb") as target:
+        record = list(ArchiveIterator(target))[1]
+    assert record.rec_type == "revisit"
+    assert record.rec_headers.get_header("WARC-Refers-To") == \
+        "<urn:uuid:1first>"
+
+
+def test_migrate_batch_dedup(tmpdir):
+    """
+    Test the deduplication of the files of a batch with a shared index.
+    """
+    sources = []
+    for name in ("a", "b", "c"):
+        tmpdir.join(name + ".warc").write_binary(
+            _warc(_response(b"http://a/", b"same", name.encode())))
+        sources.append(str(tmpdir.join(name + ".warc")))
+
+    index = str(tmpdir.join("digests.sqlite"))
+    report = migrate_batch(sources, str(tmpdir.mkdir("targets")), [],
+                           workers=1, dedup_index=index)
+    assert [result["count"] for result in report] == [2, 2, 2]
+    rec_types = []
+    for result in report:
+        with open(result["target"], "rb") as target:
+            rec_types.append(list(ArchiveIterator(target))[1].rec_type)
+    assert rec_types == ["response", "revisit", "revisit"]
+
+
+def test_digest_index_target(tmpdir):
+    """
+    Test that the records of an earlier migration of the same target are
+    not found, and that they are replaced on commit.
+    """
+    path = str(tmpdir.join("digests.sqlite"))
+    index = DigestIndex(path, target="/a.warc.gz")
+    index.add("sha1:A", "<urn:uuid:1>", "http://a/", "2020", "a.warc.gz")
+    index.commit()
+    index.close()
+
+    index = DigestIndex(path, target="/a.warc.gz")
+    other = DigestIndex(path, target="/b.warc.gz")
+    assert index.lookup("sha1:A") is None
+    assert other.lookup("sha1:A") == ("<urn:uuid:1>", "http://a/", "2020")
+    index.add("sha1:A", "<urn:uuid:2>", "http://a/", "2021", "a.warc.gz")
+    index.commit()
+    assert other.lookup("sha1:A") == ("<urn:uuid:2>", "http://a/", "2021")
+    other.close()
+    index.close()
+
+
+@pytest.mark.parametrize("source", ["valid_0.17.warc", "valid_1.0.arc",
+                                    "valid_1.1.arc"])
+def test_migrate_dedup_again(source, tmpdir):
+    """
+    Test that migrating the same target again, after the earlier target
+    has been deleted, does not write revisit records of the deleted
+    records.
+    """
+    source = os.path.join("tests/data", source)
+    index = str(tmpdir.join("digests.sqlite"))
+    target = str(tmpdir.join("target.warc.gz"))
+    rec_types = []
+    for _ in range(2):
+        if os.path.exists(target):
+            os.remove(target)
+        migrate_to_warc(source, target, [], dedup_index=index)
+        with open(target, "rb") as target_handler:
+            rec_types.append([record.rec_type for record
+                              in ArchiveIterator(target_handler)])
+    assert "revisit" not in rec_types[1]
+    assert rec_types[1] == rec_types[0]
+
+
+@pytest.mark.parametrize("source", ["valid_0.17.warc", "valid_1.0.arc",
+                                    "valid_1.1.arc"])
+def test_migrate_dedup_other_target(source, tmpdir):
+    """
+    Test that migrating a source into another target with the same index
+    does not write revisit records referring to themselves, as the records
+    keep their WARC-Record-IDs.
+    """
+    source = os.path.join("tests/data", source)
+    index = str(tmpdir.join("digests.sqlite"))
+    records = []
+    for name in ("first", "second"):
+        target = str(tmpdir.join(name + ".warc.gz"))
+        migrate_to_warc(source, target, [], dedup_index=index)
+        with open(target, "rb") as target_handler:
+            records.append([
+                (record.rec_type,
+                 record.rec_headers.get_header("WARC-Record-ID"),
+                 record.rec_headers.get_header("WARC-Refers-To"))
+                for record in ArchiveIterator(target_handler)])
+    assert [record[0] for record in records[1]] == \
+        [record[0] for record in records[0]]
+    assert all(record_id != refers_to
+               for _, record_id, refers_to in records[1])
+
+
+def test_migrate_dedup_resume(tmpdir, monkeypatch):
+    """
+    Test that the originals written before a migration was resumed are
+    added to the index, and that their duplicates written after the resume
+    are revisit records referring to them.
+    """
+    class Interrupted(Exception):
+        """
+        Simulated interruption of the migration.
+        """
+
+    add_index = CompressingWARCWriter._add_index
+
+    def _add_index(self, entry, length):
+        add_index(self, entry, length)
+        if self.records == 3:
+            raise Interrupted()
+
+    tmpdir.join("source.warc").write_binary(
+        _warc(_response(b"http://a/", b"same", b"1"),
+              _response(b"http://b/", b"other", b"2"),
+              _response(b"http://c/", b"same", b"3")))
+    source = str(tmpdir.join("source.warc"))
+    target = str(tmpdir.join("target.warc.gz"))
+    index = str(tmpdir.join("digests.sqlite"))
+    with monkeypatch.context() as patch:
+        patch.setattr(CompressingWARCWriter, "_add_index", _add_index)
+        with pytest.raises(Interrupted):
+            migrate_to_warc(source, target, [], checkpoint_interval=1,
+                            dedup_index=index)
+
+    assert migrate_to_warc(source, target, [], resume=True,
+                           dedup_index=index).count == 4
+    with open(target, "rb") as target_handler:
+        records = list(ArchiveIterator(target_handler))
+    assert [record.rec_type for record in records] == [
+        "warcinfo", "response", "response", "revisit"]
+    assert records[3].rec_headers.get_header("WARC-Refers-To") == \
+        "<urn:uuid:1>"
+
+    other = DigestIndex(index, target="/other.warc.gz")
+    assert other.lookup(
+        records[1].rec_headers.get_header("WARC-Payload-Digest")) == (
+            "<urn:uuid:1>", "http://a/", "2020-01-01T00:00:00Z")
+    other.close()
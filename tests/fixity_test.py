@@ -0,0 +1,168 @@
+"""
+Test the fixity digests of the source and target files of a migration.
+"""
+import hashlib
+import io
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from warc_migrator.batch import migrate_batch
+from warc_migrator.compression import CompressingWARCWriter
+from warc_migrator.fixity import FixityReader, FixityWriter, make_digesters
+from warc_migrator.migrator import migrate_to_warc, warc_migrator_cli
+
+
+def _digests(path, algorithms=("md5", "sha256")):
+    """
+    Compute the digests of a file in a separate pass.
+    """
+    with open(path, "rb") as handler:
+        data = handler.read()
+    return {name: hashlib.new(name, data).hexdigest() for name in algorithms}
+
+
+def test_fixity_reader(tmpdir):
+    """
+    Test that the digests of a file are computed once in order, also when
+    parts of the file are read again, skipped or left unread.
+    """
+    path = tmpdir.join("source")
+    path.write_binary(b"".join(b"line %d\n" % number
+                               for number in range(10000)))
+    with FixityReader(open(str(path), "rb")) as reader:
+        assert reader.readline() == b"line 0\n"
+        assert reader.read(100)
+        reader.seek(3)
+        assert reader.read(10) == b"e 0\nline 1"
+        reader.seek(1000, io.SEEK_CUR)
+        buff = bytearray(500)
+        assert reader.readinto(buff) == 500
+        assert reader.tell() == 1513
+    assert reader.digests() == _digests(str(path))
+
+
+def test_fixity_writer(tmpdir):
+    """
+    Test that the digests of a target include the bytes already in the
+    file, e.g. of a resumed part file.
+    """
+    path = str(tmpdir.join("target"))
+    with open(path, "wb") as target:
+        target.write(b"written before")
+    with open(path, "r+b") as target:
+        target.seek(0, os.SEEK_END)
+        writer = FixityWriter(target, ["sha1"])
+        writer.write(b" and after")
+        writer.close()
+    assert writer.digests() == _digests(path, ["sha1"])
+
+
+def test_unknown_algorithm():
+    """
+    Test that an unknown algorithm is rejected before the migration.
+    """
+    with pytest.raises(ValueError):
+        make_digesters(["md5", "crc32"])
+    with pytest.raises(ValueError):
+        migrate_to_warc("tests/data/valid_1.1.arc", "target.warc.gz", [],
+                        fixity=["crc32"])
+
+
+@pytest.mark.parametrize("source", ["valid_1.1.arc", "valid_0.17.warc",
+                                    "valid_1.0.warc.gz"])
+@pytest.mark.parametrize("options", [
+    {}, {"streaming": False}, {"mmap": True}, {"pipeline": True},
+    {"passthrough": True}, {"max_size": 1, "validation": "inline"}])
+def test_migrate_fixity(source, options, tmpdir):
+    """
+    Test that the digests of the source and the target files are the same
+    as the digests computed from the files, and that the manifest lists
+    them relative to its directory.
+    """
+    source = os.path.join("tests/data", source)
+    target = str(tmpdir.join("warc.warc.gz"))
+    result = migrate_to_warc(source, target, [], fixity_manifest=True,
+                             **options)
+    assert list(result.fixity) == [source] + result.parts
+    for path, digests in result.fixity.items():
+        assert digests == _digests(path)
+
+    with open(target + ".manifest", "r") as manifest:
+        lines = manifest.read().splitlines()
+    assert len(lines) == 2 * len(result.fixity)
+    assert "SHA256 (warc.warc.gz) = %s" % \
+        result.fixity[target]["sha256"] in lines
+
+
+def test_migrate_fixity_resume(tmpdir, monkeypatch):
+    """
+    Test the digests of a resumed migration rolled over to part files.
+    """
+    class Interrupted(Exception):
+        """
+        Simulated interruption of the migration.
+        """
+
+    add_index = CompressingWARCWriter._add_index
+
+    def _add_index(self, entry, length):
+        add_index(self, entry, length)
+        if self.records == 3:
+            raise Interrupted()
+
+    source = "tests/data/valid_1.1.arc"
+    target = str(tmpdir.join("warc.warc.gz"))
+    with monkeypatch.context() as patch:
+        patch.setattr(CompressingWARCWriter, "_add_index", _add_index)
+        with pytest.raises(Interrupted):
+            migrate_to_warc(source, target, [], max_size=1,
+                            checkpoint_interval=1)
+
+    result = migrate_to_warc(source, target, [], max_size=1, resume=True,
+                             fixity=["sha512"])
+    assert len(result.parts) > 1
+    for path in [source] + result.parts:
+        assert result.fixity[path] == _digests(path, ["sha512"])
+
+
+def test_migrate_without_fixity(tmpdir):
+    """
+    Test that no digests are computed by default.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    result = migrate_to_warc("tests/data/valid_0.17.warc", target, [])
+    assert result.fixity is None
+    assert not os.path.exists(target + ".manifest")
+
+
+def test_fixity_cli(tmpdir):
+    """
+    Test that the digests are printed by the command line tool.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    result = CliRunner().invoke(warc_migrator_cli, [
+        "tests/data/valid_0.17.warc", target, "--fixity", "sha1"])
+    assert result.exit_code == 0
+    assert "SHA1 (%s) = %s" % (target, _digests(target, ["sha1"])["sha1"]) \
+        in result.output.splitlines()
+    assert not os.path.exists(target + ".manifest")
+
+
+def test_migrate_batch_fixity(tmpdir):
+    """
+    Test that the manifests of a batch are written next to the targets.
+    """
+    sources = [os.path.join("tests/data", name)
+               for name in ("valid_1.1.arc", "valid_0.17.warc")]
+    report = migrate_batch(sources, str(tmpdir), [], workers=1,
+                           fixity=["md5"], fixity_manifest=True)
+    for source, result in zip(sources, report):
+        with open(result["target"] + ".manifest", "r") as manifest:
+            lines = manifest.read().splitlines()
+        assert lines == [
+            "MD5 (%s) = %s" % (os.path.relpath(os.path.abspath(path),
+                                               str(tmpdir)),
+                               _digests(path, ["md5"])["md5"])
+            for path in (source, result["target"])]
@@ -0,0 +1,122 @@
+"""
+Test the index of the migrated WARC file.
+"""
+import json
+import os
+from io import BytesIO
+
+import pytest
+from warcio.archiveiterator import ArchiveIterator
+
+from warc_migrator.indexer import CdxWriter, surt
+from warc_migrator.migrator import migrate_to_warc
+
+
+@pytest.mark.parametrize(
+    ["uri", "key"],
+    [
+        ("http://www.Example.com/a/B?b=1&a=2", "com,example)/a/b?a=2&b=1"),
+        ("https://example.com", "com,example)/"),
+        ("http://example.com:8080/x", "com,example:8080)/x"),
+        ("http://localhost:80/localfile.txt", "localhost)/localfile.txt"),
+        ("dns:localhost", "dns:localhost"),
+    ]
+)
+def test_surt(uri, key):
+    """
+    Test the canonicalization of URIs.
+    """
+    assert surt(uri) == key
+
+
+def _read_member(path, offset, length):
+    """
+    Read the record in the given member of a WARC file.
+    """
+    with open(path, "rb") as warc:
+        warc.seek(offset)
+        member = warc.read(length)
+    record = next(iter(ArchiveIterator(BytesIO(member))))
+    return record.rec_headers.get_header("WARC-Target-URI")
+
+
+@pytest.mark.parametrize("source", ["valid_1.1.arc", "valid_0.17.warc"])
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_migrate_cdxj(source, jobs, tmpdir):
+    """
+    Test that the CDXJ index points to the records of the target.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    migrate_to_warc(os.path.join("tests/data", source), target, (),
+                    jobs=jobs, index="cdxj")
+
+    with open(target + ".cdxj", "r") as index:
+        lines = index.readlines()
+    assert lines == sorted(lines)
+    assert lines
+    for line in lines:
+        urlkey, timestamp, fields = line.split(" ", 2)
+        fields = json.loads(fields)
+        assert urlkey == surt(fields["url"])
+        assert len(timestamp) == 14
+        assert fields["filename"] == "warc.warc.gz"
+        assert _read_member(target, int(fields["offset"]),
+                            int(fields["length"])) == fields["url"]
+
+
+def test_migrate_cdx(tmpdir):
+    """
+    Test the CDX11 index.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    migrate_to_warc("tests/data/valid_0.17.warc", target, (), index="cdx")
+
+    with open(target + ".cdx", "r") as index:
+        lines = index.readlines()
+    assert lines[0] == " CDX N b a m s k r M S V g\n"
+    fields = lines[1].split()
+    assert fields[:5] == ["localhost)/localfile.txt", "20210615181300",
+                          "http://localhost/localfile.txt", "text/html",
+                          "200"]
+    assert _read_member(target, int(fields[9]), int(fields[8])) == fields[2]
+
+
+@pytest.mark.parametrize("index_format", ["cdxj", "cdx"])
+def test_cdx_writer_runs(index_format, tmpdir):
+    """
+    Test that an index spooled in sorted runs is the same as an index
+    sorted in memory.
+    """
+    entries = [{"urlkey": surt(uri), "timestamp": "2021061518130%d" % second,
+                "url": uri, "mime": "text/html", "status": "200",
+                "digest": "-"}
+               for second in range(3)
+               for uri in ("http://b.com/", "http://a.com/x y",
+                           "http://c.com/", "http://a.com/")]
+    paths = []
+    for max_lines in (1000, 3, 1):
+        path = str(tmpdir.join("index%d" % max_lines))
+        writer = CdxWriter(path, "warc.warc.gz", index_format, max_lines)
+        for offset, entry in enumerate(entries):
+            writer.add(entry, offset, 10)
+        writer.close()
+        paths.append(path)
+
+    with open(paths[0], "r") as index:
+        expected = index.readlines()
+    assert len(expected) == len(entries) + (index_format == "cdx")
+    assert expected[-len(entries):] == sorted(expected[-len(entries):])
+    for path in paths[1:]:
+        with open(path, "r") as index:
+            assert index.readlines() == expected
+
+
+def test_invalid_index_format(tmpdir):
+    """
+    Test that an unknown index format is rejected.
+    """
+    with pytest.raises(ValueError):
+        CdxWriter(str(tmpdir.join("index")), "warc.warc.gz", "json")
+    with pytest.raises(ValueError):
+        migrate_to_warc("tests/data/valid_0.17.warc",
+                        str(tmpdir.join("warc.warc.gz")), (), index="json")
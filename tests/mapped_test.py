@@ -0,0 +1,58 @@
+"""
+Test the memory-mapped input.
+"""
+import gzip
+from io import BytesIO
+
+import pytest
+
+from warc_migrator.mapped import map_file
+from warc_migrator.migrator import ConvertedArcStream, convert
+
+
+def test_map_file(tmpdir):
+    """
+    Test that an uncompressed file is mapped and served as views.
+    """
+    path = tmpdir.join("warc.warc")
+    path.write_binary(b"WARC/1.0\r\n")
+    with map_file(str(path)) as mapped:
+        assert mapped.read(4) == b"WARC"
+        view = mapped.view(5, 100)
+        assert view == b"1.0\r\n"
+        # The map can not be closed until the view is released
+        mapped.close()
+        assert not mapped.closed
+        assert view == b"1.0\r\n"
+        view.release()
+        mapped.close()
+        assert mapped.closed
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_converted_views_released(streaming):
+    """
+    Test that the views of the content of large ARC records are released
+    after the records have been written, so that the map is closed at the
+    end of the conversion.
+    """
+    mapped = map_file("tests/data/valid_1.1.arc")
+    if streaming:
+        with ConvertedArcStream(mapped, spool_size=0) as stream:
+            assert stream.read()
+            assert mapped.closed
+    else:
+        assert convert(mapped, BytesIO(), spool_size=0) == 4
+        assert mapped.closed
+
+
+def test_map_file_not_mapped(tmpdir):
+    """
+    Test that empty and gzip compressed files are not mapped.
+    """
+    empty = tmpdir.join("empty.warc")
+    empty.write_binary(b"")
+    assert map_file(str(empty)) is None
+    compressed = tmpdir.join("warc.warc.gz")
+    compressed.write_binary(gzip.compress(b"WARC/1.0\r\n"))
+    assert map_file(str(compressed)) is None
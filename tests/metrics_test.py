@@ -0,0 +1,187 @@
+"""
+Test the metrics of migrations.
+"""
+import os
+import pickle
+import shutil
+import urllib.request
+
+import pytest
+from click.testing import CliRunner
+
+from warc_migrator import migrator
+from warc_migrator.batch import warc_migrator_batch_cli
+from warc_migrator.metrics import Metrics
+from warc_migrator.migrator import migrate_to_warc, warc_migrator_cli
+from warc_migrator.validator import ValidationError
+
+
+def _samples(metrics):
+    """
+    Parse the samples of rendered metrics.
+
+    :metrics: Metrics
+    :returns: Dict of sample values by the sample name with labels
+    """
+    samples = {}
+    for line in metrics.render().splitlines():
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_render():
+    """
+    Test the Prometheus text format of counters and histograms.
+    """
+    metrics = Metrics()
+    metrics.inc("records_total", 3)
+    metrics.inc("records_total")
+    metrics.inc("source_files_total", format="warc",
+                compression="single-member")
+    metrics.inc("validation_failures_total", tool='a"b\\c')
+    for value in (0.05, 0.3, 0.35, 5.0):
+        metrics.observe("compression_ratio", value)
+
+    text = metrics.render()
+    assert "# TYPE warc_migrator_records_total counter\n" \
+        "warc_migrator_records_total 4\n" in text
+    assert "# TYPE warc_migrator_compression_ratio histogram\n" in text
+    samples = _samples(metrics)
+    assert samples['warc_migrator_source_files_total{'
+                   'compression="single-member",format="warc"}'] == 1
+    assert samples[
+        'warc_migrator_validation_failures_total{tool="a\\"b\\\\c"}'] == 1
+    assert samples['warc_migrator_compression_ratio_bucket{le="0.1"}'] == 1
+    assert samples['warc_migrator_compression_ratio_bucket{le="0.3"}'] == 2
+    assert samples['warc_migrator_compression_ratio_bucket{le="0.4"}'] == 3
+    assert samples['warc_migrator_compression_ratio_bucket{le="2"}'] == 3
+    assert samples['warc_migrator_compression_ratio_bucket{le="+Inf"}'] == 4
+    assert samples["warc_migrator_compression_ratio_count"] == 4
+    assert samples["warc_migrator_compression_ratio_sum"] == \
+        pytest.approx(5.7)
+
+
+def test_merge():
+    """
+    Test merging metrics returned from a worker process.
+    """
+    metrics = Metrics()
+    metrics.inc("records_total", 2)
+    metrics.observe("record_seconds", 0.002)
+    other = pickle.loads(pickle.dumps(metrics))
+    other.inc("migrations_total", result="success")
+    metrics.merge(other)
+
+    samples = _samples(metrics)
+    assert samples["warc_migrator_records_total"] == 4
+    assert samples['warc_migrator_migrations_total{result="success"}'] == 1
+    assert samples['warc_migrator_record_seconds_bucket{le="0.005"}'] == 2
+    assert samples["warc_migrator_record_seconds_count"] == 2
+
+
+def test_write_and_serve(tmpdir):
+    """
+    Test writing the metrics into a file and serving them over HTTP.
+    """
+    metrics = Metrics()
+    metrics.inc("records_total", 5)
+    path = tmpdir.join("warc_migrator.prom")
+    metrics.write(str(path))
+    metrics.write(str(path))
+    assert path.read() == metrics.render()
+    assert tmpdir.listdir() == [path]
+
+    server = metrics.serve(0)
+    try:
+        url = "http://127.0.0.1:%d/metrics" % server.server_address[1]
+        with urllib.request.urlopen(url) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read().decode("utf-8") == metrics.render()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize(
+    ["source", "file_format", "compression"],
+    [("valid_1.1.arc", "arc", "uncompressed"),
+     ("valid_1.0.warc.gz", "warc", "multi-member"),
+     ("invalid_0.17_incorrectly_compressed.warc.gz", "warc",
+      "single-member")]
+)
+def test_migration_metrics(source, file_format, compression, tmpdir):
+    """
+    Test the metrics of a successful migration.
+    """
+    metrics = Metrics()
+    target = tmpdir.join("warc.warc.gz")
+    result = migrate_to_warc("tests/data/" + source, str(target), (),
+                             metrics=metrics)
+
+    samples = _samples(metrics)
+    assert samples['warc_migrator_migrations_total{result="success"}'] == 1
+    assert samples['warc_migrator_source_files_total{compression="%s",'
+                   'format="%s"}' % (compression, file_format)] == 1
+    assert samples["warc_migrator_records_total"] == result.count
+    assert samples["warc_migrator_source_bytes_total"] == \
+        os.path.getsize("tests/data/" + source)
+    assert samples["warc_migrator_target_bytes_total"] == target.size()
+    assert samples["warc_migrator_record_seconds_count"] == result.count
+    assert samples["warc_migrator_compression_ratio_count"] == 1
+    assert samples["warc_migrator_migration_seconds_count"] == 1
+
+
+def test_failure_metrics(tmpdir, monkeypatch):
+    """
+    Test that failed migrations and validations are counted.
+    """
+    metrics = Metrics()
+    empty = tmpdir.join("empty.arc")
+    empty.write("")
+    with pytest.raises(OSError):
+        migrate_to_warc(str(empty), str(tmpdir.join("empty.warc.gz")), (),
+                        metrics=metrics)
+
+    def _fail(path):
+        raise ValidationError("Invalid %s" % path)
+
+    monkeypatch.setattr(migrator, "validate_warc", _fail)
+    with pytest.raises(ValidationError):
+        migrate_to_warc("tests/data/valid_1.0.arc",
+                        str(tmpdir.join("warc.warc.gz")), (),
+                        metrics=metrics)
+
+    samples = _samples(metrics)
+    assert samples['warc_migrator_migrations_total{result="failure"}'] == 2
+    assert samples[
+        'warc_migrator_validation_failures_total{tool="internal"}'] == 1
+    assert "warc_migrator_records_total" not in samples
+
+
+def test_metrics_cli(tmpdir):
+    """
+    Test writing the metrics from the command lines.
+    """
+    metrics_path = tmpdir.join("migration.prom")
+    result = CliRunner().invoke(warc_migrator_cli, [
+        "tests/data/valid_1.0.arc", str(tmpdir.join("warc.warc.gz")),
+        "--metrics-file", str(metrics_path), "--metrics-port", "0"])
+    assert result.exit_code == 0
+    assert 'warc_migrator_migrations_total{result="success"} 1\n' in \
+        metrics_path.read()
+    assert "warc_migrator_records_total 4\n" in metrics_path.read()
+
+    source_dir = tmpdir.mkdir("sources")
+    shutil.copy("tests/data/valid_1.0.arc", str(source_dir))
+    source_dir.join("empty.arc").write("")
+    metrics_path = tmpdir.join("batch.prom")
+    result = CliRunner().invoke(warc_migrator_batch_cli, [
+        str(source_dir), str(tmpdir.join("targets")), "--workers", "2",
+        "--metrics-file", str(metrics_path)])
+    assert result.exit_code == 1
+    text = metrics_path.read()
+    assert 'warc_migrator_migrations_total{result="failure"} 1\n' in text
+    assert 'warc_migrator_migrations_total{result="success"} 1\n' in text
+    assert "warc_migrator_record_seconds_count 4\n" in text
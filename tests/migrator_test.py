@@ -4,14 +4,19 @@ Test the WARC migrator.
 import base64
 import hashlib
 import os
-import pytest
+import subprocess
+import sys
+from io import BytesIO
 
+import pytest
 from click.testing import CliRunner
 from warcio.archiveiterator import ArchiveIterator
 
+from warc_migrator import migrator, warc_fixer
+from warc_migrator.compression import CompressingWARCWriter
 from warc_migrator.migrator import (migrate_to_warc, run_validation,
                                     ValidationError, warc_migrator_cli,
-                                    is_arc, convert)
+                                    is_arc, convert, ConvertedArcStream)
 
 
 @pytest.mark.parametrize(
@@ -162,3 +167,391 @@ def test_convert(infile, given_count, tmpdir):
     out = tmpdir.mkdir("warc-migrator").join("warc.warc.gz").open("wb")
     count = convert(os.path.join("tests/data", infile), out)
     assert count == given_count
+
+
+@pytest.mark.parametrize(
+    ["infile", "given_count"],
+    [
+        ("valid_1.0.arc", 4),
+        ("valid_1.1.arc", 4),
+        ("invalid_1.0_missing_length.arc", 4)
+    ]
+)
+def test_converted_arc_stream(infile, given_count, tmpdir):
+    """
+    Test that the streamed conversion yields the same records as the
+    conversion into a file.
+    """
+    out_path = str(tmpdir.join("warc.warc"))
+    with open(out_path, "wb") as out:
+        convert(os.path.join("tests/data", infile), out)
+
+    with ConvertedArcStream(os.path.join("tests/data", infile)) as stream:
+        streamed = [(record.rec_type, record.raw_stream.read())
+                    for record in ArchiveIterator(stream)]
+        assert stream.count == given_count
+
+    with open(out_path, "rb") as stream:
+        converted = [(record.rec_type, record.raw_stream.read())
+                     for record in ArchiveIterator(stream)]
+
+    assert streamed == converted
+
+
+@pytest.mark.parametrize("spool_size", [0, 1024])
+def test_converted_arc_stream_mmap(spool_size):
+    """
+    Test that the streamed conversion of a memory-mapped ARC file yields
+    the same records, with the content of the large records read from the
+    map.
+    """
+    infile = "tests/data/valid_1.1.arc"
+    with ConvertedArcStream(infile, spool_size) as stream:
+        expected = [(record.rec_type, record.raw_stream.read())
+                    for record in ArchiveIterator(stream)]
+
+    with ConvertedArcStream(infile, spool_size, mmap=True) as stream:
+        streamed = [(record.rec_type, record.raw_stream.read())
+                    for record in ArchiveIterator(stream)]
+        assert stream.count == 4
+
+    assert streamed == expected
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_migrate_arc_streaming(streaming, tmpdir):
+    """
+    Test ARC migration with and without the intermediate temporary file.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    count = migrate_to_warc("tests/data/valid_1.1.arc", target, (),
+                            streaming=streaming)
+    assert count == 4
+    with open(target, "rb") as stream:
+        assert [record.rec_type for record in ArchiveIterator(stream)] == \
+            ["warcinfo", "metadata", "response", "response"]
+
+
+@pytest.mark.parametrize("source", ["valid_1.1.arc", "valid_0.17.warc"])
+def test_migrate_jobs(source, tmpdir):
+    """
+    Test migration with several compression threads.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    result = migrate_to_warc(os.path.join("tests/data", source), target, (),
+                             jobs=4)
+    with open(target, "rb") as stream:
+        assert len(list(ArchiveIterator(stream))) == result.count
+
+
+@pytest.mark.parametrize("source", ["valid_1.1.arc", "valid_0.17.warc"])
+def test_migrate_compression_settings(source, tmpdir):
+    """
+    Test migration with a non-default compression level and backend.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    result = migrate_to_warc(os.path.join("tests/data", source), target, (),
+                             compression_level=1, compression_backend="auto")
+    with open(target, "rb") as stream:
+        assert len(list(ArchiveIterator(stream))) == result.count
+
+
+def test_migrate_single_member_gzip(tmpdir, monkeypatch):
+    """
+    Test that a WARC file compressed as a single gzip member is migrated
+    in a single pass, without recompressing it into a temporary file.
+    """
+    def _fail(*args, **kwargs):
+        raise AssertionError("Recompression should not be needed.")
+
+    monkeypatch.setattr("warc_migrator.migrator.recompress_warc", _fail)
+    target = str(tmpdir.join("warc.warc.gz"))
+    result = migrate_to_warc(
+        "tests/data/invalid_0.17_incorrectly_compressed.warc.gz", target, ())
+    assert result.count == 2
+
+
+def _write_large_source(path, arc, size):
+    """
+    Write an ARC or WARC 0.17 file with an HTTP response record of the
+    given size in megabytes.
+    """
+    block = b"0123456789abcdef" * 4096
+    http = b"HTTP/1.1 200 OK\r\nContent-Type: video/mp4\r\n\r\n"
+    length = len(http) + size * 16 * len(block)
+    with open(path, "wb") as out:
+        if arc:
+            out.write(b"filedesc://large.arc 0.0.0.0 20210615181500 "
+                      b"text/plain 65\n1 0 Test\nURL IP-address "
+                      b"Archive-date Content-type Archive-length\n\n\n")
+            out.write(b"http://localhost/v.mp4 0.0.0.0 20210615181300 "
+                      b"video/mp4 %d\n" % length)
+        else:
+            out.write(b"WARC/0.17\r\nWARC-Type: response\r\n"
+                      b"WARC-Record-ID: <urn:uuid:1>\r\n"
+                      b"WARC-Date: 2021-06-15T18:13:00Z\r\n"
+                      b"WARC-Target-URI: http://localhost/v.mp4\r\n"
+                      b"Content-Type: application/http; msgtype=response\r\n"
+                      b"Content-Length: %d\r\n\r\n" % length)
+        out.write(http)
+        for _ in range(size * 16):
+            out.write(block)
+        out.write(b"\n" if arc else b"\r\n\r\n")
+
+
+def _peak_memory(source, target, validation, jobs):
+    """
+    Migrate a file in a subprocess and return its peak memory in kilobytes.
+    """
+    script = (
+        "import resource, sys\n"
+        "from warc_migrator.migrator import migrate_to_warc\n"
+        "migrate_to_warc(sys.argv[1], sys.argv[2], (), compression_level=1,"
+        " validation=sys.argv[3], jobs=int(sys.argv[4]))\n"
+        "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n")
+    output = subprocess.check_output(
+        [sys.executable, "-c", script, source, target, validation,
+         str(jobs)])
+    return int(output)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"),
+                    reason="ru_maxrss is in kilobytes only in Linux")
+@pytest.mark.parametrize(
+    ["arc", "validation", "jobs"],
+    [(True, "internal", 1), (True, "inline", 4), (False, "inline", 4)]
+)
+def test_migrate_large_record_memory(arc, validation, jobs, tmpdir):
+    """
+    Test that the peak memory use does not grow with the record size.
+    """
+    peaks = []
+    for size in (1, 32):
+        source = str(tmpdir.join("source-%d" % size))
+        _write_large_source(source, arc, size)
+        peaks.append(_peak_memory(source, source + ".warc.gz", validation,
+                                  jobs))
+    assert peaks[1] - peaks[0] < 16 * 1024
+
+
+@pytest.mark.parametrize(
+    ["source", "parts", "repeated"],
+    [("valid_1.1.arc", 3, 4), ("valid_0.17.warc", 2, 1),
+     ("valid_1.0.warc.gz", 4, 3)]
+)
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_migrate_max_size(source, parts, repeated, jobs, tmpdir):
+    """
+    Test that the target is rolled over to part files, each starting with
+    its own warcinfo record, and the ARC metadata record if the source is
+    an ARC file.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    single = migrate_to_warc(os.path.join("tests/data", source),
+                             str(tmpdir.join("single.warc.gz")), ())
+    result = migrate_to_warc(os.path.join("tests/data", source), target, (),
+                             jobs=jobs, max_size=1, validation="inline")
+    assert result.parts == [target] + [
+        str(tmpdir.join("warc-%05d.warc.gz" % part))
+        for part in range(1, parts)]
+    assert result.count == single.count + repeated
+    assert result.verification["records"] == result.count
+
+    for path in result.parts:
+        with open(path, "rb") as stream:
+            records = list(ArchiveIterator(stream))
+        warcinfo = records[0].rec_headers
+        assert records[0].rec_type == "warcinfo"
+        assert warcinfo.get_header("WARC-Filename") == os.path.basename(path)
+        if source.endswith(".arc"):
+            assert records[1].rec_type == "metadata"
+            assert records[1].rec_headers.get_header(
+                "WARC-Concurrent-To") == warcinfo.get_header("WARC-Record-ID")
+        for record in records[1:]:
+            assert record.rec_headers.get_header("WARC-Warcinfo-ID") in \
+                (None, warcinfo.get_header("WARC-Record-ID"))
+
+
+
+def _read(path):
+    """
+    Read a file.
+    """
+    with open(path, "rb") as stream:
+        return stream.read()
+
+
+def _skip_first_member(path):
+    """
+    Read a multi-member gzip file after its first member.
+    """
+    with open(path, "rb") as stream:
+        records = ArchiveIterator(stream)
+        next(records)
+        records.read_to_end()
+        stream.seek(records.get_record_offset() + records.get_record_length())
+        return stream.read()
+
+
+@pytest.mark.parametrize("shards", [2, 3, 8])
+@pytest.mark.parametrize("index", [None, "cdx"])
+def test_migrate_sharded(shards, index, tmpdir):
+    """
+    Test that a multi-member gzip file migrated in shards results in the
+    same target and index as a migration in a single process.
+    """
+    source = tmpdir.join("source.warc.gz")
+    with open("tests/data/valid_1.0.warc.gz", "rb") as warc:
+        source.write_binary(warc.read() * 5)
+    expected = str(tmpdir.join("expected.warc.gz"))
+    target = str(tmpdir.join("warc.warc.gz"))
+    count = migrate_to_warc(str(source), expected, (), index=index).count
+
+    result = migrate_to_warc(str(source), target, (), shards=shards,
+                             index=index, validation="inline")
+    assert result.count == count
+    assert result.verification["records"] == count
+    # Only the date of the warcinfo record in the first member differs
+    assert _skip_first_member(target) == _skip_first_member(expected)
+    if index:
+        first = len(_read(target)) - len(_skip_first_member(target))
+        expected_first = len(_read(expected)) - \
+            len(_skip_first_member(expected))
+        with open(expected + ".cdx") as expected_index, \
+                open(target + ".cdx") as target_index:
+            for expected_line, line in zip(expected_index, target_index):
+                expected_fields = expected_line.split()
+                fields = line.split()
+                if fields[0] == "CDX":
+                    continue
+                assert int(fields[9]) - first == \
+                    int(expected_fields[9]) - expected_first
+                assert fields[:9] == expected_fields[:9]
+
+
+def test_migrate_sharded_inside_member(tmpdir, monkeypatch):
+    """
+    Test that a shard cut inside a gzip member, at a gzip file stored
+    uncompressed in a record, is detected and the rest of the file is
+    migrated without shards.
+    """
+    inner = BytesIO()
+    writer = CompressingWARCWriter(inner, warc_version="1.0")
+    writer.write_record(writer.create_warc_record(
+        "http://example.com/", "resource", payload=BytesIO(b"inner"),
+        warc_content_type="text/plain"))
+    stored = BytesIO()
+    writer = CompressingWARCWriter(stored, level=0, warc_version="1.0")
+    writer.write_record(writer.create_warc_record(
+        "http://example.com/inner.warc.gz", "resource",
+        payload=BytesIO(b"x" * 100 + inner.getvalue() + b"x" * 100),
+        warc_content_type="application/warc"))
+    valid = _read("tests/data/valid_1.0.warc.gz")
+    source = tmpdir.join("source.warc.gz")
+    source.write_binary(valid + stored.getvalue() + valid)
+    fake_cut = len(valid) + stored.getvalue().find(inner.getvalue())
+    size = len(source.read_binary())
+
+    def _member_ranges(source_handler, start, end, shard_size):
+        assert end == size
+        return [(start, fake_cut), (fake_cut, end)]
+
+    expected = str(tmpdir.join("expected.warc.gz"))
+    target = str(tmpdir.join("warc.warc.gz"))
+    count = migrate_to_warc(str(source), expected, ()).count
+    monkeypatch.setattr(warc_fixer, "member_ranges", _member_ranges)
+    result = migrate_to_warc(str(source), target, (), shards=2,
+                             validation="inline")
+    assert result.count == count
+    assert _skip_first_member(target) == _skip_first_member(expected)
+
+
+@pytest.mark.parametrize(
+    "source", ["valid_1.0.warc.gz", "valid_0.17.warc",
+               "invalid_0.17_incorrectly_compressed.warc.gz"])
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_migrate_pipeline(source, jobs, tmpdir):
+    """
+    Test that a WARC file migrated in the pipeline results in the same
+    target as without the pipeline.
+    """
+    expected = str(tmpdir.join("expected.warc.gz"))
+    target = str(tmpdir.join("warc.warc.gz"))
+    count = migrate_to_warc(os.path.join("tests/data", source), expected,
+                            (), jobs=jobs).count
+
+    result = migrate_to_warc(os.path.join("tests/data", source), target, (),
+                             jobs=jobs, pipeline=True, validation="inline")
+    assert result.count == count
+    assert result.verification["records"] == count
+    # Only the date of the warcinfo record in the first member differs
+    assert _skip_first_member(target) == _skip_first_member(expected)
+
+
+@pytest.mark.parametrize(
+    "source", ["valid_1.0.arc", "valid_1.1.arc", "valid_0.17.warc",
+               "valid_1.0.warc.gz"])
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_migrate_mmap(source, pipeline, tmpdir, monkeypatch):
+    """
+    Test that a source read from a memory map results in the same records
+    as a source read from a file. Only uncompressed ARC sources are mapped,
+    WARC and gzip compressed sources are read from the file.
+    """
+    expected = str(tmpdir.join("expected.warc.gz"))
+    target = str(tmpdir.join("warc.warc.gz"))
+    count = migrate_to_warc(os.path.join("tests/data", source), expected,
+                            (), spool_size=1024).count
+
+    mapped = []
+    map_file = migrator.map_file
+
+    def _map_file(path):
+        mapped.append(path)
+        return map_file(path)
+
+    monkeypatch.setattr(migrator, "map_file", _map_file)
+    result = migrate_to_warc(os.path.join("tests/data", source), target, (),
+                             spool_size=1024, pipeline=pipeline, mmap=True,
+                             validation="inline")
+    assert bool(mapped) == source.endswith(".arc")
+    assert result.count == count
+    assert result.verification["records"] == count
+    assert _payloads(target) == _payloads(expected)
+
+
+def _payloads(path):
+    """
+    Read the types and the payloads of the records of a WARC file.
+    """
+    with open(path, "rb") as stream:
+        return [(record.rec_type, record.content_stream().read())
+                for record in ArchiveIterator(stream)]
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_migrate_passthrough(pipeline, tmpdir):
+    """
+    Test that the records of a WARC 1.0 source are copied to the target as
+    they are, after the fixed warcinfo record.
+    """
+    source = "tests/data/valid_1.0.warc.gz"
+    target = str(tmpdir.join("warc.warc.gz"))
+    result = migrate_to_warc(source, target, (), pipeline=pipeline,
+                             passthrough=True, index="cdx",
+                             validation="inline")
+    assert result.count == 4
+    assert result.verification["records"] == 4
+    assert _skip_first_member(target) == _skip_first_member(source)
+    with open(target + ".cdx") as index:
+        assert len(index.read().splitlines()) == 3
+
+
+def test_migrate_sharded_max_size(tmpdir):
+    """
+    Test that shards can not be combined with a maximum size.
+    """
+    with pytest.raises(ValueError):
+        migrate_to_warc("tests/data/valid_1.0.warc.gz",
+                        str(tmpdir.join("warc.warc.gz")), (), shards=2,
+                        max_size=1000)
@@ -0,0 +1,121 @@
+"""
+Test the pipeline of reader, fixer and writer threads.
+"""
+import os
+from io import BytesIO
+
+import pytest
+from warcio.archiveiterator import ArchiveIterator
+
+from warc_migrator.migrator import migrate_to_warc
+from warc_migrator.pipeline import PipelinedWARCWriter, ReadAheadReader
+
+
+class _FailingStream:
+    """
+    Stream failing after the given number of bytes.
+    """
+
+    def __init__(self, data, fail_at):
+        """
+        Initialize stream with its content and the failing offset.
+        """
+        self.stream = BytesIO(data)
+        self.fail_at = fail_at
+
+    def read(self, size=-1):
+        """
+        Read bytes, unless the failing offset has been reached.
+        """
+        if self.stream.tell() >= self.fail_at:
+            raise OSError("Read failed.")
+        return self.stream.read(size)
+
+    def write(self, data):
+        """
+        Write bytes, unless they would pass the failing offset.
+        """
+        if self.stream.tell() + len(data) > self.fail_at:
+            raise OSError("Write failed.")
+        return self.stream.write(data)
+
+    def flush(self):
+        """
+        Nothing to flush.
+        """
+
+
+@pytest.mark.parametrize(["block_size", "depth"], [(1, 1), (10, 2),
+                                                   (4096, 16)])
+def test_read_ahead_reader(block_size, depth):
+    """
+    Test that the stream is read as it is, in reads of any size.
+    """
+    data = bytes(range(256)) * 40
+    reader = ReadAheadReader(BytesIO(data), block_size, depth)
+    parts = [reader.read(7), reader.read(0)]
+    buff = bytearray(1000)
+    parts.append(bytes(buff[:reader.readinto(buff)]))
+    parts.append(reader.read())
+    assert b"".join(parts) == data
+    assert reader.read(7) == b""
+    reader.close()
+
+
+def test_read_ahead_reader_error():
+    """
+    Test that an error of the underlying stream is raised in the consumer.
+    """
+    reader = ReadAheadReader(_FailingStream(b"x" * 100, 50), 10)
+    assert reader.read(50) == b"x" * 10
+    with pytest.raises(OSError):
+        reader.read()
+    reader.close()
+
+
+def test_read_ahead_reader_close():
+    """
+    Test that the reader thread is stopped when the stream is closed before
+    its end, and the underlying stream is left open.
+    """
+    stream = BytesIO(b"x" * 1000)
+    reader = ReadAheadReader(stream, 1, 1)
+    assert reader.read(1) == b"x"
+    reader.close()
+    assert reader.closed
+    assert not stream.closed
+
+
+def test_pipelined_writer_error():
+    """
+    Test that an error of the writer thread is raised in the caller.
+    """
+    writer = PipelinedWARCWriter(_FailingStream(b"", 1000),
+                                 warc_version="1.0")
+    payload = os.urandom(10000)
+    record = writer.create_warc_record(
+        "file:///random", "resource", payload=BytesIO(payload),
+        length=len(payload))
+    with pytest.raises(OSError):
+        try:
+            writer.write_record(record)
+        finally:
+            writer.close()
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_migrate_arc_pipeline(streaming, tmpdir):
+    """
+    Test ARC migration in the pipeline, with the conversion timed in the
+    reader thread, and rolled over to part files.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    result = migrate_to_warc("tests/data/valid_1.1.arc", target, (),
+                             streaming=streaming, pipeline=True,
+                             max_size=1, index="cdxj")
+    assert len(result.parts) == 3
+    assert result.count == 8
+    assert result.stats["stages"]["convert"]["records"] == 4
+    with open(target, "rb") as stream:
+        assert [record.rec_type for record in ArchiveIterator(stream)] == \
+            ["warcinfo", "metadata"]
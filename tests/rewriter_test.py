@@ -0,0 +1,167 @@
+"""
+Test the rewriting of the WARC headers of data records as bytes.
+"""
+import gzip
+import os
+from io import BytesIO
+
+import pytest
+from warcio.archiveiterator import ArchiveIterator
+
+from warc_migrator import warc_fixer
+from warc_migrator.indexer import EntryCollector
+from warc_migrator.metrics import Metrics
+from warc_migrator.migrator import migrate_to_warc
+from warc_migrator.rewriter import (MEMORY_BLOCK_SIZE, RawHeaders,
+                                    RawRecord, RecordReader)
+from warc_migrator.warc_fixer import WarcFixer
+
+HTTP = (b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n\r\n"
+        b"<html>hello</html>")
+
+
+def _record(headers, block=HTTP, version=b"WARC/0.18", tail=b"\r\n\r\n"):
+    """
+    Serialize a WARC record with the given header lines.
+    """
+    lines = [version] + headers + [b"Content-Length: %d" % len(block)]
+    return b"\r\n".join(lines) + b"\r\n\r\n" + block + tail
+
+
+def _response(*extra, **kwargs):
+    """
+    Serialize an HTTP response record with additional header lines.
+    """
+    uri = kwargs.pop("uri", b"http://example.com/")
+    return _record([b"WARC-Type: response",
+                    b"WARC-Record-ID: <urn:uuid:1>",
+                    b"WARC-Target-URI: " + uri,
+                    b"WARC-Date: 2020-01-01T00:00:00Z",
+                    b"Content-Type: application/http; msgtype=response"] +
+                   list(extra), **kwargs)
+
+
+def _fix(source, rewrite, indexer=None):
+    """
+    Fix WARC data records and return the target.
+    """
+    target = BytesIO()
+    WarcFixer({}, "warc.warc.gz", indexer=indexer,
+              rewrite=rewrite).fix_warc_original(BytesIO(source), target)
+    return target.getvalue()
+
+
+@pytest.mark.parametrize(["record", "raw"], [
+    (_response(), True),
+    (_response(version=b"WARC/1.0"), True),
+    (_response(b"WARC-Block-Digest: sha1:AAAA",
+               b"WARC-Payload-Digest: sha1:BBBB"), True),
+    (_response(block=HTTP + b"x" * MEMORY_BLOCK_SIZE), True),
+    (_response(tail=b"\r\n"), True),
+    (_record([b"WARC-Type: resource", b"WARC-Target-URI: file:///a",
+              b"Content-Type: text/plain"], b"text"), True),
+    (_record([b"WARC-Type: response", b"WARC-Target-URI: dns:a"],
+             b"20200101 a 192.0.2.1\n"), True),
+    (_record([b"warc-type: response", b"WARC-Target-URI: http://a/"]),
+     True),
+    (_response(b"X-Folded: a", b" b"), False),
+    (_response(b"X-Spaces:  a"), False),
+    (_response(b"Content-Type: text/plain"), False),
+    (_response(uri=b"<http://example.com/>"), False),
+    (_response(block=b"\r\n" + HTTP), False),
+    (_record([b"WARC-Type: revisit", b"WARC-Target-URI: http://a/"]),
+     False),
+])
+def test_record_reader(record, raw):
+    """
+    Test that the records Warcio would serialize again with the same
+    headers are read as bytes, and that they are fixed into the same bytes
+    as the records parsed by Warcio.
+    """
+    records = list(RecordReader(BytesIO(record + _response())))
+    assert isinstance(records[0], RawRecord) is raw
+    assert isinstance(records[1], RawRecord)
+
+    source = gzip.compress(record) + gzip.compress(_response())
+    parsed_index, rewritten_index = EntryCollector(), EntryCollector()
+    assert _fix(source, True, rewritten_index) == \
+        _fix(source, False, parsed_index)
+    assert rewritten_index.entries == parsed_index.entries
+
+
+class _ParsingReader(RecordReader):
+    """
+    RecordReader which parses all the records with Warcio.
+    """
+
+    @property
+    def rewrite(self):
+        """
+        The records are never rewritten as bytes.
+        """
+        return False
+
+    @rewrite.setter
+    def rewrite(self, value):
+        """
+        Ignore the setting of the fixer.
+        """
+
+
+def _skip_warcinfo(path):
+    """
+    Read a migrated file after the gzip member of its warcinfo record,
+    whose date differs between migrations.
+    """
+    with open(path, "rb") as stream:
+        records = ArchiveIterator(stream)
+        next(records)
+        records.read_to_end()
+        stream.seek(records.get_record_offset() + records.get_record_length())
+        return stream.read()
+
+
+@pytest.mark.parametrize("source", sorted(os.listdir("tests/data")))
+def test_rewrite_parse_identical(source, tmpdir, monkeypatch):
+    """
+    Test that the records rewritten as bytes are migrated into the same
+    target as the records parsed by Warcio, for each test file.
+    """
+    source = os.path.join("tests/data", source)
+    rewritten = str(tmpdir.join("rewritten.warc.gz"))
+    parsed = str(tmpdir.join("parsed.warc.gz"))
+    metrics = Metrics()
+    count = migrate_to_warc(source, rewritten, (), metrics=metrics).count
+    assert "warc_migrator_rewritten_records_total 0" not in metrics.render()
+    with monkeypatch.context() as patch:
+        patch.setattr(warc_fixer, "RecordReader", _ParsingReader)
+        assert migrate_to_warc(source, parsed, ()).count == count
+    assert _skip_warcinfo(rewritten) == _skip_warcinfo(parsed)
+
+
+def test_raw_headers():
+    """
+    Test reading and changing the headers as Warcio's StatusAndHeaders.
+    """
+    lines = [b"WARC-Type: response\r\n", b"X-Id: <urn:uuid:1>\r\n",
+             b"x-id: <urn:uuid:2>\r\n"]
+    headers = RawHeaders(lines, {b"warc-type": 0, b"x-id": 1})
+    assert headers.get_header("x-ID") == "<urn:uuid:1>"
+    assert headers.get_header("X-Missing", "-") == "-"
+
+    headers.replace_header("X-Id", "<urn:uuid:3>")
+    headers.add_header("X-New", "new")
+    assert headers.to_bytes() == (
+        b"WARC/1.0\r\nWARC-Type: response\r\nX-Id: <urn:uuid:1>\r\n"
+        b"x-id: <urn:uuid:3>\r\nX-New: new\r\n\r\n")
+
+
+def test_fix_warc_rewrite_metrics():
+    """
+    Test that the records rewritten as bytes are counted in the metrics.
+    """
+    metrics = Metrics()
+    warc_fixer = WarcFixer({}, "warc.warc.gz", metrics=metrics)
+    with open("tests/data/valid_0.17.warc", "rb") as filein:
+        assert warc_fixer.fix_warc_original(filein, BytesIO()) == 2
+    assert "warc_migrator_rewritten_records_total 1" in metrics.render()
@@ -0,0 +1,72 @@
+"""
+Test the scan of archive files.
+"""
+import gzip
+import os
+
+import pytest
+
+from warc_migrator.scan import SCAN_FIELDS, scan_batch, scan_file
+
+
+@pytest.mark.parametrize(
+    ["source", "file_format", "version", "compression", "records",
+     "non_ascii"],
+    [
+        ("valid_1.0.arc", "arc", "1.0", "uncompressed", 3, 0),
+        ("valid_1.1.arc", "arc", "1.1", "uncompressed", 3, 0),
+        ("invalid_1.0_missing_length.arc", "arc", "1.0", "uncompressed", 3,
+         0),
+        ("valid_0.17.warc", "warc", "0.17", "uncompressed", 2, 0),
+        ("valid_0.17_scandinavian.warc", "warc", "0.17", "uncompressed", 2,
+         1),
+        ("valid_1.0.warc.gz", "warc", "1.0", "multi-member", 4, 0),
+        ("invalid_0.17_incorrectly_compressed.warc.gz", "warc", "0.17",
+         "single-member", 2, 0),
+    ]
+)
+def test_scan_file(source, file_format, version, compression, records,
+                   non_ascii):
+    """
+    Test the scanned format, version, compression layout and counts.
+    """
+    path = os.path.join("tests/data", source)
+    result = scan_file(path)
+    assert tuple(result) == SCAN_FIELDS
+    assert result["error"] is None
+    assert result["format"] == file_format
+    assert result["version"] == version
+    assert result["compression"] == compression
+    assert result["records"] == records
+    assert result["non_ascii_status"] == non_ascii
+    assert result["bytes"] == os.path.getsize(path)
+
+
+def test_scan_single_member_arc(tmpdir):
+    """
+    Test that an ARC file compressed as a single gzip member is detected
+    from the failure of reading it record by record.
+    """
+    source = tmpdir.join("arc.arc.gz")
+    with open("tests/data/valid_1.1.arc", "rb") as arc:
+        source.write_binary(gzip.compress(arc.read()))
+    result = scan_file(str(source))
+    assert result["error"] is None
+    assert result["version"] == "1.1"
+    assert result["compression"] == "single-member"
+    assert result["records"] == 3
+
+
+def test_scan_batch(tmpdir):
+    """
+    Test that a batch is scanned in order and failing files are reported
+    without stopping the scan of the other files.
+    """
+    empty = tmpdir.join("empty.warc")
+    empty.write("")
+    sources = ["tests/data/valid_1.0.arc", str(empty),
+               "tests/data/valid_0.17.warc"]
+    inventory = scan_batch(sources, workers=2)
+    assert [result["source"] for result in inventory] == sources
+    assert [result["records"] for result in inventory] == [3, None, 2]
+    assert inventory[1]["error"] == "Empty source file."
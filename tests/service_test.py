@@ -0,0 +1,185 @@
+"""
+Test the migration service.
+"""
+import json
+import os
+import socket
+import threading
+from io import StringIO
+
+import pytest
+from click.testing import CliRunner
+
+from warc_migrator import batch
+from warc_migrator.metrics import Metrics
+from warc_migrator.service import (MigrationService, parse_job,
+                                   warc_migrator_service_cli)
+
+
+def _job(tmpdir, job_id, source, **fields):
+    """
+    Create a job line migrating a file of the test data.
+    """
+    job = {"id": job_id, "source": "tests/data/" + source,
+           "target": str(tmpdir.join("%s.warc.gz" % job_id))}
+    job.update(fields)
+    return json.dumps(job) + "\n"
+
+
+def _results(lines):
+    """
+    Parse result lines into a dict by job id.
+    """
+    results = {}
+    for line in lines:
+        result = json.loads(line)
+        results[result["id"]] = result
+    return results
+
+
+def test_parse_job():
+    """
+    Test parsing a valid job line.
+    """
+    job_id, job = parse_job(json.dumps({
+        "id": "a", "source": "a.arc", "target": "a.warc.gz",
+        "meta": [["k1", "v1"]], "options": {"index": "cdx"}}), True)
+    assert job_id == "a"
+    assert job == ("a.arc", "a.warc.gz", (("k1", "v1"),), True,
+                   {"index": "cdx"})
+    assert parse_job(b'{"source": "a", "target": "b"}') == \
+        (None, ("a", "b", (), False, {}))
+
+
+@pytest.mark.parametrize(
+    ["line", "error"],
+    [("[1]", "not a JSON object"),
+     ('{"source": "a"}', "Missing target"),
+     ('{"source": "a", "target": "b", "meta": [["k"]]}', "meta fields"),
+     ('{"source": "a", "target": "b", "options": {"progress": true}}',
+      "Unknown options progress"),
+     ("{", "Expecting")]
+)
+def test_parse_invalid_job(line, error):
+    """
+    Test that invalid job lines are rejected.
+    """
+    with pytest.raises(ValueError) as exc:
+        parse_job(line)
+    assert error in str(exc.value)
+
+
+def test_serve_lines(tmpdir):
+    """
+    Test migrating jobs read as lines.
+    """
+    metrics = Metrics()
+    metrics_path = tmpdir.join("service.prom")
+    service = MigrationService(2, metrics=metrics,
+                               metrics_file=str(metrics_path))
+    out = StringIO()
+    try:
+        service.serve_lines([
+            _job(tmpdir, 1, "valid_1.0.arc"), "\n", "not json\n",
+            _job(tmpdir, 2, "valid_0.17.warc", meta=[["k1", "v1"]],
+                 options={"index": "cdxj"}),
+            _job(tmpdir, 3, "missing.arc")], out)
+    finally:
+        service.close()
+
+    results = _results(out.getvalue().splitlines())
+    assert len(results) == 4
+    assert results[1]["count"] == 4
+    assert results[1]["error"] is None
+    assert results[2]["count"] == 2
+    assert tmpdir.join("2.warc.gz.cdxj").isfile()
+    assert "No such file" in results[3]["error"]
+    assert results[None]["error"].startswith("Invalid job")
+    assert 'migrations_total{result="success"} 2\n' in metrics_path.read()
+
+
+def test_socket(tmpdir):
+    """
+    Test migrating jobs sent over a Unix socket.
+    """
+    path = str(tmpdir.join("service.sock"))
+    tmpdir.join("service.sock").write("")
+    service = MigrationService(2)
+    with pytest.raises(OSError):
+        service.create_server(path)  # Not a socket, not replaced
+    tmpdir.join("service.sock").remove()
+    server = service.create_server(path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        for _ in range(2):
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            with client, client.makefile("rb") as results:
+                client.sendall(_job(tmpdir, 1, "valid_1.0.arc").encode())
+                # The result is sent before the client has closed its end
+                assert json.loads(results.readline())["count"] == 4
+                tmpdir.join("1.warc.gz").remove()
+                client.sendall(
+                    (_job(tmpdir, 2, "valid_0.17.warc") + "\xe4\n").encode(
+                        "latin-1"))
+                client.shutdown(socket.SHUT_WR)
+                lines = results.readlines()
+            tmpdir.join("2.warc.gz").remove()
+            results = _results(lines)
+            assert results[2]["count"] == 2
+            assert results[None]["error"].startswith("Invalid job")
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        service.close()
+
+    # A stale socket of a previous run is replaced
+    service.create_server(path).server_close()
+
+
+def test_service_cli(tmpdir):
+    """
+    Test the command line interface reading jobs from stdin.
+    """
+    result = CliRunner().invoke(
+        warc_migrator_service_cli, ["--workers", "2"],
+        input=_job(tmpdir, 1, "valid_1.0.arc") +
+        _job(tmpdir, 2, "valid_1.1.arc"))
+    assert result.exit_code == 0
+    results = _results(result.output.splitlines())
+    assert [results[1]["count"], results[2]["count"]] == [4, 4]
+    assert list(results[1]) == ["id", "source", "target", "count", "error",
+                                "seconds"]
+
+
+def test_worker_crash(tmpdir, monkeypatch):
+    """
+    Test that the service keeps migrating jobs after a worker process has
+    died during a job.
+    """
+    migrate_to_warc = batch.migrate_to_warc
+
+    def _crash(source_path, *args, **kwargs):
+        if source_path.endswith("valid_1.0.arc"):
+            os._exit(1)  # pylint: disable=protected-access
+        return migrate_to_warc(source_path, *args, **kwargs)
+
+    # The worker processes are forked with the patched function
+    monkeypatch.setattr(batch, "migrate_to_warc", _crash)
+    service = MigrationService(1)
+    results = []
+    try:
+        for job_id, source in ((1, "valid_1.0.arc"), (2, "valid_1.1.arc"),
+                               (3, "valid_0.17.warc")):
+            service.submit(_job(tmpdir, job_id, source),
+                           results.append).wait()
+    finally:
+        service.close()
+
+    assert results[0]["id"] == 1
+    assert results[0]["error"]
+    assert [(result["id"], result["error"]) for result in results[1:]] == \
+        [(2, None), (3, None)]
+    assert all(result["count"] for result in results[1:])
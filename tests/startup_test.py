@@ -0,0 +1,52 @@
+"""
+Test that the heavy dependencies are imported only when needed.
+"""
+import json
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.startup import HEAVY_PACKAGES, MODULES, ROOT, import_time
+
+# Generous upper bound of the import time of a command line module, which
+# only guards against regressions such as importing Warctools at start-up
+IMPORT_BUDGET = 0.5
+
+_MIGRATE_SCRIPT = """
+import json, sys
+from warc_migrator.migrator import migrate_to_warc
+migrate_to_warc({source!r}, {target!r}, (), validation="inline")
+print(json.dumps(sorted({{name.split(".")[0] for name in sys.modules}} &
+                        set({packages!r}))))
+"""
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_import(module):
+    """
+    Test that the command line modules import no heavy packages and are
+    imported within the budget.
+    """
+    seconds, loaded = import_time(module, repeat=3)
+    assert loaded == []
+    assert seconds < IMPORT_BUDGET
+
+
+@pytest.mark.parametrize(
+    ["source", "loaded"],
+    [("valid_1.0.warc.gz", []),
+     ("valid_1.1.arc", ["hanzo", "lxml"])]
+)
+def test_migration_imports(tmpdir, source, loaded):
+    """
+    Test that a WARC migration does not need the heavy packages, and an ARC
+    migration loads them.
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-c", _MIGRATE_SCRIPT.format(
+            source="tests/data/" + source,
+            target=str(tmpdir.join("target.warc.gz")),
+            packages=HEAVY_PACKAGES)],
+        cwd=ROOT)
+    assert json.loads(output.decode("utf-8")) == loaded
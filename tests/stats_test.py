@@ -0,0 +1,93 @@
+"""
+Test the statistics and progress display of a migration.
+"""
+import json
+import time
+from io import StringIO
+
+import pytest
+from click.testing import CliRunner
+
+from warc_migrator.migrator import migrate_to_warc, warc_migrator_cli
+from warc_migrator.stats import Progress, Stats
+
+
+def test_nested_stages():
+    """
+    Test that the time of a nested stage is excluded from the stage around
+    it.
+    """
+    stats = Stats()
+    with stats.stage("write"):
+        time.sleep(0.05)
+        with stats.stage("convert"):
+            time.sleep(0.1)
+        time.sleep(0.05)
+    stats.add("write", size=1000, records=2)
+
+    result = stats.as_dict()
+    write = result["stages"]["write"]
+    convert = result["stages"]["convert"]
+    assert 0.1 <= write["wall_seconds"] < 0.15
+    assert 0.1 <= convert["wall_seconds"] < 0.15
+    assert write["bytes"] == 1000
+    assert write["records_per_s"] == pytest.approx(
+        2 / write["wall_seconds"])
+    assert result["wall_seconds"] >= write["wall_seconds"] + \
+        convert["wall_seconds"]
+
+
+def test_progress():
+    """
+    Test the progress display.
+    """
+    out = StringIO()
+    progress = Progress(out, interval=10)
+    progress.update(250, 1000, 10, 2.0)
+    progress.update(500, 1000, 20, 4.0)  # Too soon, not shown
+    progress.finish(40, 3725)
+    lines = out.getvalue().split("\r")[1:]
+    assert lines[0].startswith(" 25.0% 10 records, 5.0 records/s, "
+                               "0.0 MB/s, ETA 0:00:06")
+    assert lines[1] == "40 records in 1:02:05".ljust(79) + "\n"
+
+
+@pytest.mark.parametrize(
+    ["source", "streaming", "stages"],
+    [("valid_1.1.arc", True, ["convert", "write", "validate"]),
+     ("valid_1.1.arc", False, ["convert", "write", "validate"]),
+     ("valid_0.17.warc", True, ["write", "validate"]),
+     ("invalid_0.17_incorrectly_compressed.warc.gz", True,
+      ["write", "validate"])]
+)
+def test_migration_stats(source, streaming, stages, tmpdir):
+    """
+    Test the statistics of the stages of a migration.
+    """
+    progress = Progress(StringIO())
+    result = migrate_to_warc("tests/data/" + source,
+                             str(tmpdir.join("warc.warc.gz")), (),
+                             streaming=streaming, index="cdxj",
+                             progress=progress)
+    stats = result.stats
+    assert sorted(stats["stages"]) == sorted(stages + ["index"])
+    assert stats["records"] == result.count
+    assert stats["stages"]["write"]["records"] == result.count
+    assert stats["stages"]["write"]["bytes"] == \
+        tmpdir.join("warc.warc.gz").size()
+    assert stats["stages"]["validate"]["records"] == result.count
+    assert progress.out.getvalue().endswith("\n")
+
+
+def test_stats_json(tmpdir):
+    """
+    Test writing the statistics from the command line.
+    """
+    stats_path = tmpdir.join("stats.json")
+    result = CliRunner().invoke(warc_migrator_cli, [
+        "tests/data/valid_1.0.arc", str(tmpdir.join("warc.warc.gz")),
+        "--progress", "--stats-json", str(stats_path)])
+    assert result.exit_code == 0
+    stats = json.loads(stats_path.read())
+    assert stats["records"] == 4
+    assert list(stats["stages"]) == ["write", "convert", "validate"]
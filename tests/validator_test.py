@@ -0,0 +1,276 @@
+"""
+Test the in-process WARC validation.
+"""
+import base64
+import gzip
+import hashlib
+import os
+import pytest
+
+from warc_migrator.migrator import migrate_to_warc, run_validation
+from warc_migrator.validator import (ValidationError, VerifyingWriter,
+                                     validate_warc)
+
+
+@pytest.mark.parametrize(
+    ["infile", "given_count"],
+    [
+        ("valid_1.0.warc.gz", 4),
+        ("valid_1.0_warctools_resulted.warc", 4),
+        ("valid_0.17.warc", 2),
+    ]
+)
+def test_validate_warc(infile, given_count):
+    """
+    Test validation of valid files.
+    """
+    assert validate_warc(os.path.join("tests/data", infile)) == given_count
+
+
+@pytest.mark.parametrize(
+    "source", ["valid_1.0.arc", "valid_1.1.arc", "valid_0.17.warc",
+               "invalid_0.17_incorrectly_compressed.warc.gz"]
+)
+def test_validate_migrated(source, tmpdir):
+    """
+    Test that the migrated files are valid both in-process and with the
+    external validation tools.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    result = migrate_to_warc(os.path.join("tests/data", source), target, (),
+                             validation="external")
+    assert validate_warc(target) == result.count
+
+
+def _write_invalid(tmpdir, content, compress=False):
+    """
+    Write the given content into a file, optionally as a single gzip member.
+    """
+    path = tmpdir.join("invalid.warc.gz" if compress else "invalid.warc")
+    if compress:
+        content = gzip.compress(content)
+    path.write_binary(content)
+    return str(path)
+
+
+def test_validate_invalid_digest(tmpdir):
+    """
+    Test that a changed block is detected with the digests.
+    """
+    with gzip.open("tests/data/valid_1.0.warc.gz", "rb") as infile:
+        content = infile.read().replace(b"Test description",
+                                        b"Test descriptioN")
+    path = _write_invalid(tmpdir, content)
+    with pytest.raises(ValidationError) as err:
+        validate_warc(path)
+    assert "Digest errors" in str(err.value)
+    with pytest.raises(ValidationError):
+        run_validation("warcio", path)
+
+
+def test_validate_non_chunked_gzip(tmpdir):
+    """
+    Test that a WARC file compressed as a single gzip member is invalid.
+    """
+    with open("tests/data/valid_1.0_warctools_resulted.warc", "rb") as infile:
+        path = _write_invalid(tmpdir, infile.read(), compress=True)
+    with pytest.raises(ValidationError) as err:
+        validate_warc(path)
+    assert "Non-chunked gzip" in str(err.value)
+    with pytest.raises(ValidationError):
+        run_validation("warcio", path)
+
+
+def test_validate_truncated(tmpdir):
+    """
+    Test that truncated files are invalid.
+    """
+    with open("tests/data/valid_1.0.warc.gz", "rb") as infile:
+        content = infile.read()
+    path = _write_invalid(tmpdir, content[:-100])
+    with pytest.raises(ValidationError):
+        validate_warc(path)
+
+    with open("tests/data/valid_1.0_warctools_resulted.warc", "rb") as infile:
+        content = infile.read()
+    path = _write_invalid(tmpdir, content[:-100])
+    with pytest.raises(ValidationError):
+        validate_warc(path)
+    with pytest.raises(ValidationError):
+        run_validation("warctools", path)
+
+
+def test_validate_missing_file():
+    """
+    Test that a missing file is invalid.
+    """
+    with pytest.raises(ValidationError):
+        validate_warc("tests/data/invalid_1.0.warc")
+
+
+@pytest.mark.parametrize(
+    "source", ["valid_1.0.arc", "valid_1.1.arc", "valid_0.17.warc",
+               "valid_0.17_scandinavian.warc",
+               "invalid_0.17_incorrectly_compressed.warc.gz"]
+)
+def test_migrate_inline_validation(source, tmpdir):
+    """
+    Test that the target is verified while it is written.
+    """
+    target = str(tmpdir.join("warc.warc.gz"))
+    result = migrate_to_warc(os.path.join("tests/data", source), target, (),
+                             validation="inline")
+    assert result.verification["records"] == result.count
+    assert result.verification["digests"] >= result.count
+    assert result.verification["bytes"] == os.path.getsize(target)
+    assert validate_warc(target) == result.count
+
+
+def _gzip_members(path):
+    """
+    Recompress the records of an uncompressed WARC file each into its own
+    gzip member.
+    """
+    with gzip.open(path, "rb") as infile:
+        content = infile.read()
+    return [gzip.compress(b"WARC/1.0\r\n" + record)
+            for record in content.split(b"WARC/1.0\r\n")[1:]]
+
+
+def test_verifying_writer(tmpdir):
+    """
+    Test that VerifyingWriter passes valid output through as is.
+    """
+    members = _gzip_members("tests/data/valid_1.0.warc.gz")
+    out = tmpdir.join("out.warc.gz").open("wb")
+    writer = VerifyingWriter(out)
+    for member in members:
+        for i in range(0, len(member), 7):
+            writer.write(member[i:i + 7])
+    writer.flush()
+    assert writer.summary() == {"records": 4, "digests": 7,
+                                "bytes": sum(len(m) for m in members)}
+
+
+@pytest.mark.parametrize(
+    ["change", "error"],
+    [
+        (lambda members: [gzip.compress(gzip.decompress(members[0]).replace(
+            b"Test description", b"Test descriptioN"))],
+         "WARC-Block-Digest failed"),
+        (lambda members: [gzip.compress(b"".join(
+            gzip.decompress(member) for member in members))],
+         "Extra data after record"),
+        (lambda members: [members[0][:-6] + b"\x00" * 6],
+         "Invalid gzip member"),
+        (lambda members: [b"not gzip"], "Invalid gzip member"),
+    ]
+)
+def test_verifying_writer_invalid(change, error, tmpdir):
+    """
+    Test that VerifyingWriter detects invalid output.
+    """
+    members = change(_gzip_members("tests/data/valid_1.0.warc.gz"))
+    writer = VerifyingWriter(tmpdir.join("out.warc.gz").open("wb"))
+    with pytest.raises(ValidationError) as err:
+        for member in members:
+            writer.write(member)
+    assert error in str(err.value)
+
+
+def test_verifying_writer_large_member(tmpdir):
+    """
+    Test verification of a large member written at once.
+    """
+    block = b"0123456789abcdef" * 65536
+    record = (b"WARC/1.0\r\nWARC-Type: resource\r\n"
+              b"WARC-Record-ID: <urn:uuid:1>\r\n"
+              b"WARC-Block-Digest: sha1:%s\r\n"
+              b"Content-Length: %d\r\n\r\n%s\r\n\r\n" % (
+                  base64.b32encode(hashlib.sha1(block).digest()),
+                  len(block), block))
+    member = gzip.compress(record)
+    writer = VerifyingWriter(tmpdir.join("out.warc.gz").open("wb"))
+    writer.write(member + member)
+    assert writer.summary() == {"records": 2, "digests": 2,
+                                "bytes": 2 * len(member)}
+
+
+@pytest.mark.parametrize(["block_digest", "verified"], [
+    (lambda block: base64.b32encode(hashlib.sha1(block).digest()), 1),
+    (lambda block: base64.b16encode(hashlib.sha1(block).digest()).lower(),
+     1),
+    (lambda block: base64.b64encode(hashlib.sha1(block).digest()), 1),
+    (lambda block: base64.b32encode(hashlib.sha1(block + b" ").digest()),
+     None)], ids=["base32", "base16", "base64", "changed"])
+def test_verifying_writer_revisit(block_digest, verified, tmpdir):
+    """
+    Test that the block digest of a revisit record is verified in the
+    encodings of RFC 3548, and its payload digest of the original record
+    is not.
+    """
+    block = b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n"
+    record = (b"WARC/1.0\r\nWARC-Type: revisit\r\n"
+              b"WARC-Record-ID: <urn:uuid:1>\r\n"
+              b"WARC-Target-URI: http://example.com/\r\n"
+              b"WARC-Block-Digest: sha1:%s\r\n"
+              b"WARC-Payload-Digest: sha1:%s\r\n"
+              b"Content-Length: %d\r\n\r\n%s\r\n\r\n" % (
+                  block_digest(block),
+                  base64.b32encode(hashlib.sha1(b"original").digest()),
+                  len(block), block))
+    writer = VerifyingWriter(tmpdir.join("out.warc.gz").open("wb"))
+    if verified is None:
+        with pytest.raises(ValidationError) as err:
+            writer.write(gzip.compress(record))
+        assert "WARC-Block-Digest failed" in str(err.value)
+        return
+    writer.write(gzip.compress(record))
+    assert writer.summary()["digests"] == verified
+
+
+@pytest.mark.parametrize("block", [
+    b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n \r\npayload\n",
+    b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n",
+    b"HTTP/1.1 200 OK\r\n" + b"0123456789abcdef" * 131072],
+    ids=["headers", "no-end", "large"])
+@pytest.mark.parametrize("step", [1, 7, None])
+def test_verifying_writer_http_headers(block, step, tmpdir):
+    """
+    Test that the payload of an HTTP response starts after the first blank
+    line, also when the line is split between writes, and that a block
+    without one is all HTTP headers with an empty payload, as for the
+    validation with Warcio.
+    """
+    end = block.find(b"\r\n \r\n")
+    payload = block[end + 5:] if end > -1 else b""
+    record = (b"WARC/1.0\r\nWARC-Type: response\r\n"
+              b"WARC-Record-ID: <urn:uuid:1>\r\n"
+              b"WARC-Target-URI: http://example.com/\r\n"
+              b"WARC-Date: 2020-01-01T00:00:00Z\r\n"
+              b"Content-Type: application/http; msgtype=response\r\n"
+              b"WARC-Block-Digest: sha1:%s\r\n"
+              b"WARC-Payload-Digest: sha1:%s\r\n"
+              b"Content-Length: %d\r\n\r\n%s\r\n\r\n" % (
+                  base64.b32encode(hashlib.sha1(block).digest()),
+                  base64.b32encode(hashlib.sha1(payload).digest()),
+                  len(block), block))
+    member = gzip.compress(record)
+    path = tmpdir.join("out.warc.gz")
+    writer = VerifyingWriter(path.open("wb"))
+    for i in range(0, len(member), step or len(member)):
+        writer.write(member[i:i + (step or len(member))])
+    writer.flush()
+    assert writer.summary()["digests"] == 2
+    assert validate_warc(str(path)) == 1
+
+
+def test_verifying_writer_incomplete(tmpdir):
+    """
+    Test that an incomplete last member is detected.
+    """
+    members = _gzip_members("tests/data/valid_1.0.warc.gz")
+    writer = VerifyingWriter(tmpdir.join("out.warc.gz").open("wb"))
+    writer.write(members[0][:-4])
+    with pytest.raises(ValidationError):
+        writer.summary()
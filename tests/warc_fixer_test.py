@@ -1,11 +1,16 @@
 """
 Test WARC fixing methods
 """
+import gzip
 import os
 import pytest
 from warcio.statusandheaders import StatusAndHeaders
 from warcio.archiveiterator import ArchiveIterator
-from warc_migrator.warc_fixer import WarcFixer
+from benchmarks.corpus import write_file
+from warc_migrator.metrics import Metrics
+from warc_migrator.compression import MemberBoundaryError
+from warc_migrator.migrator import convert
+from warc_migrator.warc_fixer import METADATA_BLOCK_SIZE, WarcFixer, fix_shard
 
 
 @pytest.mark.parametrize(
@@ -157,3 +162,110 @@ def test_extract_arc_metadata():
     assert warc_fixer.source.warcinfo["date"] == ["2021-06-15T18:15:00+00:00"]
     assert warc_fixer.source.warcinfo["software"] == ["Test Crawler"]
     assert len(warc_fixer.source.warcinfo) == 8
+
+
+def test_fix_large_arc_metadata(tmpdir):
+    """
+    Test fixing an ARC file header with XML metadata read in several
+    blocks.
+    """
+    arc_path = str(tmpdir.join("metadata.arc"))
+    converted = tmpdir.join("converted.warc")
+    write_file(arc_path, "arc-1.1", records=1, size=100,
+               metadata_size=3 * METADATA_BLOCK_SIZE)
+    with converted.open("wb") as out:
+        convert(arc_path, out)
+
+    target = tmpdir.join("warc.warc.gz")
+    warc_fixer = WarcFixer({}, "warc.warc.gz")
+    with converted.open("rb") as source, target.open("wb") as out:
+        assert warc_fixer.fix_warc_migrated(source, out) == 3
+
+    subjects = warc_fixer.source.warcinfo["subject"]
+    assert len(subjects) > 3 * METADATA_BLOCK_SIZE // 100
+    with target.open("rb") as warc:
+        records = list((record.rec_type, record.content_stream().read())
+                       for record in ArchiveIterator(warc))
+    assert records[0][1].count(b"subject: ") == len(subjects)
+    assert records[1][0] == "metadata"
+    assert records[1][1] == warc_fixer.source.metadata
+    assert records[1][1].endswith(b"</arcmetadata>\n")
+
+
+def _members(path):
+    """
+    Read the gzip members of the records of a multi-member gzip file.
+    """
+    with open(path, "rb") as warc:
+        data = warc.read()
+        warc.seek(0)
+        records = ArchiveIterator(warc)
+        members = []
+        for _ in records:
+            records.read_to_end()
+            offset = records.get_record_offset()
+            members.append(data[offset:offset +
+                                records.get_record_length()])
+    return members
+
+
+@pytest.mark.parametrize("corrupt", [False, True])
+def test_fix_warc_passthrough(corrupt, tmpdir):
+    """
+    Test that the gzip members of the WARC 1.0 records are copied as they
+    are, other than the warcinfo record and a record with a failed digest.
+    """
+    source = "tests/data/valid_1.0.warc.gz"
+    members = _members(source)
+    if corrupt:
+        record = gzip.decompress(members[2])
+        members[2] = gzip.compress(record.replace(b"\r\n\r\n",
+                                                  b"\r\n\r\nX", 1)[:-1])
+        source = str(tmpdir.join("corrupt.warc.gz"))
+        with open(source, "wb") as warc:
+            warc.write(b"".join(members))
+
+    target = str(tmpdir.join("warc.warc.gz"))
+    metrics = Metrics()
+    warc_fixer = WarcFixer({}, "warc.warc.gz", passthrough=True,
+                           metrics=metrics)
+    with open(source, "rb") as filein, open(target, "wb") as out:
+        assert warc_fixer.fix_warc_original(filein, out) == 4
+
+    copied = _members(target)
+    assert copied[0] != members[0]
+    assert copied[1] == members[1]
+    assert (copied[2] == members[2]) is not corrupt
+    assert copied[3] == members[3]
+    assert metrics.render().count(
+        "warc_migrator_copied_records_total %d" % (2 if corrupt else 3)) == 1
+
+
+def test_fix_shard_inside_member(tmpdir):
+    """
+    Test that a shard ending inside a gzip member, at a gzip file stored
+    uncompressed in a record, is rejected while it is fixed, and that the
+    shards cut at the member boundaries are fixed.
+    """
+    inner = gzip.compress(b"WARC/1.0\r\nWARC-Type: resource\r\n\r\n")
+    payload = b"x" * 100 + inner + b"x" * 100
+    stored = gzip.compress(
+        b"WARC/1.0\r\nWARC-Type: resource\r\n"
+        b"WARC-Record-ID: <urn:uuid:1>\r\n"
+        b"WARC-Date: 2020-01-01T00:00:00Z\r\n"
+        b"Content-Type: application/warc\r\n"
+        b"Content-Length: %d\r\n\r\n%s\r\n\r\n" % (len(payload), payload),
+        compresslevel=0)
+    with open("tests/data/valid_1.0.warc.gz", "rb") as valid:
+        source = stored + valid.read()
+    path = str(tmpdir.join("source.warc.gz"))
+    with open(path, "wb") as out:
+        out.write(source)
+
+    with pytest.raises(MemberBoundaryError):
+        fix_shard(path, 0, stored.find(inner))
+    for start, end, count in [(0, len(stored), 1),
+                              (len(stored), len(source), 4)]:
+        shard_path, records, _ = fix_shard(path, start, end)
+        os.remove(shard_path)
+        assert records == count
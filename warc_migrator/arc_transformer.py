@@ -0,0 +1,139 @@
+"""
+Conversion of ARC records to WARC records with bounded memory use.
+"""
+import io
+
+from hanzo.arc2warc import ArcTransformer, is_http_response
+from hanzo.httptools import RequestMessage, ResponseMessage
+from hanzo.httptools.messaging import ZipLengthReader
+from hanzo.warctools.arc import ArcRecord
+from hanzo.warctools.warc import WarcRecord
+
+from warc_migrator.archive_handler import ChunkStream
+from warc_migrator.compression import (COPY_BLOCK_SIZE, DEFAULT_SPOOL_SIZE,
+                                       create_spool)
+from warc_migrator.mapped import MappedFile
+
+
+class SpoolingArcTransformer(ArcTransformer):
+    """
+    Warctools' ArcTransformer, which does not load the content of ARC
+    records larger than the spool size into memory.
+
+    Warctools reads the whole content of each record into memory when it
+    is converted. The content of large records is instead copied into a
+    spooled temporary file, and the WARC record is written from it. If the
+    ARC file is memory-mapped, see mapped.MappedFile, the content is not
+    copied but served from the map as a ChunkStream of one memoryview. The
+    resulting WARC records are identical with the ones of ArcTransformer.
+    """
+
+    def __init__(self, spool_size=DEFAULT_SPOOL_SIZE, **kwargs):
+        """
+        Initialize transformer.
+
+        :spool_size: Maximum size of record content kept in memory in bytes
+        """
+        super().__init__(**kwargs)
+        self.spool_size = spool_size
+
+    def convert_record(self, record):
+        """
+        Convert an ARC data record to a WARC record.
+
+        :record: Warctools ARC record, with unread content
+        :returns: Tuple of one Warctools WARC record
+        """
+        if record.content_length <= self.spool_size:
+            return super().convert_record(record)
+
+        spool = _map_content(record.content_file)
+        if spool is None:
+            spool = create_spool(self.spool_size)
+            content_file = record.content_file
+            for block in iter(lambda: content_file.read(COPY_BLOCK_SIZE),
+                              b""):
+                spool.write(block)
+        length = spool.seek(0, io.SEEK_END)
+        spool.seek(0)
+
+        # The content has been read, as done by Warctools when the content
+        # of a record is read into memory
+        record.content_file = None
+
+        # Convert the headers of a copy of the record with an empty content,
+        # created with the public constructor of Warctools. The record type
+        # is resolved from the content only for HTTP URLs which are not
+        # configured as resources or responses, and that rule of
+        # ArcTransformer.convert_record() is applied below to the spool.
+        headers_only = ArcRecord(
+            headers=record.headers,
+            content=(record.get_header(record.CONTENT_TYPE), b""),
+            errors=record.errors)
+        (headers_record,) = super().convert_record(headers_only)
+        content_type = headers_record.content[0]
+
+        url = record.url.lower()
+        if url.startswith(b"http") and \
+                not any(url.startswith(p) for p in self.resources) and \
+                not any(url.startswith(p) for p in self.responses) and \
+                spooled_http_response(spool):
+            content_type = b"application/http;msgtype=response"
+            headers_record.set_header(WarcRecord.TYPE, WarcRecord.RESPONSE)
+        spool.seek(0)
+
+        headers = headers_record.headers + [
+            (WarcRecord.CONTENT_TYPE, content_type),
+            (WarcRecord.CONTENT_LENGTH, str(length).encode("ascii"))]
+        return (WarcRecord(headers=headers, content_file=spool,
+                           version=self.version),)
+
+
+def _map_content(content_file):
+    """
+    Serve the unread content of a record from the memory map of the ARC
+    file, and skip the content in the file.
+
+    :content_file: Warctools record stream positioned at the content
+    :returns: ChunkStream of the content, None if the file is not mapped
+    """
+    mapped = content_file.fh
+    if not isinstance(mapped, MappedFile):
+        return None
+    start = mapped.tell()
+    view = mapped.view(start, content_file.bytes_to_eoc)
+    mapped.seek(start + len(view))
+    content_file.bytes_to_eoc -= len(view)
+    return ChunkStream([view] if view else [])
+
+
+def spooled_http_response(spool):
+    """
+    Resolve whether spooled content is a complete HTTP response, with the
+    same result as Warctools' is_http_response().
+
+    The content is fed to the HTTP parser block by block and the parsed
+    bytes are dropped from the parser buffer. Gzip encoded responses with
+    a known length are parsed by Warctools only as a whole, so for those
+    the content is read into memory.
+
+    :spool: Content file, positioned at the start
+    :returns: True if the content is an HTTP response, False otherwise
+    """
+    message = ResponseMessage(RequestMessage())
+    remainder = b""
+    for block in iter(lambda: spool.read(COPY_BLOCK_SIZE), b""):
+        if remainder:
+            return False
+        try:
+            remainder = message.feed(bytes(block))
+        except EOFError:
+            remainder = None
+        if remainder is None or \
+                isinstance(message.body_reader, ZipLengthReader):
+            spool.seek(0)
+            return is_http_response(spool.read())
+        del message.buffer[:message.offset]
+        message.offset = 0
+    message.close()
+    return message.complete() and not remainder
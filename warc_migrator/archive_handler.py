@@ -1,26 +1,158 @@
 """
 Handler for warcinfo and metadata records.
 """
-from io import BytesIO
+import io
+from bisect import bisect_right
 from warcio.recordbuilder import RecordBuilder
-from xml_helpers.utils import decode_utf8, encode_utf8
+
+# xml_helpers.utils imports lxml, so it is imported in the methods only when
+# the records are created
+# pylint: disable=import-outside-toplevel
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Seekable read-only stream of a payload collected as a list of byte
+    chunks. The chunks are not joined, a read returns a whole chunk as it is
+    whenever the read is aligned with the chunk.
+    """
+
+    def __init__(self, chunks):
+        """
+        Initialize stream.
+
+        :chunks: List of non-empty byte strings or memoryviews
+        """
+        super().__init__()
+        self._chunks = chunks
+        self._starts = []  # Offsets of the chunks in the payload
+        self.length = 0    # Length of the payload
+        for chunk in chunks:
+            self._starts.append(self.length)
+            self.length += len(chunk)
+        self._position = 0
+
+    @property
+    def chunks(self):
+        """
+        List of the chunks of the payload.
+        """
+        return self._chunks
+
+    def readable(self):
+        """
+        The stream is readable.
+        """
+        return True
+
+    def seekable(self):
+        """
+        The stream is seekable.
+        """
+        return True
+
+    def tell(self):
+        """
+        :returns: Current position in the payload
+        """
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """
+        Change the position in the payload.
+
+        :offset: Offset relative to whence
+        :whence: io.SEEK_SET, io.SEEK_CUR or io.SEEK_END
+        :returns: New position
+        """
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        if offset < 0:
+            raise ValueError("Negative seek position %d." % offset)
+        self._position = offset
+        return offset
+
+    def read(self, size=-1):
+        """
+        Read at most the given number of bytes, up to the end of the chunk at
+        the current position.
+
+        :size: Maximum number of bytes, negative to read to the end
+        :returns: Bytes read, empty at the end of the payload
+        """
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(io.DEFAULT_BUFFER_SIZE),
+                                 b""))
+        if size == 0 or self._position >= self.length:
+            return b""
+        index = bisect_right(self._starts, self._position) - 1
+        chunk = self._chunks[index]
+        start = self._position - self._starts[index]
+        end = min(len(chunk), start + size)
+        data = chunk if start == 0 and end == len(chunk) else \
+            chunk[start:end]
+        self._position += len(data)
+        return data
+
+    def readinto(self, buff):
+        """
+        Read bytes into the given buffer.
+
+        :buff: Writable buffer
+        :returns: Number of bytes read, 0 at the end of the payload
+        """
+        data = self.read(len(buff))
+        buff[:len(data)] = data
+        return len(data)
+
+    def release(self):
+        """
+        Release the memoryview chunks, e.g. views of a memory-mapped file,
+        when the payload is no longer read. The stream can not be read
+        after that.
+        """
+        for chunk in self._chunks:
+            if isinstance(chunk, memoryview):
+                chunk.release()
 
 
 class ArchiveHandler:
     """
     Handler for warcinfo and metadata record read from a file or
     to be written to a file.
+
+    The metadata payload is collected as a list of chunks, which are handed
+    to Warcio as a ChunkStream without joining them.
     """
 
     def __init__(self):
         """
         Initalize handler.
         """
-        self.metadata = b""          # Metadata record payload
+        self.metadata_chunks = []    # Metadata record payload as chunks
         self.warcinfo = {}           # Warcinfo dict
         self.metadata_record = None  # Warcio metadata record
         self.warcinfo_record = None  # Warcio warcinfo record
 
+    @property
+    def metadata(self):
+        """
+        Metadata record payload as bytes.
+        """
+        return b"".join(self.metadata_chunks)
+
+    @metadata.setter
+    def metadata(self, metadata):
+        """
+        Replace the metadata record payload.
+
+        :metadata: Metadata payload
+        """
+        self.metadata_chunks = []
+        self.append_metadata(metadata)
+
     def set_warcinfo(self, warcinfo):
         """
         Set a warcinfo dict.
@@ -39,6 +171,7 @@ class ArchiveHandler:
         :key: Key to be added
         :value: Value to be added
         """
+        from xml_helpers.utils import decode_utf8
         if self.warcinfo.get(decode_utf8(key)):
             self.warcinfo[decode_utf8(key)].append(decode_utf8(value))
         else:
@@ -50,7 +183,9 @@ class ArchiveHandler:
 
         :metadata: Metadata string.
         """
-        self.metadata += encode_utf8(metadata)
+        from xml_helpers.utils import encode_utf8
+        if metadata:
+            self.metadata_chunks.append(encode_utf8(metadata))
 
     def set_metadata_record(self, record):
         """
@@ -72,24 +207,33 @@ class ArchiveHandler:
         """
         Create new info record from given header and record type.
 
+        The digests and the Content-Type of the given header are removed,
+        and the Warcio writer adds them back, the digests computed from the
+        new payload.
+
         :header: WARC header
         :record_type: Record type: "warcinfo" or "metadata"
         """
-        builder = RecordBuilder("WARC/1.0")
         if record_type == "metadata":
-            self.set_metadata_record(builder.create_warc_record(
-                uri=None,
-                record_type=record_type,
-                payload=BytesIO(encode_utf8(self.metadata)),
-                warc_headers=header
-            ))
+            payload = ChunkStream(self.metadata_chunks)
         elif record_type == "warcinfo":
-            self.set_warcinfo_record(builder.create_warc_record(
-                uri=None,
-                record_type=record_type,
-                payload=BytesIO(encode_utf8(self._make_warcinfo_payload())),
-                warc_headers=header
-            ))
+            payload = ChunkStream([self._make_warcinfo_payload()])
+        else:
+            return
+        for name in ("WARC-Block-Digest", "WARC-Payload-Digest"):
+            header.remove_header(name)
+        record = RecordBuilder("WARC/1.0").create_warc_record(
+            uri=None,
+            record_type=record_type,
+            payload=payload,
+            length=payload.length,
+            warc_headers=header
+        )
+        header.remove_header("Content-Type")
+        if record_type == "metadata":
+            self.set_metadata_record(record)
+        else:
+            self.set_warcinfo_record(record)
 
     def _make_warcinfo_payload(self):
         """
@@ -97,14 +241,14 @@ class ArchiveHandler:
 
         :returns: Warcinfo as payload
         """
-        payload = b""
-        iterator = self.warcinfo.items()
-        for key, values in iterator:
+        from xml_helpers.utils import encode_utf8
+        fields = []
+        for key, values in self.warcinfo.items():
             for value in values:
                 if not value.startswith(" "):
                     value = " " + value
                 if not value.endswith("\r\n"):
                     value = value + "\r\n"
-                payload = payload + b"%s:%s" % (encode_utf8(key),
-                                                encode_utf8(value))
-        return payload
+                fields.append(b"%s:%s" % (encode_utf8(key),
+                                          encode_utf8(value)))
+        return b"".join(fields)
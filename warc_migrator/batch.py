@@ -0,0 +1,347 @@
+"""
+Migrate a batch of ARC and WARC files to WARC 1.0 with a pool of worker
+processes.
+"""
+import csv
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import click
+
+from warc_migrator.fixity import fixity_algorithms
+from warc_migrator.metrics import Metrics
+from warc_migrator.migrator import migrate_to_warc
+from warc_migrator.scan import scan_batch
+
+
+@click.command()
+@click.argument("source", metavar="SOURCE", type=str)
+@click.argument("target_dir", metavar="TARGET_DIR", required=False,
+                type=click.Path(file_okay=False))
+@click.option("--meta", nargs=2, type=str, multiple=True,
+              metavar="<NAME> <VALUE>", default=(),
+              help="Warcinfo field name and value to be added to each WARC "
+                   "file.")
+@click.option("--workers", type=click.IntRange(min=1), default=None,
+              help="Number of worker processes. Defaults to the number of "
+                   "CPUs.")
+@click.option("--report", "report_path", type=click.Path(dir_okay=False),
+              default=None,
+              help="Write the per-file migration report, or the inventory "
+                   "of --scan, into the given file.")
+@click.option("--report-format", type=click.Choice(["json", "csv"]),
+              default="json", show_default=True,
+              help="Format of the report file.")
+@click.option("--scan", is_flag=True, default=False,
+              help="Only scan the sources for their format, version, "
+                   "compression, number of records and number of non-ASCII "
+                   "HTTP status lines, without migrating them. TARGET_DIR "
+                   "is not needed.")
+@click.option("--dedup-index", type=click.Path(dir_okay=False),
+              default=None,
+              help="Deduplicate the response records of the batch with the "
+                   "given SQLite digest index shared by the worker "
+                   "processes: records whose payload is in the index are "
+                   "written as revisit records referring to the original "
+                   "records. The index is created if it does not exist.")
+@click.option("--fixity", type=click.Choice(fixity_algorithms()),
+              multiple=True, metavar="ALGORITHM",
+              help="Compute a fixity digest of each source and migrated "
+                   "file with the given algorithm while they are read and "
+                   "written, and write the digests into a manifest next to "
+                   "the migrated file. Can be given several times.")
+@click.option("--fixity-manifest", is_flag=True, default=False,
+              help="Write the fixity digests, by default MD5 and SHA-256, "
+                   "into a manifest next to each migrated file, named after "
+                   "it with the extension .manifest.")
+@click.option("--metrics-file", type=click.Path(dir_okay=False),
+              default=None,
+              help="Write the metrics of the migrations in the Prometheus "
+                   "text format into the given file, updated after each "
+                   "migrated file.")
+@click.option("--metrics-port", type=click.IntRange(0, 65535), default=None,
+              help="Serve the metrics of the migrations in the Prometheus "
+                   "text format on the given local HTTP port while the "
+                   "batch runs.")
+@click.pass_context
+def warc_migrator_batch_cli(ctx, source, target_dir, meta, workers,
+                            report_path, report_format, scan, dedup_index,
+                            fixity, fixity_manifest, metrics_file,
+                            metrics_port):
+    """
+    WARC Migrator for a batch of files.
+
+    Migrate all ARC 1.0/1.1 and WARC 0.17/0.18 files given in SOURCE to
+    WARC 1.0 files in TARGET_DIR. The files are migrated in parallel and
+    a failure in one file does not stop the migration of the other files.
+    With --scan, the files are only read for an inventory.
+
+    \b
+    SOURCE: Directory, glob pattern or manifest file listing the sources
+    TARGET_DIR: Directory for the migrated files (warc.gz)
+    """
+    # \b above is for help formatting of click library
+    if scan:
+        _scan_cli(ctx, source, workers, report_path, report_format)
+        return
+    if target_dir is None:
+        raise click.UsageError("Missing argument 'TARGET_DIR'.")
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+
+    metrics = None
+    server = None
+    if metrics_file or metrics_port is not None:
+        metrics = Metrics()
+    if metrics_port is not None:
+        server = metrics.serve(metrics_port)
+    try:
+        report = migrate_batch(collect_sources(source), target_dir, meta,
+                               workers=workers, metrics=metrics,
+                               metrics_file=metrics_file,
+                               dedup_index=dedup_index,
+                               fixity=fixity or None,
+                               fixity_manifest=fixity_manifest or
+                               bool(fixity))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    failed = 0
+    for result in report:
+        if result["error"] is None:
+            click.echo("Wrote the migrated warc into {} with {} "
+                       "records.".format(result["target"], result["count"]))
+        else:
+            failed += 1
+            click.echo("Failed to migrate {}: {}".format(
+                result["source"], result["error"]), err=True)
+
+    if report_path:
+        write_report(report, report_path, report_format)
+
+    click.echo("Migrated {} of {} files.".format(
+        len(report) - failed, len(report)))
+    if failed:
+        ctx.exit(1)
+
+
+def _scan_cli(ctx, source, workers, report_path, report_format):
+    """
+    Scan the sources of a batch and print the inventory.
+
+    :ctx: Click context
+    :source: Directory, manifest file or glob pattern
+    :workers: Number of worker processes
+    :report_path: Inventory file, None for no file
+    :report_format: Format of the inventory file, "json" or "csv"
+    """
+    inventory = scan_batch(collect_sources(source), workers=workers)
+    failed = 0
+    for result in inventory:
+        if result["error"] is None:
+            click.echo("{}: {} {}, {}, {} records, {} non-ASCII status "
+                       "lines.".format(
+                           result["source"], result["format"].upper(),
+                           result["version"], result["compression"],
+                           result["records"], result["non_ascii_status"]))
+        else:
+            failed += 1
+            click.echo("Failed to scan {}: {}".format(
+                result["source"], result["error"]), err=True)
+
+    if report_path:
+        write_report(inventory, report_path, report_format)
+
+    click.echo("Scanned {} of {} files, {} bytes and {} records.".format(
+        len(inventory) - failed, len(inventory),
+        sum(result["bytes"] or 0 for result in inventory),
+        sum(result["records"] or 0 for result in inventory)))
+    if failed:
+        ctx.exit(1)
+
+
+def write_report(report, report_path, report_format="json"):
+    """
+    Write the per-file results of a batch into a file.
+
+    :report: List of result dicts with the same keys
+    :report_path: Report file path
+    :report_format: "json" for a JSON list, "csv" for a CSV file with a
+                    header line
+    """
+    with open(report_path, "w", newline="") as report_file:
+        if report_format == "csv":
+            writer = csv.DictWriter(report_file,
+                                    list(report[0]) if report else [])
+            writer.writeheader()
+            writer.writerows(report)
+        else:
+            json.dump(report, report_file, indent=2)
+
+
+def collect_sources(source):
+    """
+    Resolve the source files of a batch.
+
+    The source can be a directory, in which case all the files in the
+    directory are used, a manifest file listing one source path per line
+    (relative paths are relative to the manifest file), or a glob pattern.
+
+    :source: Directory, manifest file or glob pattern
+    :returns: Sorted list of source file paths
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name) for name in os.listdir(source)
+            if os.path.isfile(os.path.join(source, name)))
+
+    if os.path.isfile(source):
+        base_dir = os.path.dirname(source)
+        sources = []
+        with open(source, "r") as manifest:
+            for line in manifest:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                sources.append(os.path.join(base_dir, line))
+        return sources
+
+    return sorted(path for path in glob.glob(source) if os.path.isfile(path))
+
+
+def target_name(source_path):
+    """
+    Resolve the name of the migrated file from the source file name.
+
+    :source_path: Source archive file path
+    :returns: Target file name, with .warc.gz extension
+    """
+    name = os.path.basename(source_path)
+    for extension in (".gz", ".arc", ".warc"):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return name + ".warc.gz"
+
+
+def migrate_batch(sources, target_dir, meta, workers=None, metrics=None,
+                  metrics_file=None, dedup_index=None, fixity=None,
+                  fixity_manifest=False):
+    """
+    Migrate a batch of archive files to WARC 1.0 in worker processes.
+
+    The worker processes are reused for several files, so the modules
+    needed in the migration are imported only once per worker. If a
+    worker process dies, e.g. it runs out of memory, the files which were
+    not finished are reported with an error, and the results of the
+    finished files are kept.
+
+    :sources: List of source archive file paths
+    :target_dir: Directory for the target WARC files
+    :meta: User given metadata fields that are added to warcinfo records
+    :workers: Number of worker processes, defaults to the number of CPUs
+    :metrics: Metrics updated with the metrics of the workers after each
+              migrated file, see metrics.Metrics, None for no metrics
+    :metrics_file: File into which the metrics are written after each
+                   migrated file, None for no file
+    :dedup_index: Path of the SQLite digest index deduplicating the
+                  response records of all the files, see
+                  dedup.DigestIndex, None for no deduplication. A file
+                  refers only to the files migrated before it has
+                  finished, so with several workers the revisit records
+                  depend on the order in which the files finish.
+    :fixity: Hashlib algorithm names of the fixity digests of the source
+             and target files, see migrator.migrate_to_warc()
+    :fixity_manifest: True to write the fixity digests of each file into a
+                      manifest next to the target
+    :returns: List of result dicts with keys source, target, count and
+              error, in the same order as the sources
+    """
+    options = {}
+    if dedup_index is not None:
+        options["dedup_index"] = dedup_index
+    if fixity is not None:
+        options["fixity"] = tuple(fixity)
+    if fixity_manifest:
+        options["fixity_manifest"] = True
+    jobs = []
+    targets = set()
+    report = []
+    for source_path in sources:
+        target_path = os.path.join(target_dir, target_name(source_path))
+        result = {"source": source_path, "target": target_path,
+                  "count": None, "error": None}
+        if target_path in targets:
+            result["error"] = "Target file is shared with another source."
+        else:
+            targets.add(target_path)
+            jobs.append((source_path, target_path, tuple(meta),
+                         metrics is not None, options))
+        report.append(result)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for job, result in zip(jobs, (result for result in report
+                                      if result["error"] is None)):
+            try:
+                futures[executor.submit(migrate_job, job)] = result
+            except BrokenProcessPool as err:
+                result.update(_failed_job(err))
+        for future in as_completed(futures):
+            result = futures[future]
+            try:
+                result.update(future.result())
+            except Exception as err:  # pylint: disable=broad-except
+                # The worker process died, e.g. it ran out of memory
+                result.update(_failed_job(err))
+            job_metrics = result.pop("metrics", None)
+            if metrics is None:
+                continue
+            if job_metrics is not None:
+                metrics.merge(job_metrics)
+            if metrics_file:
+                metrics.write(metrics_file)
+
+    return report
+
+
+def _failed_job(err):
+    """
+    Create the result of a job whose worker process failed.
+
+    :err: Exception of the future of the job
+    :returns: Dict with keys count, error and metrics
+    """
+    return {"count": None, "metrics": None,
+            "error": "Worker processes failed: %s" % (
+                str(err) or type(err).__name__)}
+
+
+def migrate_job(job):
+    """
+    Migrate a single file in a worker process.
+
+    :job: Tuple of (source path, target path, metadata fields, True to
+          collect metrics), optionally followed by a dict of other keyword
+          arguments of migrate_to_warc()
+    :returns: Dict with keys count, error and metrics, the metrics of the
+              migration or None
+    """
+    source_path, target_path, meta, collect_metrics = job[:4]
+    options = job[4] if len(job) > 4 else {}
+    metrics = Metrics() if collect_metrics else None
+    try:
+        result = migrate_to_warc(source_path, target_path, meta,
+                                 metrics=metrics, **options)
+    except Exception as err:  # pylint: disable=broad-except
+        return {"count": None, "error": str(err) or type(err).__name__,
+                "metrics": metrics}
+    return {"count": result.count, "error": None, "metrics": metrics}
+
+
+if __name__ == '__main__':
+    warc_migrator_batch_cli()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,137 @@
+"""
+Checkpoint journal for resuming an interrupted migration.
+"""
+import json
+import os
+
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024
+
+
+class Checkpoint:
+    """
+    Journal of the progress of a migration.
+
+    The journal is a file of JSON lines next to the target file. A line is
+    appended at a gzip member boundary whenever the target has grown by the
+    checkpoint interval. Each line has the number of records written, the
+    number of the current part file and the offset of the end of the last
+    member in it, the number of warcinfo and metadata records repeated in
+    the part files, the WARC-Record-ID of the warcinfo record of the part
+    file and the size and modification time of the source file. The target
+    is flushed to disk before the line is written, so the target is always
+    complete up to the offset of the last line.
+    """
+
+    def __init__(self, path, source_path, interval=CHECKPOINT_INTERVAL):
+        """
+        Initialize journal.
+
+        :path: Journal file path
+        :source_path: Source file path
+        :interval: Minimum number of bytes written to the target between
+                   two checkpoints
+        """
+        self.path = path
+        self.interval = interval
+        source_stat = os.stat(source_path)
+        self.source = {"source_size": source_stat.st_size,
+                       "source_mtime": source_stat.st_mtime}
+        self.warcinfo_id = None  # WARC-Record-ID of the written warcinfo
+        self.part = 0            # Number of the current part file
+        self.repeated = 0        # Number of repeated records in the parts
+        self._last_offset = None
+
+    def load(self):
+        """
+        Read the last complete checkpoint of the journal.
+
+        :returns: Checkpoint dict with keys records, part, offset,
+                  repeated and warcinfo_id, None if there is no journal.
+                  If the journal is empty, the migration is resumed from
+                  the start.
+        :raises: ValueError if the source file has changed after the
+                 checkpoint was written
+        """
+        entry = None
+        try:
+            with open(self.path, "r") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # Partially written last line
+        except FileNotFoundError:
+            return None
+
+        if entry is None:
+            entry = dict(self.source, records=0, part=0, offset=0,
+                         repeated=0, warcinfo_id=None)
+        for key, value in self.source.items():
+            if entry.get(key) != value:
+                raise ValueError("Source file has changed after the "
+                                 "checkpoint was written.")
+        self._last_offset = entry["offset"]
+        self.part = entry["part"]
+        self.repeated = entry["repeated"]
+        self.warcinfo_id = entry["warcinfo_id"]
+        return entry
+
+    def reset(self):
+        """
+        Start a new empty journal.
+        """
+        with open(self.path, "w"):
+            pass
+        self.start_part(0, 0)
+
+    def start_part(self, part, repeated):
+        """
+        Continue the journal in a new part file.
+
+        :part: Number of the part file
+        :repeated: Number of the records repeated in the part files so far
+        """
+        self.part = part
+        self.repeated = repeated
+        self._last_offset = 0
+
+    def update(self, out, records, offset):
+        """
+        Write a checkpoint if the target has grown enough since the last
+        checkpoint.
+
+        :out: Target file handler, positioned at a member boundary
+        :records: Number of records written into the target
+        :offset: Offset of the member boundary in the target
+        """
+        if self._last_offset is None:
+            self._last_offset = offset
+        if offset - self._last_offset < self.interval:
+            return
+
+        _sync(out)
+        entry = dict(self.source, records=records, part=self.part,
+                     offset=offset, repeated=self.repeated,
+                     warcinfo_id=self.warcinfo_id)
+        with open(self.path, "a") as journal:
+            journal.write(json.dumps(entry) + "\n")
+            _sync(journal)
+        self._last_offset = offset
+
+    def remove(self):
+        """
+        Remove the journal after a completed migration.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _sync(out):
+    """
+    Flush a file to disk.
+
+    :out: File handler, or a wrapper of it with fileno()
+    :raises: OSError if the file can not be flushed to disk
+    """
+    out.flush()
+    os.fsync(out.fileno())
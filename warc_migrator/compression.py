@@ -0,0 +1,548 @@
+"""
+Compression of WARC records into gzip members.
+"""
+import functools
+import importlib
+import shutil
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from warcio.limitreader import LimitReader
+from warcio.warcwriter import WARCWriter
+
+from warc_migrator.indexer import index_entry
+
+DEFAULT_LEVEL = 9
+GZIP_MAGIC = b"\x1f\x8b"
+GZIP_MEMBER_HEADER = GZIP_MAGIC + b"\x08"  # Magic and deflate method
+WARC_START = b"WARC/"  # Start of the version line of a WARC record
+SNIFF_BLOCK_SIZE = 64 * 1024
+COPY_BLOCK_SIZE = 64 * 1024
+DEFAULT_SPOOL_SIZE = 512 * 1024
+BACKENDS = ("zlib", "zlib-ng", "isal", "auto")
+
+# Optional deflate backends with zlib compatible interfaces, in the order
+# of preference for the "auto" backend
+_OPTIONAL_BACKENDS = (("isal", "isal.isal_zlib"),
+                      ("zlib-ng", "zlib_ng.zlib_ng"))
+
+
+def resolve_backend(backend="zlib"):
+    """
+    Resolve the deflate backend to be used.
+
+    The optional backends zlib-ng and isal need their Python bindings. The
+    "auto" backend is the fastest installed backend, and falls back to the
+    standard library zlib if neither is installed.
+
+    :backend: One of "zlib", "zlib-ng", "isal" or "auto"
+    :returns: Name of the backend actually used
+    :raises: ValueError if the backend is unknown, or if an explicitly
+             named backend is not installed
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown compression backend %s." % backend)
+    for name, module in _OPTIONAL_BACKENDS:
+        if backend in (name, "auto") and _import_backend(module):
+            return name
+    if backend != "auto" and backend != "zlib":
+        raise ValueError("Compression backend %s is not installed." %
+                         backend)
+    return "zlib"
+
+
+@functools.lru_cache(maxsize=None)
+def _import_backend(module):
+    """
+    Import the zlib compatible module of a deflate backend. The result is
+    cached, so a missing module is looked up only once.
+
+    :module: Module name
+    :returns: The module, or None if it is not installed
+    """
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        return None
+
+
+def make_compressor(level=DEFAULT_LEVEL, backend="zlib"):
+    """
+    Create a compressor object producing a gzip member.
+
+    ISA-L supports only compression levels 0-3, so the levels 1-9 are
+    mapped to ISA-L levels 1-3.
+
+    :level: Compression level 0-9
+    :backend: Deflate backend, see resolve_backend(). The writers resolve
+              it once, so "auto" is resolved here only for single members.
+    :returns: Compressor object
+    """
+    if not 0 <= level <= 9:
+        raise ValueError("Invalid compression level %s." % level)
+    backend = resolve_backend(backend)
+    if backend == "zlib":
+        module = zlib
+    else:
+        module = _import_backend(dict(_OPTIONAL_BACKENDS)[backend])
+    if backend == "isal":
+        level = min(3, (level + 2) // 3)
+    return module.compressobj(level, module.DEFLATED, module.MAX_WBITS + 16)
+
+
+def sniff_compression(source):
+    """
+    Resolve the compression layout of a WARC file from its first record.
+
+    The first gzip member is decompressed until the end of the first
+    record. If the member continues with another record, the whole file is
+    compressed as a single gzip member instead of record by record. The
+    file position is restored.
+
+    :source: Seekable source file handler
+    :returns: "uncompressed", "multi-member" or "single-member"
+    """
+    position = source.tell()
+    try:
+        data = source.read(SNIFF_BLOCK_SIZE)
+        if not data.startswith(GZIP_MAGIC):
+            return "uncompressed"
+
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        header = b""
+        record_end = None
+        offset = 0  # Offset of the decompressed chunk in the member
+        while data and not decompressor.eof:
+            chunk = decompressor.decompress(data, SNIFF_BLOCK_SIZE)
+            data = decompressor.unconsumed_tail or \
+                source.read(SNIFF_BLOCK_SIZE)
+            if record_end is None:
+                header += chunk
+                record_end = _record_end(header)
+                if record_end is None:
+                    if len(header) > SNIFF_BLOCK_SIZE:
+                        break  # Not a WARC header, leave it to the parser
+                    continue
+                chunk = header
+            if chunk[max(record_end - offset, 0):].strip(b"\r\n"):
+                return "single-member"
+            offset += len(chunk)
+        return "multi-member"
+    finally:
+        source.seek(position)
+
+
+def _record_end(content):
+    """
+    Resolve the end of the first record from its header.
+
+    :content: Decompressed content from the start of the record
+    :returns: Offset of the end of the record block, None if the header is
+              incomplete or has no valid Content-Length
+    """
+    end = content.find(b"\r\n\r\n")
+    if end < 0:
+        return None
+    for line in content[:end].split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            try:
+                return end + 4 + int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class MemberBoundaryError(ValueError):
+    """Exception class for a range cut inside a gzip member"""
+
+
+def member_ranges(source, start, end, size):
+    """
+    Cut a multi-member gzip file into ranges of whole gzip members without
+    decompressing the file.
+
+    A range ends at the first gzip member found at or after the given size
+    from its start, see find_member(). The header found may still be
+    inside a member, e.g. of a gzip file stored uncompressed in a record,
+    so the reader of a range is to check that it ends at the end of a
+    member, see warc_fixer.WarcFixer.fix_warc_shard(). If no more members
+    are found, the rest of the file is left to the last range.
+
+    :source: Seekable source file handler
+    :start: Offset of a member boundary to start from
+    :end: Size of the file
+    :size: Minimum size of a range in bytes
+    :returns: Generator of (start, end) offset tuples
+    """
+    while start + size < end:
+        cut = find_member(source, start + size, end)
+        if cut is None:
+            break
+        yield start, cut
+        start = cut
+    if start < end:
+        yield start, end
+
+
+def find_member(source, offset, end):
+    """
+    Find the first gzip member header at or after the given offset which
+    decompresses into the start of a WARC record.
+
+    :source: Seekable source file handler
+    :offset: Offset to start the search from
+    :end: Size of the file
+    :returns: Offset of the member, None if there is none
+    """
+    keep = len(GZIP_MEMBER_HEADER) - 1  # Bytes of a header cut by a read
+    position = offset  # Offset of the data
+    data = b""
+    while position + len(data) < end:
+        source.seek(position + len(data))
+        block = source.read(COPY_BLOCK_SIZE)
+        if not block:
+            break
+        data += block
+        index = data.find(GZIP_MEMBER_HEADER)
+        while index > -1:
+            if _starts_record(source, position + index):
+                return position + index
+            index = data.find(GZIP_MEMBER_HEADER, index + 1)
+        position += max(0, len(data) - keep)
+        data = data[-keep:]
+    return None
+
+
+def _starts_record(source, offset):
+    """
+    Check whether a gzip member at the given offset decompresses into the
+    start of a WARC record.
+
+    :source: Seekable source file handler
+    :offset: Offset of a gzip member header
+    :returns: True if the member starts a WARC record
+    """
+    source.seek(offset)
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    try:
+        data = decompressor.decompress(source.read(SNIFF_BLOCK_SIZE),
+                                       len(WARC_START))
+    except zlib.error:
+        return False
+    return data == WARC_START
+
+
+def compress_member(data, level=DEFAULT_LEVEL, backend="zlib"):
+    """
+    Compress a serialized record into a single gzip member.
+
+    With the default settings, the result is identical to the gzip member
+    written by Warcio's WARCWriter for the same record.
+
+    :data: Uncompressed record as bytes
+    :level: Compression level 0-9
+    :backend: Deflate backend, see resolve_backend()
+    :returns: Gzip member as bytes
+    """
+    compressor = make_compressor(level, backend)
+    return compressor.compress(data) + compressor.flush()
+
+
+def create_spool(spool_size=DEFAULT_SPOOL_SIZE):
+    """
+    Create a temporary buffer which is kept in memory until it grows
+    larger than the given size, and is then moved to a temporary file.
+
+    :spool_size: Maximum size of the buffer in memory in bytes
+    :returns: Spooled temporary file
+    """
+    return tempfile.SpooledTemporaryFile(max_size=spool_size,
+                                         prefix="warc-migrator.")
+
+
+def compress_spool(spool, level=DEFAULT_LEVEL, backend="zlib",
+                   spool_size=DEFAULT_SPOOL_SIZE):
+    """
+    Compress a spooled serialized record into a single gzip member, block
+    by block, so that neither the record nor the member is held in memory
+    as a whole. The source spool is closed.
+
+    :spool: Spooled uncompressed record, see create_spool()
+    :level: Compression level 0-9
+    :backend: Deflate backend, see resolve_backend()
+    :spool_size: Maximum size of the result buffer in memory in bytes
+    :returns: Spooled gzip member, positioned at the start
+    """
+    member = create_spool(spool_size)
+    wrapper = GzipMemberWrapper(member, make_compressor(level, backend))
+    with spool:
+        spool.seek(0)
+        for block in iter(lambda: spool.read(COPY_BLOCK_SIZE), b""):
+            wrapper.write(block)
+    wrapper.flush()
+    member.seek(0)
+    return member
+
+
+def member_bound(length):
+    """
+    Resolve an upper bound of the size of a gzip member, like zlib's
+    deflateBound() with the gzip header and trailer.
+
+    :length: Length of the uncompressed data
+    :returns: Maximum length of the gzip member
+    """
+    return length + (length >> 10) + 64
+
+
+class GzipMemberWrapper:
+    """
+    Output wrapper compressing everything written into one gzip member,
+    like Warcio's GzippingWrapper, with a configurable compressor.
+    """
+
+    def __init__(self, out, compressor):
+        """
+        Initialize wrapper.
+
+        :out: Target file handler
+        :compressor: Compressor object from make_compressor()
+        """
+        self.out = out
+        self.compressor = compressor
+        self.written = 0  # Number of compressed bytes written
+
+    def write(self, buff):
+        """
+        Compress and write bytes.
+        """
+        self._write(self.compressor.compress(buff))
+
+    def flush(self):
+        """
+        Finish the gzip member.
+        """
+        self._write(self.compressor.flush())
+        self.out.flush()
+
+    def _write(self, data):
+        """
+        Write compressed bytes.
+        """
+        self.out.write(data)
+        self.written += len(data)
+
+
+class CompressingWARCWriter(WARCWriter):
+    """
+    WARC writer which compresses each record into its own gzip member.
+
+    With more than one job, the records are serialized in the calling
+    thread and compressed in a pool of threads, and the compressed members
+    are written in the original order. With the default compression
+    settings, the output is the same as with Warcio's WARCWriter(gzip=True).
+
+    Records larger than the spool size, both when their digests are
+    computed and when they wait for the compression threads, are buffered
+    in temporary files instead of memory.
+
+    If an indexer is given, the index entry, offset and length of each
+    written member are added to it. If a checkpoint journal is given, it is
+    updated after each written member.
+    """
+
+    def __init__(self, filebuf, jobs=1, level=DEFAULT_LEVEL, backend="zlib",
+                 spool_size=DEFAULT_SPOOL_SIZE, indexer=None, checkpoint=None,
+                 *args, **kwargs):
+        """
+        Initialize writer.
+
+        :filebuf: Target file handler
+        :jobs: Number of compression threads
+        :level: Compression level 0-9
+        :backend: Deflate backend, see resolve_backend()
+        :spool_size: Maximum size of a record buffered in memory in bytes
+        :indexer: Index writer, see indexer.CdxWriter
+        :checkpoint: Checkpoint journal, see checkpoint.Checkpoint
+        """
+        kwargs["gzip"] = False
+        super().__init__(filebuf, *args, **kwargs)
+        self.jobs = jobs
+        self.level = level
+        self.backend = resolve_backend(backend)
+        self.spool_size = spool_size
+        self.indexer = indexer
+        self.checkpoint = checkpoint
+        self.offset = 0   # Offset of the next member in the target
+        self.records = 0  # Number of records written in the target
+        make_compressor(level, self.backend)  # Check the settings early
+        self._executor = None
+        self._pending = deque()
+        self._pending_size = 0  # Maximum size of the pending members
+        if jobs > 1:
+            self._executor = ThreadPoolExecutor(max_workers=jobs)
+
+    def _create_temp_file(self):
+        """
+        Create the buffer used by Warcio for computing the digests of a
+        record without a known length.
+
+        :returns: Spooled temporary file
+        """
+        return create_spool(self.spool_size)
+
+    def write_record(self, record, params=None):
+        """
+        Write a record as a gzip member.
+
+        :record: Warcio record
+        """
+        self._write(lambda out: self._write_warc_record(out, record),
+                    record)
+
+    def write_raw_record(self, record):
+        """
+        Write a record read as bytes as a gzip member, with the digests
+        computed if they are missing, as write_record() does.
+
+        :record: RawRecord, see rewriter.RecordReader
+        """
+        record.ensure_digests(self.spool_size)
+        self._write(record.write_to, record)
+
+    def _write(self, serialize, record):
+        """
+        Serialize a record and compress it into a gzip member.
+
+        :serialize: Function writing the serialized record into the given
+                    file handler
+        :record: Warcio record or RawRecord, indexed after it has been
+                 serialized with its digests
+        """
+        if self._executor is None:
+            wrapper = GzipMemberWrapper(
+                self.out, make_compressor(self.level, self.backend))
+            serialize(wrapper)
+            self._add_index(self._index_entry(record), wrapper.written)
+            return
+
+        spool = create_spool(self.spool_size)
+        serialize(spool)
+        length = spool.tell()
+        self._pending_size += member_bound(length)
+        self._pending.append((self._executor.submit(
+            compress_spool, spool, self.level, self.backend,
+            self.spool_size), self._index_entry(record), length))
+        # Limit the number of records waiting for the compression
+        while len(self._pending) > 2 * self.jobs:
+            self._write_member(*self._pending.popleft())
+
+    def reached(self, size):
+        """
+        Check whether the written members have reached the given size.
+
+        The members waiting for the compression threads are written first
+        only if they may reach the size, so the result is the same as when
+        the records are compressed in the calling thread.
+
+        :size: Size in bytes
+        :returns: True if the target is at least of the given size
+        """
+        if self.offset + self._pending_size < size:
+            return False
+        while self._pending and self.offset < size:
+            self._write_member(*self._pending.popleft())
+        return self.offset >= size
+
+    def write_members(self, members, entries, records):
+        """
+        Copy gzip members compressed elsewhere, e.g. in a worker process,
+        to the target after the pending members.
+
+        :members: File handler of the gzip members, positioned at the start
+        :entries: List of (index entry, offset, length) tuples of the
+                  indexed members, with offsets relative to the start of
+                  the members
+        :records: Number of records in the members
+        """
+        while self._pending:
+            self._write_member(*self._pending.popleft())
+        shutil.copyfileobj(members, self.out, COPY_BLOCK_SIZE)
+        if self.indexer is not None:
+            for entry, offset, length in entries:
+                self.indexer.add(entry, self.offset + offset, length)
+        self.offset += members.tell()
+        self.records += records
+        if self.checkpoint is not None:
+            self.checkpoint.update(self.out, self.records, self.offset)
+
+    def copy_member(self, source, length, entry):
+        """
+        Copy the gzip member of a record from the source as it is, after
+        the pending members.
+
+        :source: Source file handler, positioned at the start of the member
+        :length: Length of the member
+        :entry: Index entry of the record of the member
+        """
+        while self._pending:
+            self._write_member(*self._pending.popleft())
+        shutil.copyfileobj(LimitReader(source, length), self.out,
+                           COPY_BLOCK_SIZE)
+        self._add_index(entry, length)
+
+    def _write_member(self, future, entry, length):
+        """
+        Copy a compressed member to the target and close it.
+
+        :future: Future of a spooled gzip member from compress_spool()
+        :entry: Index entry of the record of the member
+        :length: Length of the uncompressed record
+        """
+        self._pending_size -= member_bound(length)
+        with future.result() as member:
+            shutil.copyfileobj(member, self.out, COPY_BLOCK_SIZE)
+            self._add_index(entry, member.tell())
+
+    def _index_entry(self, record):
+        """
+        Collect the index fields of a written record.
+
+        :record: Warcio record
+        :returns: Dict of index fields, None if the record is not indexed
+        """
+        if self.indexer is None:
+            return None
+        return index_entry(record)
+
+    def _add_index(self, entry, length):
+        """
+        Add a written member to the index, advance the offset and update
+        the checkpoint journal.
+
+        :entry: Index entry of the record of the member
+        :length: Length of the member
+        """
+        if self.indexer is not None:
+            self.indexer.add(entry, self.offset, length)
+        self.offset += length
+        self.records += 1
+        if self.checkpoint is not None:
+            self.checkpoint.update(self.out, self.records, self.offset)
+
+    def close(self):
+        """
+        Write the pending members and stop the compression threads.
+        """
+        if self._executor is None:
+            return
+        try:
+            while self._pending:
+                self._write_member(*self._pending.popleft())
+            self.out.flush()
+        finally:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,171 @@
+"""
+Deduplication of the response records of migrated files by their payload
+digests, with a persistent digest index shared across migrations.
+"""
+import sqlite3
+
+from warcio.utils import Digester
+from warcio.warcwriter import BaseWARCWriter
+
+DEDUP_TIMEOUT = 60.0  # Seconds to wait for the database lock
+EMPTY_DIGEST = str(Digester("sha1"))  # Payload digest of an empty payload
+# Headers of a revisit record referring to the WARC-Record-ID,
+# WARC-Target-URI and WARC-Date of the original record
+REFERS_TO = ("WARC-Refers-To", "WARC-Refers-To-Target-URI",
+             "WARC-Refers-To-Date")
+
+
+def is_deduplicated(record):
+    """
+    Check whether a record can be written as a revisit record of another
+    record with the same payload: a complete HTTP response record.
+
+    :record: Fixed Warcio record or rewriter.RawRecord
+    :returns: True if the record is deduplicated
+    """
+    headers = record.rec_headers
+    return (record.rec_type == "response" and
+            bool(record.http_headers) and
+            # Warcio writes a record without a Content-Length with all of
+            # its digests computed again
+            getattr(record, "length", 0) is not None and
+            all(headers.get_header(name) for name in (
+                "WARC-Record-ID", "WARC-Target-URI", "WARC-Date")) and
+            headers.get_header("WARC-Truncated") is None and
+            headers.get_header("WARC-Segment-Number") is None)
+
+
+def make_revisit(record, original):
+    """
+    Turn a response record into a revisit record of an original record
+    with the same payload, with the identical payload digest profile. The
+    block of the revisit record is only the HTTP headers of the response,
+    and the payload is left out when the record is written.
+
+    :record: Fixed Warcio record or rewriter.RawRecord, with the payload
+             digest but without the block digest computed by the writer
+    :original: Tuple of the WARC-Record-ID, WARC-Target-URI and WARC-Date
+               of the original record, see DigestIndex.lookup()
+    """
+    headers_buff = record.http_headers.headers_buff
+    block_digester = Digester("sha1")
+    block_digester.update(headers_buff)
+
+    headers = record.rec_headers
+    record.rec_type = "revisit"
+    headers.replace_header("WARC-Type", "revisit")
+    headers.replace_header("Content-Length", str(len(headers_buff)))
+    headers.add_header("WARC-Profile", BaseWARCWriter.REVISIT_PROFILE)
+    for name, value in zip(REFERS_TO, original):
+        headers.add_header(name, value)
+    headers.replace_header("WARC-Block-Digest", str(block_digester))
+
+
+class DigestIndex:
+    """
+    Persistent index of the payload digests of the response records
+    written into migrated files.
+
+    The index is an SQLite database, which can be shared by concurrent
+    migrations, e.g. by the worker processes of a batch. The records
+    written in a migration are kept pending in memory, and they are added
+    to the database only when the migration has succeeded. So a revisit
+    record refers to a record of a migration which has succeeded, or to an
+    earlier record of the same migration. The first record added for a
+    payload digest is kept.
+
+    The records are kept with the target of their migration. When the same
+    target is migrated again, e.g. after its earlier migration has been
+    deleted, the records of the earlier migration are not found, and they
+    are replaced by the records of the new migration on commit, so that a
+    record is never written as a revisit of a record it replaces. A record
+    is not found as its own original either, e.g. when the same source is
+    migrated into another target, as the WARC-Record-IDs are kept.
+    """
+
+    def __init__(self, path, timeout=DEDUP_TIMEOUT, target=None):
+        """
+        Open the index, and create it if it does not exist.
+
+        :path: Database file path
+        :timeout: Seconds to wait for another migration holding the lock
+                  of the database
+        :target: Absolute path of the target of the migration, None for no
+                 target
+        """
+        self.path = path
+        self.target = target
+        self._pending = {}  # Payload digest -> (record ID, URI, date, file)
+        self._connection = sqlite3.connect(path, timeout=timeout)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                "digest TEXT PRIMARY KEY, record_id TEXT NOT NULL, "
+                "uri TEXT NOT NULL, date TEXT NOT NULL, filename TEXT, "
+                "target TEXT)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS digests_target "
+                "ON digests (target)")
+
+    def lookup(self, digest, record_id=None):
+        """
+        Find the original record of a payload digest.
+
+        :digest: Payload digest, e.g. "sha1:..."
+        :record_id: WARC-Record-ID of the record looked up, None if not
+                    known
+        :returns: Tuple of the WARC-Record-ID, WARC-Target-URI and
+                  WARC-Date of the original record, None if the digest is
+                  not in the index, if the original is the record itself
+                  or if it is from an earlier migration of the same target
+        """
+        original = self._pending.get(digest)
+        if original is None:
+            row = self._connection.execute(
+                "SELECT record_id, uri, date, target FROM digests "
+                "WHERE digest = ?", (digest,)).fetchone()
+            if row is None or (self.target is not None and
+                               row[3] == self.target):
+                return None
+            original = row
+        if record_id is not None and original[0] == record_id:
+            return None
+        return tuple(original[:3])
+
+    def add(self, digest, record_id, uri, date, filename=None):
+        """
+        Add a written record as the original record of its payload digest,
+        pending until commit(). A digest already in the index is not
+        replaced.
+
+        :digest: Payload digest
+        :record_id: WARC-Record-ID of the record
+        :uri: WARC-Target-URI of the record
+        :date: WARC-Date of the record
+        :filename: Name of the WARC file the record was written into
+        """
+        self._pending.setdefault(digest, (record_id, uri, date, filename))
+
+    def commit(self):
+        """
+        Replace the records of an earlier migration of the same target with
+        the pending records in the database, in a single transaction.
+        """
+        with self._connection:
+            if self.target is not None:
+                self._connection.execute(
+                    "DELETE FROM digests WHERE target = ?", (self.target,))
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO digests "
+                "(digest, record_id, uri, date, filename, target) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((digest,) + original + (self.target,)
+                 for digest, original in self._pending.items()))
+        self._pending = {}
+
+    def close(self):
+        """
+        Close the database, discarding the pending records.
+        """
+        self._pending = {}
+        self._connection.close()
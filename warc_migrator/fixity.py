@@ -0,0 +1,315 @@
+"""
+Fixity digests of the source and target files of a migration, computed from
+the bytes read and written by the migration instead of separate passes over
+the files.
+"""
+import hashlib
+import io
+import os
+
+from warc_migrator.compression import COPY_BLOCK_SIZE
+
+FIXITY_ALGORITHMS = ("md5", "sha256")  # Default algorithms
+MANIFEST_EXTENSION = "manifest"        # Extension of the sidecar manifest
+
+
+def fixity_algorithms():
+    """
+    Resolve the algorithms available for the fixity digests.
+
+    :returns: Sorted list of hashlib algorithm names, without the
+              variable length SHAKE algorithms
+    """
+    return sorted(name for name in hashlib.algorithms_available
+                  if not name.startswith("shake_"))
+
+
+def make_digesters(algorithms):
+    """
+    Create the digesters of the given algorithms.
+
+    :algorithms: Iterable of hashlib algorithm names, e.g. "md5", "sha256"
+    :returns: Dict of the algorithm names and hashlib objects
+    :raises: ValueError if an algorithm is not available
+    """
+    digesters = {}
+    for name in algorithms:
+        if name not in fixity_algorithms():
+            raise ValueError("Unknown fixity algorithm %s." % name)
+        digesters[name] = hashlib.new(name)
+    return digesters
+
+
+def file_digests(path, algorithms):
+    """
+    Compute the fixity digests of a file by reading it.
+
+    :path: File path
+    :algorithms: Iterable of hashlib algorithm names
+    :returns: Dict of the algorithm names and hex digests
+    """
+    digesters = make_digesters(algorithms)
+    _digest_file(digesters, path, 0)
+    return {name: digester.hexdigest()
+            for name, digester in digesters.items()}
+
+
+def _digest_file(digesters, path, start, end=None):
+    """
+    Update digesters with a part of a file.
+
+    :digesters: Dict of hashlib objects
+    :path: File path
+    :start: Offset of the part
+    :end: End offset of the part, None for the end of the file
+    :returns: Offset after the digested bytes
+    """
+    with open(path, "rb") as handler:
+        handler.seek(start)
+        while end is None or start < end:
+            size = COPY_BLOCK_SIZE
+            if end is not None:
+                size = min(size, end - start)
+            data = handler.read(size)
+            if not data:
+                break
+            for digester in digesters.values():
+                digester.update(data)
+            start += len(data)
+    return start
+
+
+def manifest_lines(fixity, directory=None):
+    """
+    Format fixity digests as lines in the BSD style of the checksum tools,
+    one line per file and algorithm, e.g. "SHA256 (target.warc.gz) = ...".
+
+    :fixity: Dict of the file paths and their dicts of algorithm names
+             and hex digests
+    :directory: Directory which the file paths are made relative to, None
+                to keep the paths as they are
+    :returns: Generator of lines without line endings
+    """
+    for path, digests in fixity.items():
+        if directory is not None:
+            path = os.path.relpath(os.path.abspath(path), directory)
+        for algorithm, digest in digests.items():
+            yield "%s (%s) = %s" % (algorithm.upper(), path, digest)
+
+
+def write_manifest(path, fixity):
+    """
+    Write fixity digests into a manifest, which can be checked with
+    "cksum --check" in the directory of the manifest. The file paths are
+    written relative to that directory.
+
+    :path: Manifest file path
+    :fixity: Dict of the file paths and their dicts of algorithm names
+             and hex digests
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path, "w", encoding="utf-8") as manifest:
+        for line in manifest_lines(fixity, directory):
+            manifest.write(line + "\n")
+
+
+class FixityReader(io.RawIOBase):
+    """
+    Read-only source file handler computing the fixity digests of the file
+    from the bytes read through it.
+
+    The bytes are digested in order as the file is read. Bytes read again
+    after a seek backwards are not digested again, and bytes skipped by a
+    seek forwards, or left unread at the end, are read from the file for
+    the digests only.
+    """
+
+    def __init__(self, handler, algorithms=FIXITY_ALGORITHMS):
+        """
+        Initialize reader.
+
+        :handler: Seekable file handler of a file on disk, positioned at
+                  the start
+        :algorithms: Iterable of hashlib algorithm names
+        """
+        super().__init__()
+        self.handler = handler
+        self._digesters = make_digesters(algorithms)
+        self._position = handler.tell()  # Position of the handler
+        self._digested = 0  # Number of digested bytes from the start
+
+    @property
+    def name(self):
+        """
+        Path of the file.
+        """
+        return self.handler.name
+
+    def fileno(self):
+        """
+        File descriptor of the file.
+        """
+        return self.handler.fileno()
+
+    def readable(self):
+        """
+        The file is readable.
+        """
+        return True
+
+    def seekable(self):
+        """
+        The file is seekable.
+        """
+        return True
+
+    def tell(self):
+        """
+        Current position in the file.
+        """
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """
+        Move to a new position in the file.
+
+        :offset: Offset relative to whence
+        :whence: io.SEEK_SET, io.SEEK_CUR or io.SEEK_END
+        :returns: New position
+        """
+        self._position = self.handler.seek(offset, whence)
+        return self._position
+
+    def _update(self, data):
+        """
+        Digest the bytes read at the current position, and move the
+        position after them.
+
+        :data: Bytes read
+        :returns: The same bytes
+        """
+        end = self._position + len(data)
+        if self._digested < self._position and data:
+            self._digested = _digest_file(self._digesters, self.name,
+                                          self._digested, self._position)
+        if self._digested < end:
+            view = memoryview(data)[self._digested - end:]
+            for digester in self._digesters.values():
+                digester.update(view)
+            self._digested = end
+        self._position = end
+        return data
+
+    def read(self, size=-1):
+        """
+        Read at most the given number of bytes.
+
+        :size: Maximum number of bytes, negative to read to the end
+        :returns: Bytes read, empty at the end of the file
+        """
+        return self._update(self.handler.read(size))
+
+    def read1(self, size=-1):
+        """
+        Read at most the given number of bytes with at most one read of
+        the underlying file.
+
+        :size: Maximum number of bytes, negative for any number
+        :returns: Bytes read, empty at the end of the file
+        """
+        return self._update(self.handler.read1(size))
+
+    def readinto(self, buff):
+        """
+        Read bytes into the given buffer.
+
+        :buff: Writable buffer
+        :returns: Number of bytes read, 0 at the end of the file
+        """
+        count = self.handler.readinto(buff)
+        self._update(memoryview(buff)[:count])
+        return count
+
+    def readline(self, size=-1):
+        """
+        Read a line.
+
+        :size: Maximum number of bytes, negative for no limit
+        :returns: Line with the line ending, empty at the end of the file
+        """
+        return self._update(self.handler.readline(size))
+
+    def digests(self):
+        """
+        Finish the digests with the bytes which have not been read, also if
+        the file has been closed.
+
+        :returns: Dict of the algorithm names and hex digests
+        """
+        self._digested = _digest_file(self._digesters, self.name,
+                                      self._digested)
+        return {name: digester.hexdigest()
+                for name, digester in self._digesters.items()}
+
+    def close(self):
+        """
+        Close the file.
+        """
+        self.handler.close()
+        super().close()
+
+
+class FixityWriter:
+    """
+    Tee for the target file, which computes the fixity digests of the
+    bytes written to the file.
+    """
+
+    def __init__(self, out, algorithms=FIXITY_ALGORITHMS):
+        """
+        Initialize tee. The bytes already in the file before the current
+        position, e.g. of a resumed part file, are read for the digests.
+
+        :out: Target file handler
+        :algorithms: Iterable of hashlib algorithm names
+        """
+        self.out = out
+        self._digesters = make_digesters(algorithms)
+        if out.tell():
+            _digest_file(self._digesters, out.name, 0, out.tell())
+
+    def write(self, data):
+        """
+        Write data to the target and digest it.
+
+        :data: Bytes
+        """
+        self.out.write(data)
+        for digester in self._digesters.values():
+            digester.update(data)
+
+    def flush(self):
+        """
+        Flush the target.
+        """
+        self.out.flush()
+
+    def fileno(self):
+        """
+        File descriptor of the target.
+        """
+        return self.out.fileno()
+
+    def close(self):
+        """
+        Close the target.
+        """
+        self.out.close()
+
+    def digests(self):
+        """
+        :returns: Dict of the algorithm names and hex digests of the bytes
+                  written so far
+        """
+        return {name: digester.hexdigest()
+                for name, digester in self._digesters.items()}
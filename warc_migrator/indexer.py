@@ -0,0 +1,240 @@
+"""
+CDXJ and CDX index of the written WARC file.
+"""
+import heapq
+import json
+import re
+import tempfile
+import urllib.parse
+
+from warcio.archiveiterator import ArchiveIterator
+
+INDEX_FORMATS = ("cdxj", "cdx")
+INDEXED_RECORDS = ("response", "resource", "revisit")
+CDX_HEADER = " CDX N b a m s k r M S V g\n"
+MAX_INDEX_LINES = 100000  # Index lines sorted in memory before spooling
+
+
+def surt(uri):
+    """
+    Canonicalize a URI into a SURT form used as the sort key of an index,
+    e.g. "http://www.Example.com/a?b=1&a=2" to "com,example)/a?a=2&b=1".
+
+    This is a simplified version of the canonicalization of the common
+    indexers: the scheme, www prefix and default ports are dropped, the host
+    is reversed, the query arguments are sorted and everything is
+    lowercased.
+
+    :uri: URI
+    :returns: SURT key
+    """
+    parts = urllib.parse.urlsplit(uri.strip())
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        return uri.strip().lower()
+
+    host = parts.hostname.lower().strip(".")
+    host = re.sub(r"^www\d*\.", "", host)
+    key = ",".join(reversed(host.split(".")))
+    if parts.port and parts.port not in (80, 443):
+        key += ":%d" % parts.port
+    key += ")" + (parts.path or "/")
+    if parts.query:
+        key += "?" + "&".join(sorted(parts.query.split("&")))
+    return key.lower()
+
+
+def index_entry(record):
+    """
+    Collect the index fields of a written record.
+
+    :record: Warcio record, with the digests computed by the writer
+    :returns: Dict of index fields, or None if the record is not indexed
+    """
+    if record.rec_type not in INDEXED_RECORDS:
+        return None
+    uri = record.rec_headers.get_header("WARC-Target-URI")
+    if not uri:
+        return None
+
+    entry = {
+        "urlkey": surt(uri),
+        "timestamp": "".join(
+            re.findall(r"\d", record.rec_headers.get_header(
+                "WARC-Date", "")))[:14],
+        "url": uri,
+        "mime": record.content_type or "-",
+        "status": "-",
+        "digest": "-"
+    }
+    if record.rec_type == "revisit":
+        entry["mime"] = "warc/revisit"
+    elif record.http_headers:
+        status, mime = _http_fields(record.http_headers)
+        entry["status"] = status or "-"
+        entry["mime"] = mime or "unk"
+    entry["mime"] = entry["mime"].split(";")[0].strip()
+
+    digest = record.rec_headers.get_header("WARC-Payload-Digest")
+    if digest:
+        entry["digest"] = digest.split(":", 1)[-1]
+    return entry
+
+
+def _http_fields(http_headers):
+    """
+    Resolve the status code and MIME type of HTTP headers. The headers are
+    either Warcio's parsed headers, or the raw headers of SimpleHeader.
+
+    :http_headers: HTTP headers of a record
+    :returns: Tuple of status code and MIME type, None if not found
+    """
+    if hasattr(http_headers, "get_statuscode"):
+        return (http_headers.get_statuscode(),
+                http_headers.get_header("Content-Type"))
+
+    lines = http_headers.headers_buff.decode("latin-1").splitlines()
+    status = None
+    if lines:
+        fields = lines[0].split(" ", 2)
+        if len(fields) > 1 and fields[1].isdigit():
+            status = fields[1]
+    mime = None
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-type":
+            mime = value.strip()
+            break
+    return status, mime
+
+
+class CdxWriter:
+    """
+    Writer of a sorted CDXJ or CDX11 index of a WARC file.
+
+    The entries are collected while the WARC file is written, and they are
+    sorted and written when the writer is closed. At most the given number
+    of lines is kept in memory: full buffers are sorted and spooled into
+    temporary files as sorted runs, which are merged into the index.
+    """
+
+    def __init__(self, path, warc_filename, index_format="cdxj",
+                 max_lines=MAX_INDEX_LINES):
+        """
+        Initialize writer.
+
+        :path: Index file path
+        :warc_filename: Name of the indexed WARC file
+        :index_format: "cdxj" or "cdx"
+        :max_lines: Maximum number of lines kept in memory
+        """
+        if index_format not in INDEX_FORMATS:
+            raise ValueError("Unknown index format %s." % index_format)
+        self.path = path
+        self.warc_filename = warc_filename
+        self.index_format = index_format
+        self.max_lines = max_lines
+        self.lines = []
+        self._runs = []  # Temporary files of the spooled sorted runs
+
+    def add(self, entry, offset, length):
+        """
+        Add an index entry of a written record.
+
+        :entry: Dict of index fields from index_entry(), or None
+        :offset: Offset of the gzip member of the record in the WARC file
+        :length: Length of the gzip member
+        """
+        if entry is None:
+            return
+        if self.index_format == "cdx":
+            self.lines.append(" ".join([
+                entry["urlkey"], entry["timestamp"],
+                entry["url"].replace(" ", "%20"), entry["mime"],
+                entry["status"], entry["digest"], "-", "-", str(length),
+                str(offset), self.warc_filename]) + "\n")
+        else:
+            fields = {"url": entry["url"], "mime": entry["mime"]}
+            for name in ("status", "digest"):
+                if entry[name] != "-":
+                    fields[name] = entry[name]
+            fields.update({"length": str(length), "offset": str(offset),
+                           "filename": self.warc_filename})
+            self.lines.append("%s %s %s\n" % (
+                entry["urlkey"], entry["timestamp"], json.dumps(fields)))
+        if len(self.lines) >= self.max_lines:
+            self._spool()
+
+    def _spool(self):
+        """
+        Sort the lines in memory and spool them into a temporary file.
+        """
+        run = tempfile.TemporaryFile("w+", encoding="utf-8", newline="\n",
+                                     prefix="warc-migrator.")
+        run.writelines(sorted(self.lines))
+        run.seek(0)
+        self._runs.append(run)
+        self.lines = []
+
+    def close(self):
+        """
+        Write the sorted index, merging the spooled runs, and remove the
+        temporary files.
+        """
+        try:
+            with open(self.path, "w", encoding="utf-8") as out:
+                if self.index_format == "cdx":
+                    out.write(CDX_HEADER)
+                if not self._runs:
+                    out.writelines(sorted(self.lines))
+                    return
+                if self.lines:
+                    self._spool()
+                out.writelines(heapq.merge(*self._runs))
+        finally:
+            for run in self._runs:
+                run.close()
+            self._runs = []
+            self.lines = []
+
+
+class EntryCollector:
+    """
+    Collector of the index entries of records written in a worker process.
+    The collected entries are added to the index writer of the target by
+    CompressingWARCWriter.write_members().
+    """
+
+    def __init__(self):
+        """
+        Initialize collector.
+        """
+        self.entries = []
+
+    def add(self, entry, offset, length):
+        """
+        Collect an index entry of a written record.
+
+        :entry: Dict of index fields from index_entry(), or None
+        :offset: Offset of the gzip member of the record
+        :length: Length of the gzip member
+        """
+        if entry is not None:
+            self.entries.append((entry, offset, length))
+
+
+def index_warc(indexer, warc):
+    """
+    Add the records of an existing compressed WARC file to an index.
+
+    :indexer: Index writer, see CdxWriter
+    :warc: WARC file handler
+    """
+    warc.seek(0)
+    records = ArchiveIterator(warc, no_record_parse=False,
+                              ensure_http_headers=False)
+    for record in records:
+        entry = index_entry(record)
+        if entry is not None:
+            records.read_to_end()
+            indexer.add(entry, records.get_record_offset(),
+                        records.get_record_length())
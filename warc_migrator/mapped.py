@@ -0,0 +1,58 @@
+"""
+Memory-mapped input of uncompressed ARC files.
+"""
+import mmap
+
+from warc_migrator.compression import GZIP_MAGIC
+
+
+class MappedFile(mmap.mmap):
+    """
+    Read-only memory map of a file, used as a file handler by Warctools
+    and Warcio. Parts of the file are served as memoryview slices of the
+    map with view(), without copying them.
+    """
+
+    def view(self, offset, length):
+        """
+        View a part of the file without copying it.
+
+        :offset: Offset of the part
+        :length: Length of the part, cut at the end of the file
+        :returns: memoryview of the part
+        """
+        return memoryview(self)[offset:offset + length]
+
+    def close(self):
+        """
+        Close the map. The users of the views release them when they have
+        been read, see migrator._iter_converted(), so that the map can be
+        closed. If a view is still referenced after all, e.g. in the
+        traceback of a failed migration, the map can not be closed, and it
+        stays open until it is garbage collected. The BufferError is not
+        raised then, so that it does not hide the error of the migration.
+        """
+        try:
+            super().close()
+        except BufferError:
+            pass
+
+    def __exit__(self, *exc_info):
+        """
+        Close the map at the end of a with block.
+        """
+        self.close()
+
+
+def map_file(path):
+    """
+    Map an uncompressed file into memory.
+
+    :path: File path
+    :returns: MappedFile positioned at the start, or None if the file is
+              empty or gzip compressed
+    """
+    with open(path, "rb") as source:
+        if source.read(len(GZIP_MAGIC)) in (b"", GZIP_MAGIC):
+            return None
+        return MappedFile(source.fileno(), 0, access=mmap.ACCESS_READ)
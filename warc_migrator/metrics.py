@@ -0,0 +1,289 @@
+"""
+Metrics of migrations in the Prometheus text exposition format.
+"""
+import copy
+import os
+import tempfile
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+PREFIX = "warc_migrator_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+RECORD_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0,
+                  5.0)
+MIGRATION_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0,
+                     3600.0, 10800.0)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0, 1.2, 1.5, 2.0)
+
+# Name, type, help text and histogram buckets of the metrics
+METRICS = (
+    ("migrations_total", "counter",
+     "Migrated files by result, success or failure.", None),
+    ("source_files_total", "counter",
+     "Source files by format, arc or warc, and compression, uncompressed, "
+     "multi-member or single-member.", None),
+    ("records_total", "counter",
+     "Records written into the migrated files.", None),
+    ("source_bytes_total", "counter",
+     "Bytes read from the source files.", None),
+    ("target_bytes_total", "counter",
+     "Bytes written into the migrated files.", None),
+    ("copied_records_total", "counter",
+     "Records copied from multi-member gzip WARC 1.0 files as they are, "
+     "without recompression.", None),
+    ("rewritten_records_total", "counter",
+     "Records whose WARC headers were rewritten as bytes, without parsing "
+     "the records.", None),
+    ("deduplicated_records_total", "counter",
+     "Response records written as revisit records of an earlier record "
+     "with the same payload digest.", None),
+    ("recompression_fallbacks_total", "counter",
+     "Single-member gzip WARC files recompressed after the migration "
+     "failed on them.", None),
+    ("validation_failures_total", "counter",
+     "Failed validations of the migrated files by tool.", None),
+    ("compression_ratio", "histogram",
+     "Size of the migrated file divided by the size of the source file.",
+     RATIO_BUCKETS),
+    ("record_seconds", "histogram",
+     "Time of reading, fixing and writing a record in seconds.",
+     RECORD_BUCKETS),
+    ("migration_seconds", "histogram",
+     "Time of migrating a file in seconds, including validation.",
+     MIGRATION_BUCKETS),
+)
+
+
+class Metrics:
+    """
+    Counters and histograms of the migrations run in a process.
+
+    The metrics are updated by migrate_to_warc() and WarcFixer, and they
+    can be written into a file, e.g. for the textfile collector of the
+    Prometheus node exporter, or served over HTTP for scraping. The records
+    of the shards migrated in worker processes are counted, but their
+    processing time is not observed.
+    """
+
+    def __init__(self):
+        """
+        Initialize metrics with no observations.
+        """
+        self._lock = threading.Lock()
+        self._values = OrderedDict()  # name -> {labels: value}
+        for name, _, _, _ in METRICS:
+            self._values[name] = OrderedDict()
+
+    def __getstate__(self):
+        """
+        Pickle the values without the lock, to return the metrics from a
+        worker process.
+        """
+        with self._lock:
+            return {"_values": self._values}
+
+    def __setstate__(self, state):
+        """
+        Unpickle the values and create a new lock.
+        """
+        self._lock = threading.Lock()
+        self._values = state["_values"]
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increment a counter.
+
+        :name: Counter name without the prefix, see METRICS
+        :value: Increment
+        :labels: Label names and values
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Add an observation to a histogram.
+
+        :name: Histogram name without the prefix, see METRICS
+        :value: Observed value
+        :labels: Label names and values
+        """
+        key = tuple(sorted(labels.items()))
+        buckets = _buckets(name)
+        with self._lock:
+            values = self._values[name]
+            if key not in values:
+                # Counts of the buckets, the count and the sum
+                values[key] = [[0] * len(buckets), 0, 0.0]
+            histogram = values[key]
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram[0][index] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    def merge(self, other):
+        """
+        Add the values of other metrics, e.g. from a worker process.
+
+        :other: Metrics
+        """
+        # pylint: disable=protected-access
+        with other._lock:
+            others = copy.deepcopy(other._values)
+        with self._lock:
+            for name, values in others.items():
+                ours = self._values[name]
+                for key, value in values.items():
+                    if key not in ours:
+                        ours[key] = value
+                    elif isinstance(value, list):
+                        ours[key] = [
+                            [ours_count + count for ours_count, count
+                             in zip(ours[key][0], value[0])],
+                            ours[key][1] + value[1], ours[key][2] + value[2]]
+                    else:
+                        ours[key] += value
+
+    def render(self):
+        """
+        Serialize the metrics.
+
+        :returns: Metrics in the Prometheus text format
+        """
+        lines = []
+        with self._lock:
+            for name, metric_type, help_text, buckets in METRICS:
+                lines.append("# HELP %s%s %s" % (PREFIX, name, help_text))
+                lines.append("# TYPE %s%s %s" % (PREFIX, name, metric_type))
+                for key, value in self._values[name].items():
+                    if metric_type == "counter":
+                        lines.append(_sample(name, key, value))
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets, value[0]):
+                        cumulative += count
+                        lines.append(_sample(
+                            name + "_bucket",
+                            key + (("le", _number(bound)),), cumulative))
+                    lines.append(_sample(name + "_bucket",
+                                         key + (("le", "+Inf"),), value[1]))
+                    lines.append(_sample(name + "_count", key, value[1]))
+                    lines.append(_sample(name + "_sum", key, value[2]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the metrics into a file. The file is replaced atomically, so
+        a collector never reads a partially written file.
+
+        :path: File path
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, tmp_path = tempfile.mkstemp(prefix=".warc-migrator.",
+                                            dir=directory)
+        try:
+            with os.fdopen(handle, "w") as out:
+                out.write(self.render())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serve the metrics over HTTP in a daemon thread.
+
+        :port: TCP port, 0 for any free port
+        :host: Address to listen on, by default only the local host
+        :returns: HTTPServer, its server_address has the bound port and
+                  shutdown() stops it
+        """
+        # pylint: disable=import-outside-toplevel
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Respond to any GET request with the metrics.
+            """
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                Send the metrics.
+                """
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=W0221
+                """
+                Do not log the requests.
+                """
+
+        server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
+
+
+def _buckets(name):
+    """
+    Resolve the buckets of a histogram.
+
+    :name: Histogram name
+    :returns: Tuple of the upper bounds of the buckets
+    :raises: KeyError if the name is not a histogram
+    """
+    for metric_name, metric_type, _, buckets in METRICS:
+        if metric_name == name and metric_type == "histogram":
+            return buckets
+    raise KeyError(name)
+
+
+def _sample(name, labels, value):
+    """
+    Serialize a sample.
+
+    :name: Metric name without the prefix
+    :labels: Tuple of (name, value) label pairs
+    :value: Sample value
+    :returns: Sample line
+    """
+    if labels:
+        return "%s%s{%s} %s" % (PREFIX, name, ",".join(
+            '%s="%s"' % (label, _escape(str(label_value)))
+            for label, label_value in labels), _number(value))
+    return "%s%s %s" % (PREFIX, name, _number(value))
+
+
+def _escape(value):
+    """
+    Escape a label value.
+
+    :value: Label value
+    :returns: Escaped value
+    """
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"')
+
+
+def _number(value):
+    """
+    Format a sample value.
+
+    :value: Integer or float
+    :returns: Value as a string, integral values without decimals
+    """
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
@@ -1,19 +1,59 @@
 """
 Migrate ARC 1.0/1.1 and WARC 0.17/0.18 to WARC 1.0 and validate it.
 """
+import gzip
+import io
+import json
 import os
 import subprocess
 import tempfile
+import time
 import click
 
-from xml_helpers.utils import decode_utf8
-from warc_migrator.warc_fixer import WarcFixer, recompress_warc
+from warc_migrator.archive_handler import ChunkStream
+from warc_migrator.compression import (BACKENDS, COPY_BLOCK_SIZE,
+                                       DEFAULT_LEVEL, DEFAULT_SPOOL_SIZE,
+                                       GZIP_MAGIC, create_spool,
+                                       resolve_backend, sniff_compression)
+from warc_migrator.checkpoint import CHECKPOINT_INTERVAL, Checkpoint
+from warc_migrator.dedup import DigestIndex
+from warc_migrator.fixity import (FIXITY_ALGORITHMS, MANIFEST_EXTENSION,
+                                  FixityReader, FixityWriter, file_digests,
+                                  fixity_algorithms, make_digesters,
+                                  manifest_lines, write_manifest)
+from warc_migrator.indexer import INDEX_FORMATS, CdxWriter, index_warc
+from warc_migrator.mapped import MappedFile, map_file
+from warc_migrator.metrics import Metrics
+from warc_migrator.stats import Progress, Stats
+from warc_migrator.warc_fixer import WarcFixer, part_name, recompress_warc
+from warc_migrator.validator import (ValidationError, VerifyingWriter,
+                                     validate_warc)
 
-from hanzo.arc2warc import ArcTransformer
-from hanzo.warctools.mixed import MixedRecord
-from hanzo.warctools.warc import WarcRecord
+from warcio.bufferedreaders import DecompressingBufferedReader
 from warcio.exceptions import ArchiveLoadFailed
 
+LINE_LIMIT = 64 * 1024  # Maximum length of the first line read by is_arc()
+RECORD_END = b"\r\n\r\n"  # End of a WARC record written by Warctools
+
+
+def _check_backend(ctx, param, value):
+    """
+    Check that the deflate backend given in the command line is installed,
+    so that only "auto" falls back to zlib.
+
+    :ctx: Click context
+    :param: Click option
+    :value: Deflate backend, see compression.resolve_backend()
+    :returns: The backend as given
+    :raises: click.BadParameter if the backend is not installed
+    """
+    # pylint: disable=unused-argument
+    try:
+        resolve_backend(value)
+    except ValueError as err:
+        raise click.BadParameter(str(err)) from err
+    return value
+
 
 @click.command()
 @click.argument("source_path", metavar="SOURCE",
@@ -24,7 +64,99 @@ from warcio.exceptions import ArchiveLoadFailed
               metavar="<NAME> <VALUE>", default=(),
               help="Warcinfo field name and value to be added to the WARC "
                    "file.")
-def warc_migrator_cli(source_path, target_path, meta):
+@click.option("--streaming/--no-streaming", default=True,
+              help="Stream the records converted from an ARC file directly "
+                   "to the WARC writer instead of an intermediate temporary "
+                   "file. Enabled by default.")
+@click.option("--validation",
+              type=click.Choice(["internal", "external", "inline"]),
+              default="internal", show_default=True,
+              help="Validate the resulted file in-process (internal), "
+                   "with the warcvalid and warcio check commands "
+                   "(external), or while it is written without a separate "
+                   "validation pass (inline).")
+@click.option("--jobs", type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help="Number of threads compressing the records of the "
+                   "resulted file.")
+@click.option("--compression-level", type=click.IntRange(0, 9),
+              default=DEFAULT_LEVEL, show_default=True,
+              help="Compression level of the resulted file, from 0 (no "
+                   "compression) to 9 (smallest file).")
+@click.option("--compression-backend", type=click.Choice(BACKENDS),
+              default="zlib", show_default=True,
+              callback=_check_backend,
+              help="Deflate implementation. zlib-ng and isal need their "
+                   "Python bindings to be installed. auto selects the "
+                   "fastest installed one, or zlib.")
+@click.option("--spool-size", type=click.IntRange(min=0),
+              default=DEFAULT_SPOOL_SIZE, show_default=True,
+              help="Maximum size of a record buffered in memory in bytes. "
+                   "Larger records are buffered in temporary files.")
+@click.option("--index", type=click.Choice(INDEX_FORMATS), default=None,
+              help="Write a CDXJ or CDX index of the resulted file next to "
+                   "it, with the extension .cdxj or .cdx.")
+@click.option("--resume", is_flag=True, default=False,
+              help="Resume an interrupted migration of the same source from "
+                   "the last checkpoint of the existing target.")
+@click.option("--max-size", type=click.IntRange(min=1), default=None,
+              help="Roll the resulted file over to numbered part files "
+                   "TARGET-00001.warc.gz, TARGET-00002.warc.gz, ... when it "
+                   "exceeds the given size in bytes.")
+@click.option("--shards", type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help="Number of worker processes migrating a multi-member "
+                   "gzip compressed WARC file in parallel, cut into shards "
+                   "at gzip member boundaries.")
+@click.option("--pipeline", is_flag=True, default=False,
+              help="Read and decompress the source in a reader thread, and "
+                   "compress and write the records in threads of their own, "
+                   "overlapping the I/O with the migration.")
+@click.option("--mmap", is_flag=True, default=False,
+              help="Read an uncompressed ARC source from a memory map, "
+                   "and the content of its large records from the map "
+                   "without copying it into temporary files. WARC sources "
+                   "are read as usual.")
+@click.option("--passthrough", is_flag=True, default=False,
+              help="Copy the gzip members of WARC 1.0 records with valid "
+                   "digests from a multi-member gzip source as they are, "
+                   "instead of recompressing them.")
+@click.option("--dedup-index", type=click.Path(dir_okay=False),
+              default=None,
+              help="Write response records whose payload is already in the "
+                   "given SQLite digest index as revisit records referring "
+                   "to the original records. The index is created if it "
+                   "does not exist, and the records of the resulted file are "
+                   "added to it after a successful migration.")
+@click.option("--fixity", type=click.Choice(fixity_algorithms()),
+              multiple=True, metavar="ALGORITHM",
+              help="Compute a fixity digest of the source and the resulted "
+                   "file with the given algorithm, e.g. md5 or sha256, "
+                   "while they are read and written, and print it. Can be "
+                   "given several times.")
+@click.option("--fixity-manifest", is_flag=True, default=False,
+              help="Write the fixity digests, by default MD5 and SHA-256, "
+                   "into TARGET.manifest next to the resulted file.")
+@click.option("--progress", is_flag=True, default=False,
+              help="Show the progress, throughput and estimated time left "
+                   "of the migration.")
+@click.option("--stats-json", type=click.Path(dir_okay=False), default=None,
+              help="Write the time, bytes and records of each stage of the "
+                   "migration as JSON into the given file.")
+@click.option("--metrics-file", type=click.Path(dir_okay=False),
+              default=None,
+              help="Write the metrics of the migration in the Prometheus "
+                   "text format into the given file, also if the migration "
+                   "fails.")
+@click.option("--metrics-port", type=click.IntRange(0, 65535), default=None,
+              help="Serve the metrics of the migration in the Prometheus "
+                   "text format on the given local HTTP port while the "
+                   "migration runs.")
+def warc_migrator_cli(source_path, target_path, meta, streaming, validation,
+                      jobs, compression_level, compression_backend,
+                      spool_size, index, resume, max_size, shards, pipeline,
+                      mmap, passthrough, dedup_index, fixity, fixity_manifest,
+                      progress, stats_json, metrics_file, metrics_port):
     """
     WARC Migrator.
 
@@ -37,42 +169,256 @@ def warc_migrator_cli(source_path, target_path, meta):
     TARGET: Target file (warc.gz)
     """
     # \b above is for help formatting of click library
-    count = migrate_to_warc(source_path, target_path, meta)
+    metrics = None
+    server = None
+    if metrics_file or metrics_port is not None:
+        metrics = Metrics()
+    if metrics_port is not None:
+        server = metrics.serve(metrics_port)
+    try:
+        result = migrate_to_warc(source_path, target_path, meta,
+                                 streaming=streaming, validation=validation,
+                                 jobs=jobs,
+                                 compression_level=compression_level,
+                                 compression_backend=compression_backend,
+                                 spool_size=spool_size, index=index,
+                                 resume=resume, max_size=max_size,
+                                 shards=shards, pipeline=pipeline,
+                                 mmap=mmap, passthrough=passthrough,
+                                 dedup_index=dedup_index,
+                                 fixity=fixity or None,
+                                 fixity_manifest=fixity_manifest,
+                                 progress=Progress() if progress else None,
+                                 metrics=metrics)
+    finally:
+        if metrics_file:
+            metrics.write(metrics_file)
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    if stats_json:
+        with open(stats_json, "w") as stats_file:
+            json.dump(result.stats, stats_file, indent=2)
     click.echo("Wrote the migrated warc into {} with {} records.".format(
-        target_path, count))
+        ", ".join(result.parts), result.count))
+    if fixity:
+        for line in manifest_lines(result.fixity):
+            click.echo(line)
 
 
-def migrate_to_warc(source_path, target_path, meta):
+def migrate_to_warc(source_path, target_path, meta, streaming=True,
+                    validation="internal", jobs=1,
+                    compression_level=DEFAULT_LEVEL,
+                    compression_backend="zlib",
+                    spool_size=DEFAULT_SPOOL_SIZE, index=None, resume=False,
+                    checkpoint_interval=CHECKPOINT_INTERVAL, max_size=None,
+                    shards=1, pipeline=False, mmap=False, passthrough=False,
+                    dedup_index=None, fixity=None, fixity_manifest=False,
+                    progress=None, metrics=None):
     """
     Migrate archive file to WARC 1.0.
 
+    The progress is recorded in a checkpoint journal next to the target,
+    which is removed when the target has been written. If the migration
+    is interrupted, it can be resumed from the last checkpoint.
+
     :source_path: Source archive file name
     :target_path: Target WARC file name, will be compressed WARC
     :meta: User given metadata fields that are added to warcinfo record
-    :returns: Number of records written
+    :streaming: True to convert ARC records directly to the target, False
+                to convert via an intermediate temporary file
+    :validation: "internal" to validate the target in-process, "external"
+                 to validate it with warcvalid and warcio check commands,
+                 "inline" to verify the target while it is written
+    :jobs: Number of threads compressing the records of the target
+    :compression_level: Compression level 0-9 of the target
+    :compression_backend: Deflate backend, see
+                          compression.resolve_backend()
+    :spool_size: Maximum size of a record buffered in memory in bytes,
+                 larger records are buffered in temporary files
+    :index: "cdxj" or "cdx" to write an index of the target into a file
+            named after the target with the format as extension, None for
+            no index
+    :resume: True to resume an interrupted migration into an existing
+             target from the last checkpoint
+    :checkpoint_interval: Minimum number of bytes written to the target
+                          between checkpoints
+    :max_size: Size in bytes after which the target is rolled over to the
+               next part file at a record boundary, None for a single
+               target file. The parts are named after the target, e.g.
+               target.warc.gz, target-00001.warc.gz, target-00002.warc.gz
+    :shards: Number of worker processes migrating a multi-member gzip
+             compressed WARC source in parallel. Other sources, resumed and
+             deduplicated migrations are migrated in a single process.
+    :pipeline: True to read and decompress the source in a reader thread,
+               and to compress and write the records in threads of their
+               own, while the records are fixed in the calling thread
+    :mmap: True to read an uncompressed ARC source from a memory map, and
+           the content of its large records from the map without copying
+           it into temporary files. WARC sources are read as usual.
+    :passthrough: True to copy the gzip members of WARC 1.0 records with
+                  valid digests from a multi-member gzip compressed WARC
+                  source as they are, instead of decompressing, fixing and
+                  recompressing them. The warcinfo record is fixed as usual.
+    :dedup_index: Path of an SQLite digest index, possibly shared with other
+                  migrations, to write the response records whose payload
+                  digest is in it as revisit records, see dedup.DigestIndex.
+                  The records of the target are added to the index when the
+                  migration has succeeded, replacing the records of an
+                  earlier migration of the same target. None for no
+                  deduplication.
+    :fixity: Hashlib algorithm names, e.g. ["md5", "sha256"], of the fixity
+             digests of the source and target files, computed from the
+             bytes read and written by the migration. None for no digests,
+             or for the default algorithms with a manifest.
+    :fixity_manifest: True to write the fixity digests into a manifest
+                      named after the target with the extension .manifest,
+                      see fixity.write_manifest()
+    :progress: Progress display updated while the target is written, see
+               stats.Progress, None for no display
+    :metrics: Metrics updated with the result of the migration, see
+              metrics.Metrics, None for no metrics
+    :returns: Number of records written, as a MigrationResult with the
+              other results of the migration
     """
-    if os.path.exists(target_path):
-        raise OSError("Target file already exists.")
-    if os.stat(source_path).st_size == 0:
-        raise OSError("Empty source file.")
+    if validation not in ("internal", "external", "inline"):
+        raise ValueError("Unknown validation mode %s." % validation)
+    if index is not None and index not in INDEX_FORMATS:
+        raise ValueError("Unknown index format %s." % index)
+    if shards > 1 and max_size is not None:
+        raise ValueError("Shards can not be used with a maximum size.")
+    if fixity is None and fixity_manifest:
+        fixity = FIXITY_ALGORITHMS
+    if fixity is not None:
+        fixity = tuple(fixity)
+        make_digesters(fixity)
+    # Resolved once for all the writers of the migration
+    compression_backend = resolve_backend(compression_backend)
+    start = time.perf_counter()
+    validator = "inline"  # Validation raising a ValidationError
+    dedup = None
+    try:
+        if os.stat(source_path).st_size == 0:
+            raise OSError("Empty source file.")
+        checkpoint = Checkpoint(target_path + ".checkpoint", source_path,
+                                interval=checkpoint_interval)
+        resume_from = None
+        if os.path.exists(target_path):
+            if resume:
+                resume_from = checkpoint.load()
+            if resume_from is None:
+                raise OSError("Target file already exists.")
+
+        # xml_helpers imports lxml, so it is not imported at module level
+        # pylint: disable=import-outside-toplevel
+        from xml_helpers.utils import decode_utf8
+        given_warcinfo = {}
+        for field in meta:
+            if given_warcinfo.get(decode_utf8(field[0])):
+                given_warcinfo[decode_utf8(field[0])].append(
+                    decode_utf8(field[1]))
+            else:
+                given_warcinfo[decode_utf8(field[0])] = [decode_utf8(field[1])]
 
-    given_warcinfo = {}
-    for field in meta:
-        if given_warcinfo.get(decode_utf8(field[0])):
-            given_warcinfo[decode_utf8(field[0])].append(decode_utf8(field[1]))
+        stats = Stats(os.path.getsize(source_path), progress)
+        if dedup_index is not None:
+            dedup = DigestIndex(dedup_index,
+                                target=os.path.abspath(target_path))
+        warc_migr = WarcMigrator(source_path, target_path, given_warcinfo,
+                                 streaming=streaming,
+                                 verify=(validation == "inline"), jobs=jobs,
+                                 compression_level=compression_level,
+                                 compression_backend=compression_backend,
+                                 spool_size=spool_size, index=index,
+                                 checkpoint=checkpoint, resume=resume_from,
+                                 max_size=max_size, shards=shards,
+                                 pipeline=pipeline, mmap=mmap,
+                                 passthrough=passthrough, dedup=dedup,
+                                 fixity=fixity, stats=stats,
+                                 metrics=metrics)
+        arc_file = is_arc(source_path)
+        if metrics is not None:
+            _count_source(metrics, source_path, arc_file)
+        if arc_file:
+            count = warc_migr.migrate_arc()
         else:
-            given_warcinfo[decode_utf8(field[0])] = [decode_utf8(field[1])]
+            count = warc_migr.migrate_warc()
+        checkpoint.remove()
 
-    warc_migr = WarcMigrator(source_path, target_path, given_warcinfo)
-    if is_arc(source_path):
-        count = warc_migr.migrate_arc()
-    else:
-        count = warc_migr.migrate_warc()
+        # The part written before resuming is not verified inline
+        resumed = resume_from and (resume_from["offset"] or
+                                   resume_from["part"])
+        for path in warc_migr.parts:
+            if validation == "internal" or \
+                    (validation == "inline" and resumed):
+                validator = "internal"
+                with stats.stage("validate"):
+                    records = validate_warc(path)
+                stats.add("validate", os.path.getsize(path), records)
+            elif validation == "external":
+                for tool in ("warctools", "warcio"):
+                    validator = tool
+                    with stats.stage("validate:" + tool):
+                        run_validation(tool, path)
+                    stats.add("validate:" + tool, os.path.getsize(path))
+        fixity_digests = warc_migr.fixity_digests()
+        if fixity_manifest:
+            write_manifest("%s.%s" % (target_path, MANIFEST_EXTENSION),
+                           fixity_digests)
+        if dedup is not None:
+            # The records are referred to only after they are validated
+            dedup.commit()
+    except Exception as error:
+        if metrics is not None:
+            metrics.inc("migrations_total", result="failure")
+            if isinstance(error, ValidationError):
+                metrics.inc("validation_failures_total", tool=validator)
+        raise
+    finally:
+        if dedup is not None:
+            dedup.close()
+    stats.finish()
 
-    run_validation("warctools", target_path)
-    run_validation("warcio", target_path)
+    result = MigrationResult(count, target_path,
+                             verification=warc_migr.verification,
+                             parts=warc_migr.parts, stats=stats.as_dict(),
+                             fixity=fixity_digests)
+    if metrics is not None:
+        _count_result(metrics, result, stats.source_size,
+                      time.perf_counter() - start)
+    return result
 
-    return count
+
+def _count_source(metrics, source_path, arc_file):
+    """
+    Count the source file by its format and compression.
+
+    :metrics: Metrics, see metrics.Metrics
+    :source_path: Source archive file name
+    :arc_file: True for ARC file, False for WARC
+    """
+    with open(source_path, "rb") as source:
+        compression = sniff_compression(source)
+    metrics.inc("source_files_total", format="arc" if arc_file else "warc",
+                compression=compression)
+
+
+def _count_result(metrics, result, source_size, seconds):
+    """
+    Count a successful migration.
+
+    :metrics: Metrics, see metrics.Metrics
+    :result: MigrationResult
+    :source_size: Size of the source file in bytes
+    :seconds: Time of the migration, including validation
+    """
+    target_size = sum(os.path.getsize(path) for path in result.parts)
+    metrics.inc("migrations_total", result="success")
+    metrics.inc("records_total", result.count)
+    metrics.inc("source_bytes_total", source_size)
+    metrics.inc("target_bytes_total", target_size)
+    metrics.observe("compression_ratio", target_size / source_size)
+    metrics.observe("migration_seconds", seconds)
 
 
 def run_validation(tool, filename, stdout=subprocess.PIPE):
@@ -101,6 +447,8 @@ def run_validation(tool, filename, stdout=subprocess.PIPE):
         stderr = ""
 
     if returncode != 0:
+        # pylint: disable=import-outside-toplevel
+        from xml_helpers.utils import decode_utf8
         error = "\n".join(
             ["Failed: returncode %s" % returncode, decode_utf8(stdout),
              decode_utf8(stderr)])
@@ -110,50 +458,262 @@ def run_validation(tool, filename, stdout=subprocess.PIPE):
 
 def is_arc(source_path):
     """
-    Resolve with Warctools whether a file is an ARC file or WARC file
+    Resolve whether a file is an ARC file or WARC file the same way as
+    Warctools: a WARC file starts with WARC on the first non-empty line.
+    The line is read without Warctools, so that it is not imported for
+    WARC files.
 
     :source_path: Archive file path.
     :returns: True for ARC file, False for WARC
     """
-    arc_file = True
-    handler = MixedRecord.open_archive(filename=source_path, gzip="auto")
-    try:
-        for record in handler:
-            if isinstance(record, WarcRecord):
-                arc_file = False
-            break
-    finally:
-        handler.close()
+    with open(source_path, "rb") as source:
+        stream = source
+        if source.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+            stream = gzip.GzipFile(fileobj=source, mode="rb")
+        source.seek(0)
+        line = stream.readline(LINE_LIMIT)
+        while line:
+            if line not in (b"\n", b"\r\n", b"\r"):
+                return not line.startswith(b"WARC")
+            line = stream.readline(LINE_LIMIT)
 
-    return arc_file
+    return True
 
 
-def convert(infile, out):
+def convert(infile, out, spool_size=DEFAULT_SPOOL_SIZE, mmap=False):
     """
     Convert ARC to WARC with using Warctools.
 
-    :infile: ARC filename
+    :infile: ARC filename or file handler, closed after the conversion
     :out: WARC file handler
+    :spool_size: Maximum size of record content kept in memory in bytes
+    :mmap: True to read an uncompressed ARC file from a memory map
     """
     count = 0
-    arc = ArcTransformer()
-    file_handler = MixedRecord.open_archive(filename=infile, gzip="auto")
-    try:
-        for record in file_handler:
-            warcs = arc.convert(record)
-            for warcrecord in warcs:
-                warcrecord.write_to(out, gzip=False)
+    with _open_file(infile, mmap) as arc_file:
+        for warcrecord in _iter_converted(arc_file, spool_size):
+            warcrecord.write_to(out, gzip=False)
+            count += 1
+
+    return count
+
+
+def _open_file(infile, mmap=False):
+    """
+    Open an ARC or WARC file, from a memory map if requested and the file
+    is uncompressed.
+
+    :infile: File name, or a file handler opened by the caller, which is
+             returned as it is
+    :mmap: True to map an uncompressed file into memory
+    :returns: File handler or mapped.MappedFile
+    """
+    if not isinstance(infile, str):
+        return infile
+    if mmap:
+        mapped = map_file(infile)
+        if mapped is not None:
+            return mapped
+    return open(infile, "rb")
 
-            count += len(warcs)
 
+def _iter_converted(arc_file, spool_size=DEFAULT_SPOOL_SIZE):
+    """
+    Convert ARC records to WARC records with using Warctools.
+
+    :arc_file: ARC file handler
+    :spool_size: Maximum size of record content kept in memory in bytes
+    :returns: Generator of Warctools WARC records
+    """
+    # Warctools and the ARC converter are imported only for ARC files
+    # pylint: disable=import-outside-toplevel
+    from hanzo.warctools.mixed import MixedRecord
+    from warc_migrator.arc_transformer import SpoolingArcTransformer
+
+    arc = SpoolingArcTransformer(spool_size)
+    file_handler = MixedRecord.open_archive(file_handle=arc_file,
+                                            gzip="auto")
+    try:
+        for record in file_handler:
+            for warcrecord in arc.convert(record):
+                content = warcrecord.content_file
+                try:
+                    yield warcrecord
+                finally:
+                    # The record has been written, so the content served
+                    # from a mapped ARC file is released for closing the map
+                    if isinstance(content, ChunkStream):
+                        content.release()
     finally:
         file_handler.close()
 
-    return count
 
+class ConvertedArcStream(io.RawIOBase):
+    """
+    Read-only stream of uncompressed WARC records converted on the fly from
+    an ARC file. Only one converted record is buffered at a time, in a
+    temporary file if it is larger than the spool size. The large records
+    of a memory-mapped ARC file are not buffered, their content is read
+    from the map.
+    """
+
+    def __init__(self, infile, spool_size=DEFAULT_SPOOL_SIZE, stats=None,
+                 mmap=False):
+        """
+        Initialize stream.
+
+        :infile: ARC filename or file handler, closed with the stream
+        :spool_size: Maximum size of a record buffered in memory in bytes
+        :stats: Statistics of the migration, the conversion is timed as
+                stage "convert", see stats.Stats
+        :mmap: True to read an uncompressed ARC file from a memory map
+        """
+        super().__init__()
+        self.count = 0  # Number of converted records read so far
+        self.spool_size = spool_size
+        self.stats = stats if stats is not None else Stats()
+        self._arc_file = _open_file(infile, mmap)
+        self._spools = self._iter_spools()
+        self._spool = None
+
+    @property
+    def position(self):
+        """
+        Position of the conversion in the ARC file.
+        """
+        return self._arc_file.tell()
+
+    def _iter_spools(self):
+        """
+        Serialize the converted records one by one.
+
+        :returns: Generator of spooled serialized WARC records, or of
+                  ChunkStreams of the records with mapped content
+        """
+        for warcrecord in _iter_converted(self._arc_file, self.spool_size):
+            self.count += 1
+            content = warcrecord.content_file
+            if isinstance(content, ChunkStream):
+                # Serialize only the header, the content is not copied
+                warcrecord.content_file = io.BytesIO()
+                header = io.BytesIO()
+                warcrecord.write_to(header, gzip=False)
+                yield ChunkStream(
+                    [header.getvalue()[:-len(RECORD_END)]] +
+                    content.chunks + [RECORD_END])
+                continue
+            spool = create_spool(self.spool_size)
+            warcrecord.write_to(spool, gzip=False)
+            spool.seek(0)
+            yield spool
+
+    def readable(self):
+        """
+        The stream is readable.
+        """
+        return True
+
+    def read(self, size=-1):
+        """
+        Read at most the given number of converted bytes, up to the end of
+        the current record.
+
+        :size: Maximum number of bytes, negative to read to the end
+        :returns: Bytes read, empty at the end of the stream
+        """
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(COPY_BLOCK_SIZE), b""))
+        while size:
+            if self._spool is None:
+                try:
+                    with self.stats.stage("convert"):
+                        self._spool = next(self._spools)
+                except StopIteration:
+                    return b""
+            data = self._spool.read(size)
+            if data:
+                return bytes(data)
+            self._spool.close()
+            self._spool = None
+        return b""
+
+    def readinto(self, buff):
+        """
+        Read converted bytes into the given buffer.
+
+        :buff: Writable buffer
+        :returns: Number of bytes read, 0 at the end of the stream
+        """
+        data = self.read(len(buff))
+        buff[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        """
+        Close the stream and the underlying ARC file.
+        """
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        self._spools.close()
+        self._arc_file.close()
+        super().close()
+
+
+class MigrationResult(int):
+    """
+    Result of a migration. The result is the number of records written,
+    so that it can be used as the record count, with the other results as
+    attributes.
+    """
+
+    def __new__(cls, count, *args, **kwargs):
+        """
+        Create the result with the value of the record count.
+
+        :count: Number of records written
+        """
+        # pylint: disable=unused-argument
+        return super().__new__(cls, count)
+
+    def __init__(self, count, target_path, verification=None, parts=None,
+                 stats=None, fixity=None):
+        """
+        Initialize result.
+
+        :count: Number of records written
+        :target_path: Target WARC file name
+        :verification: Summary dict of the inline verification, None if
+                       the target was not verified while it was written
+        :parts: List of the written WARC file names, if the target was
+                rolled over to several part files
+        :stats: Statistics dict of the stages of the migration, see
+                stats.Stats.as_dict()
+        :fixity: Dict of the source and target file names and their dicts
+                 of fixity algorithm names and hex digests, None if no
+                 digests were computed
+        """
+        super().__init__()
+        self.target_path = target_path
+        self.verification = verification
+        self.parts = parts or [target_path]
+        self.stats = stats
+        self.fixity = fixity
+
+    @property
+    def count(self):
+        """
+        Number of records written.
+        """
+        return int(self)
 
-class ValidationError(Exception):
-    """Exception class for ValidationError"""
+    def as_dict(self):
+        """
+        :returns: Result as a dict
+        """
+        return {"count": self.count, "target": self.target_path,
+                "parts": self.parts, "verification": self.verification,
+                "stats": self.stats, "fixity": self.fixity}
 
 
 class WarcMigrator:
@@ -161,71 +721,375 @@ class WarcMigrator:
     WARC migrator class.
     """
 
-    def __init__(self, source_path, target_path, given_warcinfo):
+    def __init__(self, source_path, target_path, given_warcinfo,
+                 streaming=True, verify=False, jobs=1,
+                 compression_level=DEFAULT_LEVEL, compression_backend="zlib",
+                 spool_size=DEFAULT_SPOOL_SIZE, index=None, checkpoint=None,
+                 resume=None, max_size=None, shards=1, pipeline=False,
+                 mmap=False, passthrough=False, dedup=None, fixity=None,
+                 stats=None, metrics=None):
         """
         Initalize.
 
         :source_path: Source path
         :target_path: Target path
         :given_warcinfo: Given warcinfo fields
+        :streaming: True to stream converted ARC records directly to the
+                    target, False to use an intermediate temporary file
+        :verify: True to verify the target while it is written
+        :jobs: Number of threads compressing the records of the target
+        :compression_level: Compression level 0-9 of the target
+        :compression_backend: Deflate backend of the target
+        :spool_size: Maximum size of a record buffered in memory in bytes
+        :index: Format of the index written next to the target, "cdxj" or
+                "cdx", None for no index
+        :checkpoint: Checkpoint journal of the migration
+        :resume: Checkpoint dict to resume from, None to start from scratch
+        :max_size: Size in bytes after which the target is rolled over to
+                   the next part file, None for a single target file
+        :shards: Number of worker processes migrating a multi-member gzip
+                 compressed WARC source
+        :pipeline: True to overlap the reading, fixing and writing of the
+                   records in threads, see warc_fixer.WarcFixer
+        :mmap: True to read an uncompressed ARC source from a memory map
+        :passthrough: True to copy the gzip members of unchanged records
+                      of a multi-member gzip compressed WARC source, see
+                      warc_fixer.WarcFixer
+        :dedup: Digest index deduplicating the response records, see
+                dedup.DigestIndex, None for no deduplication
+        :fixity: Hashlib algorithm names of the fixity digests of the
+                 source and target files, see fixity_digests(), None for
+                 no digests
+        :stats: Statistics of the migration, see stats.Stats
+        :metrics: Metrics of the migration, see metrics.Metrics
         """
         self.source_path = source_path
         self.target_path = target_path
         self.given_warcinfo = given_warcinfo
+        self.streaming = streaming
+        self.verify = verify
+        self.jobs = jobs
+        self.compression_level = compression_level
+        self.compression_backend = compression_backend
+        self.spool_size = spool_size
+        self.index = index
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.max_size = max_size
+        self.shards = shards
+        self.pipeline = pipeline
+        self.mmap = mmap
+        self.passthrough = passthrough
+        self.dedup = dedup
+        self.fixity = fixity
+        self.stats = stats if stats is not None else Stats()
+        self.metrics = metrics
+        self.verification = None  # Summary of the inline verification
+        self.parts = []           # Paths of the written target files
+        self.repeated = 0         # Number of records repeated in the parts
+        self._target = None       # Handler of the current target file
+        self._source_reader = None  # FixityReader of the source
+        self._fixity_writers = {}   # Target path -> FixityWriter
 
-    def _fix_warc_file(self, source, orig_arc_file):
+    def _fix_warc_file(self, source, orig_arc_file, sharded=False,
+                       passthrough=False):
         """
         Fix WARC file.
 
         If WARC file is gzipped with a single gzip comprssion, it will be
         recompresed so that each record in the file are compressed separately.
+        Such files are normally detected beforehand in migrate_warc(), this
+        is a fallback for files which are not.
 
         :source: WARC source file handler
         :orig_arc_file: True for WARC migrated from ARC, False otherwise
+        :sharded: True to fix a multi-member gzip compressed source in
+                  shards in parallel
+        :passthrough: True to copy the gzip members of unchanged records of
+                      a multi-member gzip compressed source
         """
         warc_fixer = WarcFixer(self.given_warcinfo,
-                               target_name=os.path.basename(self.target_path))
-        if orig_arc_file:
-            fix_warc = warc_fixer.fix_warc_migrated
-        else:
-            fix_warc = warc_fixer.fix_warc_original
+                               target_name=os.path.basename(self.target_path),
+                               jobs=self.jobs,
+                               compression_level=self.compression_level,
+                               compression_backend=self.compression_backend,
+                               spool_size=self.spool_size,
+                               checkpoint=self.checkpoint,
+                               resume=self.resume, shards=self.shards,
+                               stats=self.stats, metrics=self.metrics,
+                               pipeline=self.pipeline,
+                               passthrough=passthrough, dedup=self.dedup)
 
         try:
-            with open(self.target_path, "wb") as target:
-                count = fix_warc(source, target)
+            count = self._write_target(warc_fixer, orig_arc_file, source,
+                                       sharded)
         except ArchiveLoadFailed as err:
             if "ERROR: non-chunked gzip file detected" in str(err):
+                if self.metrics is not None:
+                    self.metrics.inc("recompression_fallbacks_total")
                 with tempfile.NamedTemporaryFile(prefix="warc-migrator.") as \
                         tmp_warc:
-                    recompress_warc(source, tmp_warc)
-                    with open(self.target_path, "wb") as target:
-                        count = fix_warc(tmp_warc, target)
+                    with self.stats.stage("recompress"):
+                        recompress_warc(source, tmp_warc,
+                                        level=self.compression_level,
+                                        backend=self.compression_backend,
+                                        spool_size=self.spool_size)
+                    self.stats.add("recompress", self.stats.source_size)
+                    self.stats.position = None
+                    count = self._write_target(warc_fixer, orig_arc_file,
+                                               tmp_warc)
             else:
                 raise
 
         return count
 
+    def _write_target(self, warc_fixer, orig_arc_file, source,
+                      sharded=False):
+        """
+        Write the fixed WARC file to the target, or to several part files if
+        the size of the target is limited, through the verifying tee if the
+        target is verified while it is written, and write the index of the
+        target. When resuming, the part file of the last checkpoint is
+        truncated to the checkpoint and the records after it are appended.
+
+        :warc_fixer: WarcFixer
+        :orig_arc_file: True for WARC migrated from ARC, False otherwise
+        :source: WARC source file handler
+        :sharded: True to fix a multi-member gzip compressed source in
+                  shards in parallel
+        :returns: Count of written records
+        """
+        if orig_arc_file:
+            fix_warc = warc_fixer.fix_warc_migrated
+        elif sharded:
+            fix_warc = warc_fixer.fix_warc_sharded
+        else:
+            fix_warc = warc_fixer.fix_warc_original
+        indexer = None
+        if self.index:
+            indexer = CdxWriter(self.index_path,
+                                os.path.basename(self.target_path),
+                                self.index)
+        warc_fixer.indexer = indexer
+        warc_fixer.max_size = self.max_size
+        warc_fixer.open_part = self._open_part
+
+        self.parts = []
+        self._fixity_writers = {}
+        self.verification = None
+        part = 0
+        if self.resume:
+            part = self.resume["part"]
+            for number in range(part + 1):
+                path = part_name(self.target_path, number)
+                with open(path, "r+b") as target:
+                    if number == part:
+                        # Truncating a shorter file would pad it with zeros
+                        if os.fstat(target.fileno()).st_size < \
+                                self.resume["offset"]:
+                            raise ValueError(
+                                "Target file %s is shorter than the last "
+                                "checkpoint." % path)
+                        target.truncate(self.resume["offset"])
+                    if indexer is not None:
+                        indexer.warc_filename = os.path.basename(path)
+                        with self.stats.stage("index"):
+                            index_warc(indexer, target)
+                if number < part:
+                    self.parts.append(path)
+            # Remove the parts written after the last checkpoint
+            number = part + 1
+            while os.path.exists(part_name(self.target_path, number)):
+                os.remove(part_name(self.target_path, number))
+                number += 1
+        elif self.checkpoint is not None:
+            self.checkpoint.reset()
+
+        try:
+            with self.stats.stage("write"):
+                count = fix_warc(source, self._open_part(part))
+        except BaseException:
+            self._close_part(summarize=False)
+            raise
+        self._close_part()
+        self.repeated = warc_fixer.repeated
+        self.stats.add("write", sum(os.path.getsize(path)
+                                    for path in self.parts), count)
+
+        if indexer is not None:
+            with self.stats.stage("index"):
+                indexer.close()
+        return count
+
+    def _open_part(self, part):
+        """
+        Close the current part file and open the part file with the given
+        number.
+
+        :part: Part number, 0 for the target itself
+        :returns: Target file handler, positioned at the end of the file
+        """
+        self._close_part()
+        path = part_name(self.target_path, part)
+        if self.resume and part == self.resume["part"]:
+            target = open(path, "r+b")
+            target.seek(0, os.SEEK_END)
+        else:
+            target = open(path, "wb")
+        self.parts.append(path)
+        if self.fixity is not None:
+            target = self._fixity_writers[path] = FixityWriter(target,
+                                                               self.fixity)
+        if self.verify:
+            target = VerifyingWriter(target)
+        self._target = target
+        return target
+
+    def _close_part(self, summarize=True):
+        """
+        Close the current part file, and add its verification summary to
+        the summary of the whole migration.
+
+        :summarize: False to skip the verification summary of a failed part
+        """
+        target = self._target
+        if target is None:
+            return
+        self._target = None
+        if not self.verify:
+            target.close()
+            return
+
+        target.out.close()
+        if not summarize:
+            return
+        summary = target.summary()
+        if self.verification is None:
+            self.verification = summary
+        else:
+            for key, value in summary.items():
+                self.verification[key] += value
+
+    def _open_source(self, mmap=False):
+        """
+        Open the source file, from a memory map if requested and the file
+        is uncompressed. The fixity digests of a source read from the file
+        are computed while it is read.
+
+        :mmap: True to read an uncompressed source from a memory map
+        :returns: File handler, fixity.FixityReader or mapped.MappedFile
+        """
+        source = _open_file(self.source_path, mmap)
+        if self.fixity is not None and not isinstance(source, MappedFile):
+            source = self._source_reader = FixityReader(source, self.fixity)
+        return source
+
+    def fixity_digests(self):
+        """
+        Fixity digests of the source and the written target files. The
+        digests are computed while the files are read and written, except
+        those of a memory-mapped source and of the part files written
+        before resuming, which are read for the digests.
+
+        :returns: Dict of the source and target file names and their dicts
+                  of algorithm names and hex digests, None if no digests are
+                  computed
+        """
+        if self.fixity is None:
+            return None
+        if self._source_reader is not None:
+            fixity = {self.source_path: self._source_reader.digests()}
+        else:
+            fixity = {self.source_path: file_digests(self.source_path,
+                                                     self.fixity)}
+        for path in self.parts:
+            writer = self._fixity_writers.get(path)
+            if writer is not None:
+                fixity[path] = writer.digests()
+            else:
+                fixity[path] = file_digests(path, self.fixity)
+        return fixity
+
+    @property
+    def index_path(self):
+        """
+        Path of the index file of the target.
+
+        :returns: Target path with the index format as extension, None if
+                  no index is written
+        """
+        if not self.index:
+            return None
+        return "%s.%s" % (self.target_path, self.index)
+
     def migrate_warc(self):
         """
         Migrate WARC 0.17/0.18 file to WARC 1.0
+
+        A WARC file compressed as a single gzip member is decompressed on
+        the fly and the records are recompressed one by one as they are
+        written. A WARC file compressed record by record is migrated in
+        shards in parallel, if more than one shard is requested and the
+        records are not deduplicated, which needs a single process. Otherwise
+        in the pipeline, it is decompressed on the fly as well, so that the
+        decompression is done in the reader thread, unless the gzip members
+        of its unchanged records are copied as they are. A WARC file is not
+        read from a memory map, as warcio copies what it reads from the map
+        as from a file.
         """
-        with open(self.source_path, "rb") as source_buffer:
-            return self._fix_warc_file(source_buffer, False)
+        with self._open_source() as source_buffer:
+            self.stats.position = source_buffer.tell
+            compression = sniff_compression(source_buffer)
+            sharded = (compression == "multi-member" and
+                       self.shards > 1 and not self.resume and
+                       self.dedup is None)
+            passthrough = (compression == "multi-member" and
+                           self.passthrough and not sharded)
+            if compression == "single-member" or \
+                    (compression == "multi-member" and self.pipeline and
+                     not sharded and not passthrough):
+                return self._fix_warc_file(
+                    DecompressingBufferedReader(
+                        source_buffer, read_all_members=True),
+                    False)
+            return self._fix_warc_file(source_buffer, False, sharded=sharded,
+                                       passthrough=passthrough)
 
     def migrate_arc(self):
         """
         Migrate ARC 1.0/1.1 file to WARC 1.0
+
+        In streaming mode the converted records are read directly by the
+        fixer. Otherwise they are first written to a temporary file.
         """
-        with tempfile.NamedTemporaryFile(prefix="warc-migrator.") as \
-                source_buffer:
-            count = convert(self.source_path, source_buffer)
-            source_buffer.seek(0)
+        if self.streaming:
+            with ConvertedArcStream(self._open_source(self.mmap),
+                                    self.spool_size,
+                                    self.stats) as source_stream:
+                self.stats.position = lambda: source_stream.position
+                recount = self._fix_warc_file(source_stream, True)
+                count = source_stream.count
+        else:
+            with tempfile.NamedTemporaryFile(prefix="warc-migrator.") as \
+                    source_buffer:
+                with self.stats.stage("convert"):
+                    count = convert(self._open_source(self.mmap),
+                                    source_buffer, self.spool_size)
+                size = source_buffer.tell()
+                source_buffer.seek(0)
+                # The converted records are written in the order of the
+                # ARC records
+                self.stats.position = lambda: \
+                    self.stats.source_size * source_buffer.tell() // \
+                    max(size, 1)
 
-            recount = self._fix_warc_file(source_buffer, True)
+                recount = self._fix_warc_file(source_buffer, True)
+        self.stats.add("convert", self.stats.source_size, count)
 
-        if recount != count:
+        if recount - self.repeated != count:
             raise ValueError("Count mismatch, originally %s records, "
-                             "recounted %s records." % (count, recount))
+                             "recounted %s records." % (
+                                 count, recount - self.repeated))
 
         return recount
 
@@ -0,0 +1,293 @@
+"""
+Staged pipeline overlapping the reading, fixing and writing of records.
+
+The source is read, and decompressed or converted, in a reader thread
+ahead of the fixer, and the fixed records are compressed and written in
+threads behind it. The stages are connected by bounded queues, so the
+memory use stays bounded, and the records are written in their original
+order.
+"""
+import io
+import queue
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from warc_migrator.compression import (COPY_BLOCK_SIZE, CompressingWARCWriter,
+                                       compress_spool, create_spool,
+                                       member_bound)
+
+READ_AHEAD_BLOCK_SIZE = 256 * 1024  # Read size of the reader thread
+READ_AHEAD_DEPTH = 16               # Number of blocks read ahead
+
+
+class ReadAheadReader(io.RawIOBase):
+    """
+    Read-only stream reading the underlying stream in a reader thread, at
+    most the given number of blocks ahead of the consumer. Everything the
+    underlying stream does while it is read, e.g. the decompression of a
+    gzip file or the conversion of an ARC file, is done in the reader
+    thread.
+    """
+
+    def __init__(self, stream, block_size=READ_AHEAD_BLOCK_SIZE,
+                 depth=READ_AHEAD_DEPTH):
+        """
+        Initialize stream and start the reader thread.
+
+        :stream: Underlying stream, not read by others until this stream
+                 is closed
+        :block_size: Read size in bytes
+        :depth: Maximum number of blocks read ahead
+        """
+        super().__init__()
+        self.stream = stream
+        self.block_size = block_size
+        self._blocks = queue.Queue(maxsize=depth)
+        self._block = memoryview(b"")  # Unread part of the current block
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_blocks,
+                                        daemon=True)
+        self._thread.start()
+
+    def _read_blocks(self):
+        """
+        Read the blocks of the underlying stream into the queue, ending with
+        an empty block, or with the exception raised while reading.
+        """
+        while not self._stop.is_set():
+            try:
+                block = self.stream.read(self.block_size)
+            except BaseException as err:  # pylint: disable=broad-except
+                self._blocks.put(err)
+                return
+            self._blocks.put(block)
+            if not block:
+                return
+
+    def readable(self):
+        """
+        The stream is readable.
+        """
+        return True
+
+    def read(self, size=-1):
+        """
+        Read at most the given number of bytes, up to the end of the current
+        block.
+
+        :size: Maximum number of bytes, negative to read to the end
+        :returns: Bytes read, empty at the end of the stream
+        """
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(self.block_size), b""))
+        if size == 0 or not self._next_block():
+            return b""
+        data = self._block[:size]
+        self._block = self._block[size:]
+        return data.tobytes()
+
+    def readinto(self, buff):
+        """
+        Read bytes of the current block into the given buffer.
+
+        :buff: Writable buffer
+        :returns: Number of bytes read, 0 at the end of the stream
+        """
+        if not self._next_block():
+            return 0
+        size = min(len(buff), len(self._block))
+        buff[:size] = self._block[:size]
+        self._block = self._block[size:]
+        return size
+
+    def _next_block(self):
+        """
+        Take the next block from the reader thread, if the current block has
+        been read.
+
+        :returns: False at the end of the stream, True otherwise
+        """
+        if self._block:
+            return True
+        if self._thread is None:
+            return False
+        block = self._blocks.get()
+        if isinstance(block, BaseException):
+            self._join()
+            raise block
+        if not block:
+            self._join()
+            return False
+        self._block = memoryview(block)
+        return True
+
+    def _join(self):
+        """
+        Wait for the reader thread to end.
+        """
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        """
+        Stop the reader thread. The underlying stream is not closed.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            # Make room for the block the thread may be waiting to queue
+            while self._thread.is_alive():
+                try:
+                    self._blocks.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+            self._join()
+        self._block = memoryview(b"")
+        super().close()
+
+
+class PipelinedWARCWriter(CompressingWARCWriter):
+    """
+    WARC writer compressing the records in a pool of threads and writing
+    the compressed members in a writer thread, in the original order.
+
+    The calling thread only serializes the records and computes their
+    digests. At most twice the number of compression threads records wait
+    for the compression and the writer thread, and the calling thread is
+    blocked when there are more. The output is the same as with
+    CompressingWARCWriter.
+    """
+
+    def __init__(self, filebuf, jobs=1, *args, **kwargs):
+        """
+        Initialize writer and start the writer thread.
+
+        :filebuf: Target file handler
+        :jobs: Number of compression threads
+        """
+        super().__init__(filebuf, jobs, *args, **kwargs)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        self._members = queue.Queue(maxsize=2 * jobs)
+        # Guards the offset, the pending size and the number of queued
+        # members, and is notified when a member has been written
+        self._written = threading.Condition()
+        self._queued = 0
+        self._error = None  # Exception raised in the writer thread
+        self._thread = threading.Thread(target=self._run_writer,
+                                        daemon=True)
+        self._thread.start()
+
+    def _write(self, serialize, record):
+        """
+        Serialize a record and queue it for the compression and the writer
+        thread.
+
+        :serialize: Function writing the serialized record into the given
+                    file handler
+        :record: Warcio record or RawRecord
+        """
+        self._raise_error()
+        spool = create_spool(self.spool_size)
+        serialize(spool)
+        length = spool.tell()
+        future = self._executor.submit(compress_spool, spool, self.level,
+                                       self.backend, self.spool_size)
+        with self._written:
+            self._pending_size += member_bound(length)
+            self._queued += 1
+        self._members.put((future, self._index_entry(record), length))
+
+    def reached(self, size):
+        """
+        Check whether the written members have reached the given size, see
+        CompressingWARCWriter.reached().
+
+        :size: Size in bytes
+        :returns: True if the target is at least of the given size
+        """
+        with self._written:
+            if self.offset + self._pending_size < size:
+                return False
+            while self._queued and self.offset < size:
+                self._written.wait()
+        self._raise_error()
+        return self.offset >= size
+
+    def write_members(self, members, entries, records):
+        """
+        Copy gzip members compressed elsewhere to the target after the
+        queued members, see CompressingWARCWriter.write_members().
+        """
+        self._drain()
+        super().write_members(members, entries, records)
+
+    def copy_member(self, source, length, entry):
+        """
+        Copy the gzip member of a record as it is after the queued members,
+        see CompressingWARCWriter.copy_member().
+        """
+        self._drain()
+        super().copy_member(source, length, entry)
+
+    def _run_writer(self):
+        """
+        Write the queued members until the end of the queue. After an error
+        the rest of the members are discarded.
+        """
+        while True:
+            item = self._members.get()
+            if item is None:
+                return
+            try:
+                if self._error is None:
+                    self._write_member(*item)
+            except BaseException as err:  # pylint: disable=broad-except
+                self._error = err
+            finally:
+                with self._written:
+                    self._queued -= 1
+                    self._written.notify_all()
+
+    def _write_member(self, future, entry, length):
+        """
+        Copy a compressed member to the target and close it.
+
+        :future: Future of a spooled gzip member from compress_spool()
+        :entry: Index entry of the record of the member
+        :length: Length of the uncompressed record
+        """
+        with future.result() as member:
+            shutil.copyfileobj(member, self.out, COPY_BLOCK_SIZE)
+            with self._written:
+                self._pending_size -= member_bound(length)
+                self._add_index(entry, member.tell())
+
+    def _drain(self):
+        """
+        Wait until the queued members have been written.
+        """
+        with self._written:
+            while self._queued:
+                self._written.wait()
+        self._raise_error()
+
+    def _raise_error(self):
+        """
+        Raise the exception of the writer thread, if any.
+        """
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        """
+        Write the queued members and stop the writer and compression
+        threads.
+        """
+        if self._thread is None:
+            return
+        self._members.put(None)
+        self._thread.join()
+        self._thread = None
+        super().close()
+        self._raise_error()
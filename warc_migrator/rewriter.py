@@ -0,0 +1,460 @@
+"""
+Rewrite the WARC headers of data records as bytes, without parsing the
+records into Warcio objects.
+
+The fixer only changes the version line of a data record to WARC/1.0, and
+the writer adds the missing digests. When the WARC headers of a record are
+already in the form in which Warcio would serialize them again, the same
+result is produced by rewriting the version line, appending the digest
+headers and streaming the block as it is. Other records are parsed by
+Warcio as before.
+"""
+import re
+from io import BytesIO
+
+from warcio.archiveiterator import ArchiveIterator
+from warcio.limitreader import LimitReader
+from warcio.recordbuilder import RecordBuilder
+from warcio.recordloader import ArcWarcRecordLoader
+from warcio.statusandheaders import StatusAndHeadersParser
+from warcio.utils import BUFF_SIZE, Digester
+
+from warc_migrator.compression import create_spool
+
+VERSION_LINES = tuple(version.encode("ascii") + b"\r\n"
+                      for version in ArcWarcRecordLoader.WARC_TYPES)
+# Header line serialized again as it is by Warcio: printable ASCII, no
+# whitespace around the name or the value, and no continuation lines
+HEADER_LINE = re.compile(
+    rb"([!-9;-~](?:[ !-9;-~]*[!-9;-~])?): [!-~](?:[ -~]*[!-~])?\r\n\Z")
+# Record types whose headers the fixer or the writer changes in other ways
+PARSED_TYPES = ("warcinfo", "revisit")
+MEMORY_BLOCK_SIZE = 64 * 1024  # Blocks up to this size are read at once
+
+
+def _blank(line):
+    """
+    Check whether a header line ends the headers, as in Warcio's parser.
+
+    :line: Header line as bytes
+    :returns: True for an empty line or a line of whitespace
+    """
+    stripped = line.rstrip()
+    if stripped and 0x20 < stripped[-1] < 0x7f:
+        return False
+    return not StatusAndHeadersParser.decode_header(line).rstrip()
+
+
+def _http_lines(stream):
+    """
+    Read the HTTP status line and headers of a block, as Warcio does.
+
+    :stream: Stream of the block
+    :returns: List of the lines, including the empty line if any
+    """
+    lines = []
+    while True:
+        line = stream.readline()
+        lines.append(line)
+        if not line or _blank(line):
+            return lines
+
+
+def _data_fields(headers, repeated):
+    """
+    Resolve the fields of a data record which Warcio would serialize with
+    the same headers, apart from the version line and the digests.
+
+    :headers: RawHeaders of the record
+    :repeated: Set of lowercase header names given more than once
+    :returns: Tuple of the headers, WARC-Type, Content-Length as int,
+              WARC-Target-URI and Content-Type, None if the record has to
+              be parsed by Warcio
+    """
+    # The writer replaces the last of these headers with the value of the
+    # first one
+    if b"content-length" not in headers.names or \
+            b"content-length" in repeated or b"content-type" in repeated:
+        return None
+    length = headers.get_header("Content-Length")
+    if not length.isdigit() or (length != "0" and length[0] == "0"):
+        return None
+    rec_type = headers.get_header("WARC-Type")
+    if rec_type in PARSED_TYPES:
+        return None
+    uri = headers.get_header("WARC-Target-URI")
+    if uri is None:
+        if rec_type in ArcWarcRecordLoader.HTTP_RECORDS:
+            return None
+    elif " " in uri or (uri.startswith("<") and uri.endswith(">")):
+        # Warcio corrects the URI
+        return None
+    return (headers, rec_type, int(length), uri,
+            headers.get_header("Content-Type"))
+
+
+class RawHeaders:
+    """
+    WARC header lines of a record as bytes, with the methods of Warcio's
+    StatusAndHeaders used by the fixer and the indexer.
+    """
+
+    def __init__(self, lines, names):
+        """
+        Initialize headers.
+
+        :lines: List of header lines, without the version line and the
+                empty line
+        :names: Dict of lowercase header names to the index of their first
+                line
+        """
+        self.lines = lines
+        self.names = names
+
+    def get_header(self, name, default_value=None):
+        """
+        Get the value of the first header of the given name.
+
+        :name: Header name, case-insensitive
+        :default_value: Value returned if there is no such header
+        :returns: Header value
+        """
+        index = self.names.get(name.lower().encode("ascii"))
+        if index is None:
+            return default_value
+        return self.lines[index].split(b": ", 1)[1][:-2].decode("utf-8")
+
+    def replace_header(self, name, value):
+        """
+        Replace the value of the last header of the given name, as Warcio
+        does, or add the header if there is no such header.
+
+        :name: Header name, case-insensitive
+        :value: New header value
+        """
+        prefix = name.lower().encode("ascii") + b":"
+        for index in range(len(self.lines) - 1, -1, -1):
+            line = self.lines[index]
+            if line[:len(prefix)].lower() == prefix:
+                self.lines[index] = line[:len(prefix)] + (
+                    " %s\r\n" % value).encode("utf-8")
+                return
+        self.add_header(name, value)
+
+    def add_header(self, name, value):
+        """
+        Add a header after the other headers.
+
+        :name: Header name
+        :value: Header value
+        """
+        self.names.setdefault(name.lower().encode("ascii"), len(self.lines))
+        self.lines.append(("%s: %s\r\n" % (name, value)).encode("utf-8"))
+
+    def to_bytes(self):
+        """
+        Serialize the headers as WARC 1.0 headers.
+
+        :returns: Header block as bytes, ending with the empty line
+        """
+        return b"WARC/1.0\r\n" + b"".join(self.lines) + b"\r\n"
+
+
+class RawHttpHeaders:
+    """
+    Raw HTTP headers of a record, as SimpleHeader in the fixer.
+    """
+
+    def __init__(self, headers_buff):
+        """
+        Initialize headers.
+
+        :headers_buff: HTTP status line and headers as bytes
+        """
+        self.headers_buff = headers_buff
+
+
+class RawRecord:
+    """
+    Data record read as bytes by RecordReader, with the attributes of a
+    Warcio record used by the fixer and the indexer.
+    """
+
+    def __init__(self, rec_type, rec_headers, raw_stream, http_headers,
+                 content_type, payload=None):
+        """
+        Initialize record.
+
+        :rec_type: WARC-Type of the record
+        :rec_headers: RawHeaders of the record
+        :raw_stream: Stream of the block after the HTTP headers
+        :http_headers: RawHttpHeaders read from the block, None if the
+                       record has no HTTP headers
+        :content_type: Content-Type of the record, None if not given
+        :payload: Rest of the block after the HTTP headers if it has been
+                  read from raw_stream into memory, otherwise None
+        """
+        self.format = "warc"
+        self.rec_type = rec_type
+        self.rec_headers = rec_headers
+        self.raw_stream = raw_stream
+        self.http_headers = http_headers
+        self.content_type = content_type
+        self.payload = payload
+        self._spool = None  # Block buffered when the digests are computed
+
+    def ensure_digests(self, spool_size, block=True):
+        """
+        Compute the block and payload digests missing from the headers,
+        as Warcio's WARCWriter does. The rest of the block is buffered for
+        writing, unless it is already in memory.
+
+        :spool_size: Maximum size of the block buffered in memory in bytes
+        :block: False to compute only the payload digest
+        """
+        headers = self.rec_headers
+        block = block and not headers.get_header("WARC-Block-Digest")
+        payload = not (headers.get_header("WARC-Payload-Digest") or
+                       self.rec_type in RecordBuilder.NO_PAYLOAD_DIGEST_TYPES)
+        if not (block or payload):
+            return
+
+        block_digester = Digester("sha1") if block else None
+        payload_digester = Digester("sha1") if payload else None
+        if block_digester and self.http_headers:
+            block_digester.update(self.http_headers.headers_buff)
+        spool = None
+        if self.payload is not None:
+            bufs = (self.payload,)
+        elif self._spool is not None:
+            # Buffered already when the payload digest was computed
+            self._spool.seek(0)
+            bufs = iter(lambda: self._spool.read(BUFF_SIZE), b"")
+        else:
+            spool = self._spool = create_spool(spool_size)
+            bufs = iter(lambda: self.raw_stream.read(BUFF_SIZE), b"")
+        for buf in bufs:
+            if block_digester:
+                block_digester.update(buf)
+            if payload_digester:
+                payload_digester.update(buf)
+            if spool is not None:
+                spool.write(buf)
+        if self._spool is not None:
+            self._spool.seek(0)
+
+        if payload_digester:
+            headers.add_header("WARC-Payload-Digest", str(payload_digester))
+        if block_digester:
+            headers.add_header("WARC-Block-Digest", str(block_digester))
+
+    def write_to(self, out):
+        """
+        Serialize the record as WARC 1.0, and flush the output, which ends
+        the gzip member of GzipMemberWrapper. The payload of a revisit
+        record is left out, as Warcio's WARCWriter does.
+
+        :out: Output file handler
+        """
+        parts = [self.rec_headers.to_bytes()]
+        if self.http_headers:
+            parts.append(self.http_headers.headers_buff)
+        if self.rec_type == "revisit":
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+            parts.append(b"\r\n\r\n")
+            out.write(b"".join(parts))
+            out.flush()
+            return
+        if self.payload is not None:
+            parts += [self.payload, b"\r\n\r\n"]
+            out.write(b"".join(parts))
+            out.flush()
+            return
+
+        out.write(b"".join(parts))
+        stream = self.raw_stream if self._spool is None else self._spool
+        try:
+            for buf in iter(lambda: stream.read(BUFF_SIZE), b""):
+                out.write(buf)
+        finally:
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+        out.write(b"\r\n\r\n")
+        out.flush()
+
+
+class _PrefixedReader:
+    """
+    Stream of bytes already read from a reader, followed by the rest of
+    the reader.
+    """
+
+    def __init__(self, prefix, reader):
+        """
+        Initialize stream.
+
+        :prefix: Bytes read from the reader
+        :reader: Reader positioned after the prefix
+        """
+        self.prefix = prefix
+        self.reader = reader
+        self.offset = 0  # Number of bytes read
+
+    def read(self, size=-1):
+        """
+        Read bytes.
+        """
+        if not self.prefix:
+            data = self.reader.read(size)
+        elif size is None or size < 0 or size > len(self.prefix):
+            data, self.prefix = self.prefix, b""
+            data += self.reader.read(-1 if size is None or size < 0
+                                     else size - len(data))
+        else:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+        self.offset += len(data)
+        return data
+
+    def readline(self, size=-1):
+        """
+        Read a line. The prefix ends at a line end, unless it ends at the
+        end of the reader.
+        """
+        if not self.prefix:
+            line = self.reader.readline(size)
+        else:
+            end = self.prefix.find(b"\n") + 1 or len(self.prefix)
+            if size is not None and 0 <= size < end:
+                end = size
+            line, self.prefix = self.prefix[:end], self.prefix[end:]
+        self.offset += len(line)
+        return line
+
+    def tell(self):
+        """
+        Tell the number of bytes read.
+        """
+        return self.offset
+
+
+class RecordReader(ArchiveIterator):
+    """
+    Iterator over the records of a WARC file, as Warcio's ArchiveIterator.
+
+    Data records whose WARC headers Warcio would serialize as they are, and
+    which the fixer and the writer would change only by the version line
+    and the digests, are returned as RawRecord. The other records are
+    parsed by Warcio.
+
+    The iterator extends the private _next_record() of ArchiveIterator and
+    keeps its state (reader, loader, known_format and member_info) as
+    ArchiveIterator does, so the Warcio version is pinned in setup.py.
+    """
+
+    def __init__(self, fileobj, rewrite=True, **kwargs):
+        """
+        Initialize iterator.
+
+        :fileobj: Source file handler
+        :rewrite: True to return RawRecords, False to parse all records
+                  with Warcio, can be changed while iterating
+        """
+        super().__init__(fileobj, **kwargs)
+        self.rewrite = rewrite
+        self.in_member = False  # The input ended inside a gzip member
+
+    def close(self):
+        """
+        Close the iterator, and note whether the input ended inside a gzip
+        member, e.g. a source cut at a false member boundary. The iterator
+        is closed at the end of the records, so a cut member is noted
+        without decompressing the input again.
+        """
+        decompressor = self.reader.decompressor if self.reader else None
+        self.in_member = decompressor is not None and not decompressor.eof
+        super().close()
+
+    def _next_record(self, next_line):
+        """
+        Read the next record as RawRecord, or parse it with Warcio.
+
+        :next_line: First line of the record if already read
+        :returns: RawRecord or Warcio record
+        """
+        if not self.rewrite or self.known_format == "arc" or \
+                self.no_record_parse or self.ensure_http_headers or \
+                self.check_digests:
+            return super()._next_record(next_line)
+        if next_line is None:
+            next_line = self.reader.readline()
+        if next_line not in VERSION_LINES:
+            return super()._next_record(next_line)
+
+        # The header lines are read up to the empty line, or to the end of
+        # the stream, which ends the headers for Warcio as well
+        lines = []
+        names = {}
+        repeated = set()
+        rewritable = True
+        while True:
+            line = self.reader.readline()
+            if HEADER_LINE.match(line):
+                name = line[:line.index(b":")].lower()
+                if name in names:
+                    repeated.add(name)
+                else:
+                    names[name] = len(lines)
+                lines.append(line)
+                continue
+            if not line or _blank(line):
+                break
+            rewritable = False
+            lines.append(line)
+
+        prefix = next_line + b"".join(lines) + line
+        fields = None
+        if rewritable and line == b"\r\n":
+            fields = _data_fields(RawHeaders(lines, names), repeated)
+        if fields is None:
+            return self._parse(_PrefixedReader(prefix, self.reader))
+
+        headers, rec_type, length, uri, content_type = fields
+        raw_stream = LimitReader(self.reader, length)
+        payload = None
+        if length <= MEMORY_BLOCK_SIZE:
+            payload = raw_stream.read()
+        http_headers = None
+        if length and rec_type in ArcWarcRecordLoader.HTTP_RECORDS and \
+                uri.startswith(ArcWarcRecordLoader.HTTP_SCHEMES):
+            http_lines = _http_lines(raw_stream if payload is None
+                                     else BytesIO(payload))
+            http_headers = b"".join(http_lines)
+            if payload is not None:
+                payload = payload[len(http_headers):]
+            if _blank(http_lines[0]):
+                # Warcio returns empty HTTP headers, which the writer
+                # does not write
+                return self._parse(_PrefixedReader(
+                    prefix + http_headers + (payload or b""), self.reader))
+            http_headers = RawHttpHeaders(http_headers)
+        self.member_info = None
+        self.known_format = "warc"
+        return RawRecord(rec_type, headers, raw_stream, http_headers,
+                         content_type, payload)
+
+    def _parse(self, stream):
+        """
+        Parse a record with Warcio, as ArchiveIterator does.
+
+        :stream: Stream of the record
+        :returns: Warcio record
+        """
+        record = self.loader.parse_record_stream(
+            stream, None, self.known_format, self.no_record_parse,
+            self.ensure_http_headers, self.check_digests)
+        self.member_info = None
+        self.known_format = record.format
+        return record
@@ -0,0 +1,127 @@
+"""
+Scan ARC and WARC files for planning their migration, without writing,
+compressing or validating anything.
+"""
+import gzip
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from warcio.archiveiterator import ArchiveIterator
+from warcio.bufferedreaders import DecompressingBufferedReader
+from warcio.exceptions import ArchiveLoadFailed
+
+from warc_migrator.compression import GZIP_MAGIC, sniff_compression
+from warc_migrator.migrator import LINE_LIMIT, is_arc
+from warc_migrator.warc_fixer import non_ascii_status
+
+# Columns of the inventory, in the order of the CSV file
+SCAN_FIELDS = ("source", "format", "version", "compression", "records",
+               "non_ascii_status", "bytes", "seconds", "error")
+
+
+def scan_file(source_path):
+    """
+    Scan an archive file for its format, version, compression layout,
+    number of records and number of HTTP status lines with non-ASCII
+    characters in the reason phrase. The records are read, and
+    decompressed, but not parsed further.
+
+    :source_path: Archive file path
+    :returns: Dict with the keys of SCAN_FIELDS, error is None unless the
+              file could not be read
+    """
+    result = dict.fromkeys(SCAN_FIELDS)
+    result["source"] = source_path
+    start = time.perf_counter()
+    try:
+        result["bytes"] = os.path.getsize(source_path)
+        if not result["bytes"]:
+            raise ValueError("Empty source file.")
+        result["format"] = "arc" if is_arc(source_path) else "warc"
+        with open(source_path, "rb") as source:
+            if result["format"] == "arc":
+                result["version"] = _arc_version(source)
+            result["compression"] = sniff_compression(source)
+            try:
+                result.update(_scan_records(
+                    source, result["compression"] == "single-member"))
+            except ArchiveLoadFailed as err:
+                # The first member of an ARC file, or of a WARC file with
+                # an unusual first record, is not sniffed reliably
+                if "ERROR: non-chunked gzip file detected" not in str(err):
+                    raise
+                result["compression"] = "single-member"
+                source.seek(0)
+                result.update(_scan_records(source, True))
+    except Exception as err:  # pylint: disable=broad-except
+        result["error"] = str(err) or type(err).__name__
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def _scan_records(source, decompress):
+    """
+    Count the records of an archive file.
+
+    :source: Source file handler
+    :decompress: True to decompress a file compressed as a single gzip
+                 member on the fly
+    :returns: Dict with keys records and non_ascii_status, and version for
+              a WARC file
+    """
+    if decompress:
+        source = DecompressingBufferedReader(source, read_all_members=True)
+    scanned = {"records": 0, "non_ascii_status": 0}
+    for record in ArchiveIterator(fileobj=source, no_record_parse=False,
+                                  verify_http=False, arc2warc=False,
+                                  ensure_http_headers=False):
+        if record.format == "warc" and not scanned["records"]:
+            scanned["version"] = \
+                record.rec_headers.protocol.partition("/")[2] or None
+        if record.http_headers and \
+                non_ascii_status(record.http_headers.statusline):
+            scanned["non_ascii_status"] += 1
+        scanned["records"] += 1
+    return scanned
+
+
+def _arc_version(source):
+    """
+    Resolve the version of an ARC file from the version block of its first
+    record, which Warcio does not keep. The file position is restored.
+
+    :source: Source file handler at the start of the file
+    :returns: Version, e.g. "1.1", None if it is not known
+    """
+    stream = source
+    if source.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=source, mode="rb")
+    source.seek(0)
+    try:
+        lines = (line for line in iter(lambda: stream.readline(LINE_LIMIT),
+                                       b"")
+                 if line not in (b"\n", b"\r\n", b"\r"))
+        # The header line of the first record is followed by the major
+        # and minor version numbers
+        next(lines, None)
+        fields = next(lines, b"").split()
+    finally:
+        source.seek(0)
+    if len(fields) < 2 or not (fields[0].isdigit() and fields[1].isdigit()):
+        return None
+    return "%s.%s" % (int(fields[0]), int(fields[1]))
+
+
+def scan_batch(sources, workers=None):
+    """
+    Scan a batch of archive files in worker processes.
+
+    :sources: List of source archive file paths
+    :workers: Number of worker processes, defaults to the number of CPUs
+    :returns: List of result dicts of scan_file(), in the same order as the
+              sources
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(scan_file, sources))
+
@@ -0,0 +1,334 @@
+"""
+Long-lived migration service taking jobs as JSON lines from stdin or a Unix
+socket, so that the start-up and imports are paid only once.
+"""
+import json
+import os
+import signal
+import socketserver
+import stat
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import click
+
+from warc_migrator.batch import migrate_job
+from warc_migrator.metrics import Metrics
+
+# Keyword arguments of migrate_to_warc() accepted in the options of a job
+OPTIONS = ("streaming", "validation", "jobs", "compression_level",
+           "compression_backend", "spool_size", "index", "resume",
+           "max_size", "pipeline", "mmap", "passthrough", "dedup_index",
+           "fixity", "fixity_manifest")
+
+
+@click.command()
+@click.option("--socket", "socket_path", type=click.Path(dir_okay=False),
+              default=None,
+              help="Listen for jobs on the given Unix socket instead of "
+                   "reading them from stdin.")
+@click.option("--workers", type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help="Number of jobs migrated concurrently in worker "
+                   "processes.")
+@click.option("--metrics-file", type=click.Path(dir_okay=False),
+              default=None,
+              help="Write the metrics of the migrations in the Prometheus "
+                   "text format into the given file, updated after each "
+                   "job.")
+@click.option("--metrics-port", type=click.IntRange(0, 65535), default=None,
+              help="Serve the metrics of the migrations in the Prometheus "
+                   "text format on the given local HTTP port.")
+def warc_migrator_service_cli(socket_path, workers, metrics_file,
+                              metrics_port):
+    """
+    WARC Migrator service.
+
+    Migrate ARC 1.0/1.1 and WARC 0.17/0.18 files to WARC 1.0 files as jobs
+    are received, one JSON object per line, e.g.
+
+    \b
+    {"id": 1, "source": "a.arc", "target": "a.warc.gz",
+     "meta": [["name", "value"]], "options": {"index": "cdxj"}}
+
+    The result of each job is written as a JSON line with keys id, source,
+    target, count, error and seconds, in the order the jobs finish. Jobs
+    are read from stdin until its end, or from the connections to the Unix
+    socket until the service is terminated.
+    """
+    # \b above is for help formatting of click library
+    metrics = None
+    server = None
+    if metrics_file or metrics_port is not None:
+        metrics = Metrics()
+    if metrics_port is not None:
+        server = metrics.serve(metrics_port)
+    service = MigrationService(workers, metrics=metrics,
+                               metrics_file=metrics_file)
+    try:
+        if socket_path is None:
+            service.serve_lines(sys.stdin, sys.stdout)
+        else:
+            signal.signal(signal.SIGTERM, _terminate)
+            socket_server = service.create_server(socket_path)
+            click.echo("Listening for jobs on {}.".format(socket_path),
+                       err=True)
+            try:
+                socket_server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                socket_server.server_close()
+                os.remove(socket_path)
+    finally:
+        service.close()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+def _terminate(signum, frame):
+    """
+    Stop the service on SIGTERM as on SIGINT.
+    """
+    # pylint: disable=unused-argument
+    raise KeyboardInterrupt
+
+
+def parse_job(line, collect_metrics=False):
+    """
+    Parse a job line.
+
+    :line: JSON object with keys source and target, and optionally id,
+           meta as a list of [name, value] pairs of warcinfo fields and
+           options as a dict of other arguments of migrate_to_warc(), see
+           OPTIONS
+    :collect_metrics: True to collect the metrics of the migration
+    :returns: Tuple of the job id and the job tuple of batch.migrate_job()
+    :raises: ValueError if the line is not a valid job
+    """
+    job = json.loads(line)
+    if not isinstance(job, dict):
+        raise ValueError("Job is not a JSON object.")
+    for key in ("source", "target"):
+        if not isinstance(job.get(key), str):
+            raise ValueError("Missing %s path." % key)
+    meta = job.get("meta", [])
+    if not isinstance(meta, list) or not all(
+            isinstance(field, list) and len(field) == 2 and
+            all(isinstance(part, str) for part in field)
+            for field in meta):
+        raise ValueError("The meta fields are not [name, value] pairs.")
+    options = job.get("options", {})
+    if not isinstance(options, dict):
+        raise ValueError("The options are not a JSON object.")
+    unknown = sorted(set(options) - set(OPTIONS))
+    if unknown:
+        raise ValueError("Unknown options %s." % ", ".join(unknown))
+    return job.get("id"), (job["source"], job["target"],
+                           tuple(tuple(field) for field in meta),
+                           collect_metrics, options)
+
+
+class MigrationService:
+    """
+    Service migrating jobs in a pool of worker processes.
+
+    The worker processes are started once and reused for all jobs, so the
+    modules needed in the migration are imported only once per worker.
+    """
+
+    def __init__(self, workers=1, metrics=None, metrics_file=None):
+        """
+        Initialize service.
+
+        :workers: Number of jobs migrated concurrently
+        :metrics: Metrics updated with the metrics of each job, see
+                  metrics.Metrics, None for no metrics
+        :metrics_file: File into which the metrics are written after each
+                       job, None for no file
+        """
+        self.workers = workers
+        self.metrics = metrics
+        self.metrics_file = metrics_file
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()  # Serializes the metrics file writes
+        self._pool_lock = threading.Lock()  # Serializes the pool restarts
+
+    def submit(self, line, respond):
+        """
+        Submit a job.
+
+        :line: Job line as str or UTF-8 bytes, see parse_job()
+        :respond: Function called with the result dict of the job when the
+                  job has finished
+        :returns: Event set after the result has been responded
+        """
+        done = threading.Event()
+        start = time.perf_counter()
+        try:
+            job_id, job = parse_job(line, self.metrics is not None)
+        except ValueError as err:
+            respond({"id": None, "source": None, "target": None,
+                     "count": None, "error": "Invalid job: %s" % err,
+                     "seconds": 0.0})
+            done.set()
+            return done
+
+        def _finish(future):
+            """
+            Respond with the result of the finished job.
+            """
+            try:
+                respond(self._result(job_id, job, future, start))
+            finally:
+                done.set()
+
+        try:
+            future = self._submit(job)
+        except BrokenProcessPool as err:
+            respond({"id": job_id, "source": job[0], "target": job[1],
+                     "count": None,
+                     "error": "Worker processes failed: %s" % err,
+                     "seconds": time.perf_counter() - start})
+            done.set()
+            return done
+        future.add_done_callback(_finish)
+        return done
+
+    def _submit(self, job):
+        """
+        Submit a job to the worker processes. If a worker process has died,
+        e.g. it ran out of memory, the pool of worker processes is broken,
+        and it is replaced with a new pool before the job is submitted. The
+        jobs of the broken pool fail with an error.
+
+        :job: Job tuple of batch.migrate_job()
+        :returns: Future of the job
+        :raises: BrokenProcessPool if the new pool fails too
+        """
+        with self._pool_lock:
+            try:
+                return self._executor.submit(migrate_job, job)
+            except BrokenProcessPool:
+                self._executor.shutdown(wait=False)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers)
+                return self._executor.submit(migrate_job, job)
+
+    def _result(self, job_id, job, future, start):
+        """
+        Create the result dict of a finished job and update the metrics.
+
+        :job_id: Job id given in the job line
+        :job: Job tuple
+        :future: Finished future of batch.migrate_job()
+        :start: Submission time of the job
+        :returns: Result dict
+        """
+        try:
+            result = future.result()
+        except Exception as err:  # pylint: disable=broad-except
+            # The worker process died, e.g. it ran out of memory
+            result = {"count": None, "metrics": None,
+                      "error": str(err) or type(err).__name__}
+        job_metrics = result.pop("metrics")
+        if self.metrics is not None:
+            if job_metrics is not None:
+                self.metrics.merge(job_metrics)
+            if self.metrics_file:
+                with self._lock:
+                    self.metrics.write(self.metrics_file)
+        return {"id": job_id, "source": job[0], "target": job[1],
+                "count": result["count"], "error": result["error"],
+                "seconds": time.perf_counter() - start}
+
+    def serve_lines(self, lines, out):
+        """
+        Migrate the jobs of the given lines and write the results as JSON
+        lines in the order the jobs finish.
+
+        :lines: Iterable of job lines, e.g. stdin
+        :out: Text stream for the results, e.g. stdout
+        """
+        lock = threading.Lock()
+
+        def _respond(result):
+            """
+            Write a result line.
+            """
+            with lock:
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+
+        pending = [self.submit(line, _respond) for line in lines
+                   if line.strip()]
+        for done in pending:
+            done.wait()
+
+    def create_server(self, path):
+        """
+        Create a Unix socket server, which migrates the jobs sent to it and
+        sends the result lines back over the same connection. A connection
+        is closed after the client has closed its end and all of its jobs
+        have finished. A stale socket file of a previous run is replaced.
+
+        :path: Socket file path
+        :returns: Server, run with serve_forever()
+        """
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+        server = _JobServer(path, _JobHandler)
+        server.service = self
+        return server
+
+    def close(self):
+        """
+        Wait for the submitted jobs and stop the worker processes.
+        """
+        with self._pool_lock:
+            self._executor.shutdown(wait=True)
+
+
+class _JobServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Unix socket server handling each connection in its own thread.
+    """
+    daemon_threads = True
+    service = None  # MigrationService of the jobs
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    """
+    Read job lines from a connection and write their results back.
+    """
+
+    def handle(self):
+        """
+        Serve the jobs of the connection.
+        """
+        lock = threading.Lock()
+
+        def _respond(result):
+            """
+            Send a result line, unless the client has disconnected.
+            """
+            with lock:
+                try:
+                    self.wfile.write(
+                        (json.dumps(result) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                except OSError:
+                    pass
+
+        pending = [self.server.service.submit(line, _respond)
+                   for line in self.rfile if line.strip()]
+        for done in pending:
+            done.wait()
+
+
+if __name__ == '__main__':
+    warc_migrator_service_cli()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,225 @@
+"""
+Statistics and progress display of a migration.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+PROGRESS_INTERVAL = 0.5  # Minimum number of seconds between updates
+
+
+def _now():
+    """
+    :returns: List of the wall clock time and the CPU time of the process
+    """
+    return [time.perf_counter(), time.process_time()]
+
+
+class Stats:
+    """
+    Wall clock time, CPU time, bytes and records of the stages of a
+    migration.
+
+    The stages can be nested, e.g. the ARC records are converted while the
+    converted records are written. The time of a nested stage is excluded
+    from the time of the stage around it, so the times of the stages add up
+    to the time of the whole migration. The stages are nested only within
+    a thread, so the stages run in the threads of the pipeline overlap the
+    stages of the main thread. The CPU time is the CPU time of the whole
+    process, including the compression threads but not the worker
+    processes of the shards.
+    """
+
+    def __init__(self, source_size=0, progress=None):
+        """
+        Initialize statistics.
+
+        :source_size: Size of the source file in bytes
+        :progress: Progress display updated while the records are
+                   written, see Progress, None for no display
+        """
+        self.source_size = source_size
+        self.progress = progress
+        self.position = None  # Function returning the position in source
+        self.records = 0      # Number of records written
+        self.stages = OrderedDict()
+        self._start = _now()
+        self._local = threading.local()  # Running stages of each thread
+        self._lock = threading.Lock()
+
+    @property
+    def _stack(self):
+        """
+        [name, start] lists of the running stages of the current thread.
+        """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _stage(self, name):
+        """
+        Get the statistics of a stage, created on first use.
+
+        :name: Stage name
+        :returns: Dict of the statistics of the stage
+        """
+        if name not in self.stages:
+            self.stages[name] = {"wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                 "bytes": 0, "records": 0}
+        return self.stages[name]
+
+    def _add_time(self, name, start, end):
+        """
+        Add the time between two moments to a stage.
+
+        :name: Stage name
+        :start: Start from _now()
+        :end: End from _now()
+        """
+        with self._lock:
+            stage = self._stage(name)
+            stage["wall_seconds"] += end[0] - start[0]
+            stage["cpu_seconds"] += end[1] - start[1]
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the migration.
+
+        :name: Stage name
+        """
+        now = _now()
+        if self._stack:
+            # Pause the stage around this stage
+            self._add_time(self._stack[-1][0], self._stack[-1][1], now)
+        self._stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = _now()
+            self._add_time(name, self._stack.pop()[1], now)
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def add(self, name, size=0, records=0):
+        """
+        Add processed bytes and records to a stage.
+
+        :name: Stage name
+        :size: Number of bytes
+        :records: Number of records
+        """
+        with self._lock:
+            stage = self._stage(name)
+            stage["bytes"] += size
+            stage["records"] += records
+
+    def advance(self, records=1, position=None):
+        """
+        Count written records and update the progress display.
+
+        :records: Number of records written
+        :position: Position in the source file, by default resolved with
+                   the position function
+        """
+        self.records += records
+        if self.progress is None:
+            return
+        if position is None and self.position is not None:
+            position = self.position()
+        self.progress.update(position, self.source_size, self.records,
+                             time.perf_counter() - self._start[0])
+
+    def finish(self):
+        """
+        Finish the progress display.
+        """
+        if self.progress is not None:
+            self.progress.finish(self.records,
+                                 time.perf_counter() - self._start[0])
+
+    def as_dict(self):
+        """
+        :returns: Statistics as a dict, with the throughput of each stage
+        """
+        now = _now()
+        stages = OrderedDict()
+        for name, stage in self.stages.items():
+            stage = dict(stage)
+            seconds = stage["wall_seconds"]
+            stage["mb_per_s"] = stage["bytes"] / seconds / 1e6 \
+                if seconds else None
+            stage["records_per_s"] = stage["records"] / seconds \
+                if seconds else None
+            stages[name] = stage
+        return {"source_bytes": self.source_size,
+                "records": self.records,
+                "wall_seconds": now[0] - self._start[0],
+                "cpu_seconds": now[1] - self._start[1],
+                "stages": stages}
+
+
+class Progress:
+    """
+    Progress display of a migration, with the throughput and the estimated
+    time left based on the position in the source file. The display is
+    updated on one line at most every PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, out=None, interval=PROGRESS_INTERVAL):
+        """
+        Initialize display.
+
+        :out: Output stream, by default stderr
+        :interval: Minimum number of seconds between updates
+        """
+        self.out = out or sys.stderr
+        self.interval = interval
+        self._shown = None  # Elapsed time of the last update
+
+    def update(self, position, size, records, elapsed):
+        """
+        Show the progress, unless it has been shown recently.
+
+        :position: Position in the source file, None if not known
+        :size: Size of the source file
+        :records: Number of records written
+        :elapsed: Elapsed seconds from the start of the migration
+        """
+        if self._shown is not None and elapsed - self._shown < self.interval:
+            return
+        self._shown = elapsed
+        line = "%d records, %.1f records/s" % (records,
+                                               records / max(elapsed, 1e-9))
+        if position and size:
+            left = elapsed * (size - position) / position
+            line = "%5.1f%% %s, %.1f MB/s, ETA %s" % (
+                100.0 * position / size, line, position / elapsed / 1e6
+                if elapsed else 0.0, _duration(left))
+        self.out.write("\r" + line.ljust(79))
+        self.out.flush()
+
+    def finish(self, records, elapsed):
+        """
+        Show the final summary and end the line.
+
+        :records: Number of records written
+        :elapsed: Elapsed seconds from the start of the migration
+        """
+        self.out.write("\r" + ("%d records in %s" % (
+            records, _duration(elapsed))).ljust(79) + "\n")
+        self.out.flush()
+
+
+def _duration(seconds):
+    """
+    Format a duration.
+
+    :seconds: Number of seconds
+    :returns: Duration as H:MM:SS
+    """
+    seconds = int(round(seconds))
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60,
+                             seconds % 60)
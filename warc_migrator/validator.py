@@ -0,0 +1,588 @@
+"""
+Validate WARC files in-process with Warctools and Warcio.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import re
+import zlib
+
+from warcio.recordloader import ArcWarcRecordLoader
+
+GZIP_MAGIC = b"\x1f\x8b"
+BLOCK_SIZE = 64 * 1024
+
+
+class ValidationError(Exception):
+    """Exception class for ValidationError"""
+
+
+def validate_warc(filename):
+    """
+    Validate the WARC file in-process.
+
+    The file is decompressed only once. Each record is parsed and checked
+    with the Warctools WARC parser, as done by warcvalid, and the digests of
+    the record are checked with the Warcio record loader, as done by
+    warcio check. A gzipped file must be compressed record by record.
+
+    :filename: WARC file
+    :returns: Number of validated records
+    :raises: ValidationError if the file is not valid
+    """
+    # Warctools is imported only when a file is validated in-process
+    # pylint: disable=import-outside-toplevel
+    from hanzo.warctools.stream import RecordStream
+    from hanzo.warctools.warc import WarcParser
+
+    count = 0
+    loader = ArcWarcRecordLoader(verify_http=False, arc2warc=False)
+    try:
+        with open(filename, "rb") as warc_file:
+            reader = DecompressingReader(warc_file)
+            handler = RecordStream(reader, WarcParser())
+            for (offset, record, errors) in handler.read_records(limit=None):
+                if errors:
+                    raise ValidationError("warc errors at %s:%d\n%s" % (
+                        filename, offset, errors))
+                if record is None:
+                    break
+                if record.validate():
+                    raise ValidationError("warc errors at %s:%d\n%s" % (
+                        filename, offset, record.validate()))
+                if not reader.is_member_start(offset):
+                    raise ValidationError(
+                        "Non-chunked gzip file detected at %s:%d, gzip "
+                        "member continues beyond single record." % (
+                            filename, offset))
+
+                warc_record = loader.parse_record_stream(
+                    _ChainedReader(reader.pop_lines(), handler),
+                    known_format="warc", check_digests=True)
+                while warc_record.raw_stream.read(BLOCK_SIZE):
+                    pass
+                if warc_record.digest_checker.passed is False:
+                    raise ValidationError("Digest errors at %s:%d\n%s" % (
+                        filename, offset,
+                        "\n".join(warc_record.digest_checker.problems)))
+                reader.pop_lines()  # Drop the lines read from the block
+                count += 1
+    except ValidationError:
+        raise
+    except Exception as err:  # pylint: disable=broad-except
+        raise ValidationError("Validation of %s failed: %s" % (
+            filename, err)) from err
+
+    return count
+
+
+class DecompressingReader:
+    """
+    Sequential reader of the decompressed content of an archive file.
+
+    Gzip members are decompressed one at a time and the offsets where the
+    members start in the decompressed content are recorded. The lines read
+    since the previous call to pop_lines() are kept for re-parsing the
+    record headers.
+    """
+
+    def __init__(self, fileobj):
+        """
+        Initialize reader.
+
+        :fileobj: Compressed or uncompressed source file handler
+        """
+        self.fileobj = fileobj
+        self.position = 0           # Offset in the decompressed content
+        self._buffer = fileobj.read(BLOCK_SIZE)
+        self._decompressor = None
+        self._decompressed = 0      # Decompressed bytes in total
+        self._gzip = self._buffer.startswith(GZIP_MAGIC)
+        self._member_starts = []
+        self._lines = []
+        if self._gzip:
+            self._compressed = self._buffer
+            self._buffer = b""
+            self._fill()
+
+    def _fill(self):
+        """
+        Decompress more content into the buffer.
+
+        :returns: False at the end of the file, True otherwise
+        """
+        if not self._gzip:
+            data = self.fileobj.read(BLOCK_SIZE)
+            self._buffer += data
+            return bool(data)
+
+        while True:
+            if not self._compressed:
+                self._compressed = self.fileobj.read(BLOCK_SIZE)
+                if not self._compressed:
+                    if self._decompressor is not None:
+                        raise ValidationError(
+                            "Truncated gzip member at the end of the file.")
+                    return False
+            if self._decompressor is None:
+                self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                self._member_starts.append(self._decompressed)
+            data = self._decompressor.decompress(self._compressed,
+                                                 BLOCK_SIZE)
+            self._compressed = self._decompressor.unconsumed_tail
+            if self._decompressor.eof:
+                self._compressed = self._decompressor.unused_data
+                self._decompressor = None
+            self._decompressed += len(data)
+            if data:
+                self._buffer += data
+                return True
+
+    def is_member_start(self, offset):
+        """
+        Check whether the given offset of decompressed content is at the
+        start of a gzip member. Uncompressed content has no members, so any
+        offset is accepted.
+
+        :offset: Offset in the decompressed content
+        :returns: True if the offset is at the start of a gzip member
+        """
+        if not self._gzip:
+            return True
+        while self._member_starts and self._member_starts[0] < offset:
+            self._member_starts.pop(0)
+        return bool(self._member_starts) and self._member_starts[0] == offset
+
+    def pop_lines(self):
+        """
+        Return the lines read since the previous call, without the leading
+        blank lines.
+
+        :returns: Lines as bytes
+        """
+        lines = self._lines
+        self._lines = []
+        while lines and re.match(br"^[\r\n]+$", lines[0]):
+            lines.pop(0)
+        return b"".join(lines)
+
+    def tell(self):
+        """
+        :returns: Offset in the decompressed content
+        """
+        return self.position
+
+    def read(self, size=None):
+        """
+        Read decompressed content.
+
+        :size: Maximum number of bytes to read, None for all
+        :returns: Decompressed bytes
+        """
+        while (size is None or len(self._buffer) < size) and self._fill():
+            pass
+        if size is None:
+            size = len(self._buffer)
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        self.position += len(data)
+        return data
+
+    def readline(self, size=None):
+        """
+        Read a line of decompressed content.
+
+        :size: Maximum number of bytes to read, None for no limit
+        :returns: Line as bytes
+        """
+        while True:
+            end = self._buffer.find(b"\n") + 1
+            if end or (size is not None and len(self._buffer) >= size) or \
+                    not self._fill():
+                break
+        if not end:
+            end = len(self._buffer)
+        if size is not None:
+            end = min(end, size)
+        line = self._buffer[:end]
+        self._buffer = self._buffer[end:]
+        self.position += len(line)
+        self._lines.append(line)
+        return line
+
+
+class _ChainedReader:
+    """
+    Reader of the already read header lines followed by the rest of the
+    record from the Warctools record stream.
+    """
+
+    def __init__(self, head, stream):
+        """
+        Initialize reader.
+
+        :head: Header bytes already read
+        :stream: Warctools record stream positioned at the record block
+        """
+        self.head = io.BytesIO(head)
+        self.stream = stream
+
+    def read(self, size=-1):
+        """
+        Read bytes.
+        """
+        data = self.head.read(size)
+        if size is None or size < 0:
+            return data + self.stream.read()
+        if not data:
+            data = self.stream.read(size)
+        return data
+
+    def readline(self, size=-1):
+        """
+        Read a line.
+        """
+        line = self.head.readline(size)
+        if line:
+            return line
+        if size is None or size < 0:
+            return self.stream.readline()
+        return self.stream.readline(size)
+
+
+class VerifyingWriter:
+    """
+    Tee for the compressed WARC output, which writes the output to the
+    target file and verifies it on the fly.
+
+    Each gzip member is decompressed as it is written, which also checks
+    the gzip framing and the CRC and length of the member. The member must
+    contain exactly one WARC 1.0 record, and the block and payload digests
+    of the record are recomputed from the written bytes and compared with
+    the digests in the record header.
+    """
+
+    def __init__(self, out):
+        """
+        Initialize tee.
+
+        :out: Target file handler
+        """
+        self.out = out
+        self.records = 0         # Number of verified records
+        self.digests = 0         # Number of verified digests
+        self.written = 0         # Number of compressed bytes written
+        self._decompressor = None
+        self._record = None
+
+    def write(self, data):
+        """
+        Write compressed data to the target and verify it.
+
+        :data: Compressed bytes
+        :raises: ValidationError if the written data is not valid
+        """
+        self.out.write(data)
+        self.written += len(data)
+        pending = False  # Decompressed data may be left in the decompressor
+        while data or pending:
+            if self._decompressor is None:
+                if not data.startswith(GZIP_MAGIC[:len(data)]):
+                    raise ValidationError(
+                        "Invalid gzip member at offset %d." % self.written)
+                self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                self._record = _RecordVerifier()
+            try:
+                # Decompress block by block to keep the memory use bounded
+                # when large members are written at once
+                chunk = self._decompressor.decompress(data, BLOCK_SIZE)
+            except zlib.error as err:
+                raise ValidationError(
+                    "Invalid gzip member of record %d: %s" % (
+                        self.records + 1, err)) from err
+            self._record.feed(chunk)
+            data = self._decompressor.unconsumed_tail
+            pending = len(chunk) == BLOCK_SIZE
+            if self._decompressor.eof:
+                pending = False
+                data = self._decompressor.unused_data
+                self._decompressor = None
+                self.digests += self._record.finish()
+                self.records += 1
+
+    def flush(self):
+        """
+        Flush the target.
+        """
+        self.out.flush()
+
+    def fileno(self):
+        """
+        File descriptor of the target.
+        """
+        return self.out.fileno()
+
+    def summary(self):
+        """
+        Summary of the verified output.
+
+        :returns: Dict of the numbers of verified records and digests and
+                  the number of written bytes
+        :raises: ValidationError if the last gzip member is incomplete
+        """
+        if self._decompressor is not None:
+            raise ValidationError("Incomplete gzip member at the end of the "
+                                  "file.")
+        return {"records": self.records, "digests": self.digests,
+                "bytes": self.written}
+
+
+class _RecordVerifier:
+    """
+    Incremental parser and digest verifier of a single WARC record.
+    """
+
+    HTTP_RECORDS = ("response", "request", "revisit")
+    MAX_HEADER_SIZE = 1024 * 1024
+
+    def __init__(self):
+        """
+        Initialize verifier.
+        """
+        self.state = "warc_headers"
+        self.buffer = b""
+        self.remaining = 0
+        self.blank_line = True  # Current HTTP header line is blank so far
+        self.headers = {}
+        self.block_digester = None
+        self.payload_digester = None
+
+    def feed(self, data):
+        """
+        Feed decompressed record bytes to the verifier.
+
+        :data: Bytes of the record
+        """
+        while data:
+            if self.state == "warc_headers":
+                data = self._feed_headers(data)
+            elif self.state == "http_headers":
+                data = self._feed_http_headers(data)
+            elif self.state == "block":
+                chunk = data[:self.remaining]
+                data = data[self.remaining:]
+                self._update(chunk)
+                self.remaining -= len(chunk)
+                if self.remaining == 0:
+                    self.state = "trailer"
+            else:
+                self.buffer += data
+                data = b""
+                if not b"\r\n\r\n".startswith(self.buffer):
+                    raise ValidationError(
+                        "Extra data after record %s." % self._record_id())
+
+    def _feed_headers(self, data):
+        """
+        Buffer WARC header bytes until the end of the header.
+
+        :data: Bytes of the record
+        :returns: Bytes after the end of the header
+        """
+        # The end may start in the bytes buffered before
+        start = max(len(self.buffer) - 3, 0)
+        self.buffer += data
+        end = self.buffer.find(b"\r\n\r\n", start)
+        if end < 0:
+            if len(self.buffer) > self.MAX_HEADER_SIZE:
+                raise ValidationError("Too long record header.")
+            return b""
+
+        headers = self.buffer[:end + 4]
+        data = self.buffer[end + 4:]
+        self.buffer = b""
+        self._parse_warc_headers(headers)
+        if self.state == "block" and self.remaining == 0:
+            self.state = "trailer"
+        return data
+
+    def _feed_http_headers(self, data):
+        """
+        Digest HTTP header bytes until the end of the headers, i.e. the
+        end of the first line which is empty after stripping white space.
+        The bytes are not buffered. If the block has no such line, the
+        whole block is HTTP headers and the payload is empty, as for
+        Warcio.
+
+        :data: Bytes of the record
+        :returns: Bytes after the end of the headers
+        """
+        chunk = data[:self.remaining]
+        start = 0
+        found = False
+        while True:
+            newline = chunk.find(b"\n", start)
+            end = newline + 1 if newline > -1 else len(chunk)
+            self.blank_line = self.blank_line and \
+                not chunk[start:end].strip()
+            if newline < 0:
+                break
+            if self.blank_line:
+                found = True
+                break
+            self.blank_line = True
+            start = end
+
+        self._update(chunk[:end], payload=False)
+        self.remaining -= end
+        if found or self.remaining == 0:
+            self.state = "block"
+            self._start_payload()
+            if self.remaining == 0:
+                self.state = "trailer"
+        return data[end:]
+
+    def _parse_warc_headers(self, headers):
+        """
+        Parse the WARC header of the record and start the block.
+
+        :headers: Bytes of the WARC header
+        """
+        lines = headers.decode("utf-8", errors="replace").split("\r\n")
+        if lines[0] != "WARC/1.0":
+            raise ValidationError("Invalid WARC version line %s." % lines[0])
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                self.headers[name.strip().lower()] = value.strip()
+
+        try:
+            self.remaining = int(self.headers["content-length"])
+        except (KeyError, ValueError) as err:
+            raise ValidationError("Invalid Content-Length in record %s." %
+                                  self._record_id()) from err
+        if "warc-block-digest" not in self.headers:
+            raise ValidationError("Missing WARC-Block-Digest in record %s." %
+                                  self._record_id())
+
+        self.block_digester = self._digester("WARC-Block-Digest")
+        if self.headers.get("warc-type") in self.HTTP_RECORDS and \
+                self.remaining and \
+                self.headers.get("warc-target-uri", "").startswith(
+                    ("http:", "https:")):
+            self.state = "http_headers"
+        else:
+            self.state = "block"
+            self._start_payload()
+
+    def _start_payload(self):
+        """
+        Start the payload digest after the HTTP headers. The payload of a
+        revisit record is not in the record, so its WARC-Payload-Digest is
+        the digest of the original record and it is not verified. The
+        block digest of a revisit record is verified as for other records.
+        """
+        if self.headers.get("warc-type") != "revisit":
+            self.payload_digester = self._digester("WARC-Payload-Digest")
+
+    def _digester(self, header):
+        """
+        Create a digester for the algorithm of the given digest header.
+
+        :header: Name of the digest header
+        :returns: Hashlib object, or None if the header is missing
+        """
+        digest = self.headers.get(header.lower())
+        if not digest:
+            return None
+        try:
+            algorithm, _ = _parse_digest(digest)
+            return hashlib.new(algorithm)
+        except ValueError as err:
+            raise ValidationError("Invalid %s %s in record %s." % (
+                header, digest, self._record_id())) from err
+
+    def _update(self, data, payload=True):
+        """
+        Update the digests with the block bytes.
+
+        :data: Bytes of the block
+        :payload: True if the bytes belong to the payload
+        """
+        if self.block_digester:
+            self.block_digester.update(data)
+        if payload and self.payload_digester:
+            self.payload_digester.update(data)
+
+    def _record_id(self):
+        """
+        :returns: WARC-Record-ID of the record for error messages
+        """
+        return self.headers.get("warc-record-id", "")
+
+    def finish(self):
+        """
+        Finish the record at the end of its gzip member and compare the
+        computed digests with the digests in the header.
+
+        :returns: Number of verified digests
+        :raises: ValidationError if the record is incomplete or a digest
+                 does not match
+        """
+        if self.state != "trailer" or self.buffer != b"\r\n\r\n":
+            raise ValidationError("Incomplete record %s at the end of gzip "
+                                  "member." % self._record_id())
+        verified = 0
+        for header, digester in (
+                ("WARC-Block-Digest", self.block_digester),
+                ("WARC-Payload-Digest", self.payload_digester)):
+            digest = self.headers.get(header.lower())
+            if digester is None or not digest:
+                continue
+            if not _digest_matches(digester, digest):
+                raise ValidationError("%s failed in record %s." % (
+                    header, self._record_id()))
+            verified += 1
+        return verified
+
+
+def _parse_digest(digest):
+    """
+    Split a digest header value into the algorithm and the encoded value,
+    e.g. "sha1:..." into "sha1" and "...".
+
+    :digest: Value of a digest header
+    :returns: Tuple of the algorithm name and the encoded digest
+    :raises: ValueError if the value has no algorithm
+    """
+    algorithm, separator, value = digest.partition(":")
+    if not separator or not algorithm:
+        raise ValueError("No algorithm in digest %s." % digest)
+    return algorithm.strip().lower(), value.strip()
+
+
+def _digest_matches(digester, digest):
+    """
+    Compare a computed digest with a digest header value. WARC allows the
+    encodings of RFC 3548, so the value is decoded as base 32, base 16 or
+    base 64 depending on its length, as done by warcio.
+
+    :digester: Hashlib object of the computed digest
+    :digest: Value of the digest header
+    :returns: True if the digests are the same
+    """
+    _, value = _parse_digest(digest)
+    expected = digester.digest()
+    try:
+        if len(value) == len(base64.b32encode(expected)):
+            actual = base64.b32decode(value, casefold=True)
+        elif len(value) == 2 * len(expected):
+            actual = base64.b16decode(value, casefold=True)
+        elif "-" in value or "_" in value:
+            actual = base64.urlsafe_b64decode(value)
+        else:
+            actual = base64.b64decode(value)
+    except (binascii.Error, ValueError):
+        return False
+    return actual == expected
@@ -3,20 +3,36 @@ Fix produced WARC file to WARC 1.0.
 """
 import os
 import datetime
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 import urllib.parse
-import lxml.etree as ET
-from warcio.warcwriter import WARCWriter
 from warcio.archiveiterator import ArchiveIterator
 from warcio.bufferedreaders import DecompressingBufferedReader
+from warcio.limitreader import LimitReader
+from warcio.recordbuilder import RecordBuilder
 from warc_migrator.archive_handler import ArchiveHandler
+from warc_migrator.compression import (CompressingWARCWriter, DEFAULT_LEVEL,
+                                       DEFAULT_SPOOL_SIZE,
+                                       MemberBoundaryError, member_ranges)
+from warc_migrator.dedup import EMPTY_DIGEST, is_deduplicated, make_revisit
+from warc_migrator.indexer import EntryCollector, index_entry
+from warc_migrator.pipeline import PipelinedWARCWriter, ReadAheadReader
+from warc_migrator.rewriter import RawRecord, RecordReader
 
 
 # Pylint doesn't know what members lxml.etree has or doesn't have
 # pylint: disable=c-extension-no-member
 
+METADATA_BLOCK_SIZE = 64 * 1024  # Read size of ARC XML metadata
+# Headers referring to the warcinfo record of the file
+WARCINFO_REFERENCES = ("WARC-Warcinfo-ID", "WARC-Concurrent-To")
 
-def recompress_warc(source, target):
+
+def recompress_warc(source, target, level=DEFAULT_LEVEL, backend="zlib",
+                    spool_size=DEFAULT_SPOOL_SIZE):
     """
     Recompress a WARC file. This is used for fixing a compression
     issue. Originally, some implementations created WARC compression in a
@@ -24,11 +40,15 @@ def recompress_warc(source, target):
 
     :source: Source file buffer
     :target: Target file buffer
+    :level: Compression level 0-9
+    :backend: Deflate backend, see compression.resolve_backend()
+    :spool_size: Maximum size of a record buffered in memory in bytes
     """
     source.seek(0)
     decomp_buff = DecompressingBufferedReader(
         source, read_all_members=True)
-    writer = WARCWriter(filebuf=target, gzip=True)
+    writer = CompressingWARCWriter(target, level=level, backend=backend,
+                                   spool_size=spool_size)
     for record in ArchiveIterator(
             decomp_buff, no_record_parse=False,
             arc2warc=False, verify_http=False):
@@ -36,6 +56,130 @@ def recompress_warc(source, target):
     target.seek(0)
 
 
+def part_name(path, part):
+    """
+    Resolve the name of a part file of a target split into several files.
+
+    The first part is the target itself, the next parts are numbered, e.g.
+    target.warc.gz, target-00001.warc.gz, target-00002.warc.gz, ...
+
+    :path: Target file path or name
+    :part: Part number
+    :returns: Part file path or name
+    """
+    if part == 0:
+        return path
+    for extension in (".warc.gz", ".warc", ".gz"):
+        if path.endswith(extension):
+            return "%s-%05d%s" % (path[:-len(extension)], part, extension)
+    return "%s-%05d" % (path, part)
+
+
+def fix_shard(source_path, start, end, compression_level=DEFAULT_LEVEL,
+              compression_backend="zlib", spool_size=DEFAULT_SPOOL_SIZE,
+              index=False):
+    """
+    Fix and compress a shard of a WARC 0.17/0.18 file into a temporary
+    file. This is run in the worker processes of
+    WarcFixer.fix_warc_sharded().
+
+    :source_path: Source file path
+    :start: Offset of the first gzip member of the shard
+    :end: Offset of the end of the last gzip member of the shard
+    :compression_level: Compression level 0-9 of the written records
+    :compression_backend: Deflate backend, see
+                          compression.resolve_backend()
+    :spool_size: Maximum size of a record buffered in memory in bytes
+    :index: True to collect the index entries of the written records
+    :returns: Tuple of the temporary file path, count of written records
+              and list of index entries, see indexer.EntryCollector
+    :raises: compression.MemberBoundaryError if the shard was not cut at
+             gzip member boundaries, see WarcFixer.fix_warc_shard()
+    """
+    indexer = EntryCollector() if index else None
+    warc_fixer = WarcFixer({}, None, compression_level=compression_level,
+                           compression_backend=compression_backend,
+                           spool_size=spool_size, indexer=indexer)
+    with open(source_path, "rb") as source, \
+            tempfile.NamedTemporaryFile(prefix="warc-migrator.",
+                                        delete=False) as target:
+        try:
+            source.seek(start)
+            count = warc_fixer.fix_warc_shard(
+                LimitReader(source, end - start), target)
+        except BaseException:
+            os.remove(target.name)
+            raise
+    return target.name, count, indexer.entries if indexer else []
+
+
+def _first_warcinfo_end(source):
+    """
+    Find the end of the first warcinfo record of a WARC file, i.e. the
+    record fixed as the warcinfo of the target.
+
+    :source: Seekable source file handler
+    :returns: Offset of the end of the gzip member of the warcinfo record,
+              None if the file has no warcinfo record
+    """
+    source.seek(0)
+    try:
+        records = ArchiveIterator(fileobj=source, no_record_parse=False,
+                                  verify_http=False, arc2warc=False,
+                                  ensure_http_headers=False)
+        for record in records:
+            if record.rec_type == "warcinfo" and \
+                    record.content_type == "application/warc-fields":
+                records.read_to_end()
+                return records.get_record_offset() + \
+                    records.get_record_length()
+        return None
+    finally:
+        source.seek(0)
+
+
+def _discard_shards(futures):
+    """
+    Cancel the remaining shards of a failed migration and remove their
+    temporary files.
+
+    :futures: Futures of fix_shard() results
+    """
+    for future in futures:
+        if future.cancel() or future.exception() is not None:
+            continue
+        path = future.result()[0]
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def non_ascii_status(statusline):
+    """
+    Check whether the text after the status code of an HTTP status line
+    has non-ASCII characters, which _fix_warc_data_record() URL encodes.
+
+    :statusline: HTTP status line, as parsed by Warcio
+    :returns: True if the status line has non-ASCII characters
+    """
+    status = statusline.split(" ", 1)
+    if len(status) < 2:
+        return False
+    try:
+        status[1].encode('ascii')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return True
+    return False
+
+
+def _make_record_id():
+    """
+    Create a new WARC-Record-ID.
+
+    :returns: Record ID as a URN
+    """
+    return "<urn:uuid:%s>" % uuid.uuid4()
+
+
 # pylint: disable=too-few-public-methods
 class SimpleHeader():
     """
@@ -74,18 +218,82 @@ class WarcFixer:
     All other records are unchanged.
     """
 
-    def __init__(self, given_warcinfo, target_name):
+    def __init__(self, given_warcinfo, target_name, jobs=1,
+                 compression_level=DEFAULT_LEVEL, compression_backend="zlib",
+                 spool_size=DEFAULT_SPOOL_SIZE, indexer=None,
+                 checkpoint=None, resume=None, max_size=None,
+                 open_part=None, shards=1, stats=None, metrics=None,
+                 pipeline=False, passthrough=False, rewrite=True,
+                 dedup=None):
         """
         Initialize engine.
 
         :given_warcinfo: Dict of warcinfo fields given by the user
         :target_name: Target WARC filename
+        :jobs: Number of threads compressing the written records
+        :compression_level: Compression level 0-9 of the written records
+        :compression_backend: Deflate backend, see
+                              compression.resolve_backend()
+        :spool_size: Maximum size of a record buffered in memory in bytes
+        :indexer: Index writer of the written records, see
+                  indexer.CdxWriter
+        :checkpoint: Checkpoint journal updated while the records are
+                     written, see checkpoint.Checkpoint
+        :resume: Checkpoint dict to resume from, the records already
+                 written into the target are skipped
+        :max_size: Size in bytes after which the output is rolled over to
+                   the next part file, None for a single target file
+        :open_part: Function which closes the current part file and opens
+                    the part file with the given number
+        :shards: Number of worker processes in fix_warc_sharded()
+        :stats: Statistics of the migration counting the written records,
+                see stats.Stats
+        :metrics: Metrics observing the processing time of the written
+                  records, see metrics.Metrics
+        :pipeline: True to read the source in a reader thread and to
+                   compress and write the records in threads of their own,
+                   see pipeline.ReadAheadReader and
+                   pipeline.PipelinedWARCWriter
+        :passthrough: True to copy the gzip members of the WARC 1.0 records
+                      of a seekable multi-member gzip source as they are,
+                      when fixing them would not change them, see
+                      _copy_record()
+        :rewrite: True to rewrite the WARC headers of data records as bytes
+                  instead of parsing the records, when the result is the
+                  same, see rewriter.RecordReader
+        :dedup: Digest index of the payloads of the written response
+                records, a response record with a payload already in the
+                index is written as a revisit record, see dedup.DigestIndex
         """
 
         self.source = ArchiveHandler()
         self.target = ArchiveHandler()
         self.given_warcinfo = given_warcinfo
         self.target_name = target_name
+        self.jobs = jobs
+        self.compression_level = compression_level
+        self.compression_backend = compression_backend
+        self.spool_size = spool_size
+        self.indexer = indexer
+        self.checkpoint = checkpoint
+        self.resume = resume
+        self.max_size = max_size
+        self.open_part = open_part
+        self.shards = shards
+        self.stats = stats
+        self.metrics = metrics
+        self.pipeline = pipeline
+        self.passthrough = passthrough
+        self.rewrite = rewrite
+        self.dedup = dedup
+        self.part = 0               # Number of the current part file
+        self.repeated = 0           # Number of warcinfo and metadata
+        #                             records repeated in the part files
+        self.writer = None          # WARC writer of the current part file
+        self._skip = 0              # Number of records left to skip
+        self._source_warcinfo_id = None  # Warcinfo ID created by the fixer
+        self._warcinfo_id = None    # Warcinfo ID of the current part file
+        self._written = None        # Time when the last record was written
 
     def fix_warc_migrated(self, source_handler, target_handler):
         """
@@ -102,14 +310,29 @@ class WarcFixer:
         :target_handler: Target file handler
         :return: Count of written records
         """
+        self._start(target_handler)
+        source_handler = self._read_ahead(source_handler)
+        try:
+            count = self._fix_migrated_records(source_handler)
+        finally:
+            self._close(source_handler)
+
+        return count + self.repeated
+
+    def _fix_migrated_records(self, source_handler):
+        """
+        Fix and write the records of WARC file migrated from ARC file.
+
+        :source_handler: Source file handler
+        :return: Count of written records, excluding the repeated records
+                 of the part files
+        """
         count = 0
         warcinfo_fixed = False
-        warc_writer = WARCWriter(target_handler, warc_version="1.0",
-                                 gzip=True)
-        for record in ArchiveIterator(fileobj=source_handler,
-                                      no_record_parse=False,
-                                      verify_http=False, arc2warc=False,
-                                      ensure_http_headers=False):
+        records = RecordReader(fileobj=source_handler, rewrite=False,
+                               no_record_parse=False, verify_http=False,
+                               arc2warc=False, ensure_http_headers=False)
+        for record in records:
             if not warcinfo_fixed:
                 if record.rec_type == "warcinfo" and \
                         record.content_type == "application/warc-fields":
@@ -120,13 +343,14 @@ class WarcFixer:
                     self._extract_arc_metadata()
                     self._fix_metadata()
                     self._fix_warcinfo()
-                    warc_writer.write_record(self.target.warcinfo_record)
-                    warc_writer.write_record(self.target.metadata_record)
+                    self._write_warcinfo()
+                    self._write_record(self.target.metadata_record)
                     count += 2
                     warcinfo_fixed = True
+                    records.rewrite = self.rewrite
             else:
                 self._fix_warc_data_record(record)
-                warc_writer.write_record(record)
+                self._write_record(record, rollover=True)
                 count += 1
 
         return count
@@ -144,30 +368,467 @@ class WarcFixer:
         :target_handler: Target file handler
         :return: Count of written records
         """
+        self._start(target_handler)
+        source_handler = self._read_ahead(source_handler)
+        try:
+            count = self._fix_original_records(source_handler)
+        finally:
+            self._close(source_handler)
+
+        return count + self.repeated
+
+    def fix_warc_sharded(self, source_handler, target_handler):
+        """
+        Fix multi-member gzip compressed WARC 0.17/0.18 file in parallel,
+        with the same result as fix_warc_original().
+
+        The records up to the first warcinfo record are fixed here. The
+        rest of the file is cut into shards at the gzip members found near
+        the estimated offsets, without decompressing the file here, and the
+        shards are fixed and compressed in worker processes into temporary
+        files, which are appended to the target in order. The workers check
+        that their shard ends at the end of a member while they fix it. If
+        a cut was inside a member after all, the file is fixed here from
+        the start of that shard onwards.
+
+        :source_handler: Source file handler of a multi-member gzip file
+        :target_handler: Target file handler
+        :return: Count of written records
+        """
+        size = os.fstat(source_handler.fileno()).st_size
+        head_end = _first_warcinfo_end(source_handler)
+        if head_end is None:
+            head_end = size
+        shard_size = max(1, -(-(size - head_end) // self.shards))
+
+        self._start(target_handler)
+        with ProcessPoolExecutor(max_workers=self.shards) as executor:
+            futures = []
+            try:
+                for start, end in member_ranges(source_handler, head_end,
+                                                size, shard_size):
+                    future = executor.submit(
+                        fix_shard, source_handler.name, start, end,
+                        self.compression_level, self.compression_backend,
+                        self.spool_size, self.indexer is not None)
+                    futures.append((future, start, end))
+                source_handler.seek(0)
+                count = self._fix_original_records(
+                    LimitReader(source_handler, head_end))
+                while futures:
+                    try:
+                        path, records, entries = futures[0][0].result()
+                    except MemberBoundaryError:
+                        start = futures.pop(0)[1]
+                        source_handler.seek(start)
+                        count += self._fix_original_records(
+                            LimitReader(source_handler, size - start),
+                            warcinfo_fixed=True)
+                        break
+                    end = futures.pop(0)[2]
+                    try:
+                        with open(path, "rb") as members:
+                            self.writer.write_members(members, entries,
+                                                      records)
+                    finally:
+                        os.remove(path)
+                    count += records
+                    if self.stats is not None:
+                        self.stats.advance(records, position=end)
+            finally:
+                _discard_shards(future for future, _, _ in futures)
+                self.writer.close()
+
+        return count
+
+    def fix_warc_shard(self, source_handler, target_handler):
+        """
+        Fix a shard of WARC 0.17/0.18 file after the first warcinfo record.
+        All records of the shard are fixed as data records.
+
+        The shard is checked to end at the end of a gzip member while its
+        records are read. If it ends inside a member, the records read
+        from the cut member are not valid, and the shard is rejected, also
+        if reading them failed.
+
+        :source_handler: Source file handler of the shard, starting at a
+                         gzip member boundary
+        :target_handler: Target file handler
+        :return: Count of written records
+        :raises: compression.MemberBoundaryError if the shard ends inside a
+                 gzip member
+        """
+        records = self._record_reader(source_handler)
+        self._start(target_handler)
+        try:
+            count = self._fix_original_records(
+                source_handler, warcinfo_fixed=True, records=records)
+        except Exception as err:
+            records.close()
+            if records.in_member and not source_handler.read(1):
+                raise MemberBoundaryError(
+                    "Shard ends inside a gzip member.") from err
+            raise
+        finally:
+            self.writer.close()
+        if records.in_member:
+            raise MemberBoundaryError("Shard ends inside a gzip member.")
+
+        return count
+
+    def _record_reader(self, source_handler):
+        """
+        Create the iterator over the records of WARC 0.17/0.18 file.
+
+        :source_handler: Source file handler
+        :returns: rewriter.RecordReader
+        """
+        return RecordReader(fileobj=source_handler,
+                            rewrite=self.rewrite and not self.passthrough,
+                            no_record_parse=False, verify_http=False,
+                            arc2warc=False, ensure_http_headers=False,
+                            check_digests=self.passthrough)
+
+    def _fix_original_records(self, source_handler, warcinfo_fixed=False,
+                              records=None):
+        """
+        Fix and write the records of WARC 0.17/0.18 file.
+
+        :source_handler: Source file handler
+        :warcinfo_fixed: True if the warcinfo record of the target has
+                         already been written before the given records
+        :records: Iterator over the records of the source, see
+                  _record_reader(), None to create one
+        :return: Count of written records, excluding the repeated records
+                 of the part files
+        """
         count = 0
-        warcinfo_fixed = False
-        warc_writer = WARCWriter(target_handler, warc_version="1.0",
-                                 gzip=True)
-        for record in ArchiveIterator(fileobj=source_handler,
-                                      no_record_parse=False,
-                                      verify_http=False, arc2warc=False,
-                                      ensure_http_headers=False):
+        if records is None:
+            records = self._record_reader(source_handler)
+        for record in records:
             if record.rec_type == "warcinfo" and \
                     record.content_type == "application/warc-fields" and \
                     not warcinfo_fixed:
                 self.source.set_warcinfo_record(record)
                 self._extract_warcinfo()
                 self._fix_warcinfo()
-                warc_writer.write_record(self.target.warcinfo_record)
+                self._write_warcinfo()
                 count += 1
                 warcinfo_fixed = True
+            elif self.passthrough and \
+                    self._copy_record(records, record, source_handler):
+                count += 1
             else:
                 self._fix_warc_data_record(record)
-                warc_writer.write_record(record)
+                self._write_record(record, rollover=True)
                 count += 1
 
         return count
 
+    def _copy_record(self, records, record, source_handler):
+        """
+        Copy the gzip member of a record from the source as it is, if
+        fixing the record would not change it: the record is already WARC
+        1.0 with the digests which the writer would otherwise add, and it
+        does not refer to a warcinfo record replaced in a part file, and its
+        payload is not in the digest index of the deduplication. The
+        digests are verified while the record is read, and a record with a
+        failed digest is fixed after all.
+
+        :records: ArchiveIterator of the source, checking the digests
+        :record: Current record of the iterator, not read yet
+        :source_handler: Seekable multi-member gzip source file handler
+        :returns: True if the record was written, False if it has to be
+                  fixed
+        """
+        headers = record.rec_headers
+        if self._skip or headers.protocol != "WARC/1.0" or \
+                not headers.get_header("WARC-Block-Digest") or \
+                not (headers.get_header("WARC-Payload-Digest") or
+                     record.rec_type in
+                     RecordBuilder.NO_PAYLOAD_DIGEST_TYPES):
+            return False
+        digest = None
+        if self.dedup is not None and is_deduplicated(record):
+            digest = headers.get_header("WARC-Payload-Digest")
+            if self.dedup.lookup(
+                    digest,
+                    headers.get_header("WARC-Record-ID")) is not None:
+                return False  # Written as a revisit record
+        if self.max_size is not None and self.writer.reached(self.max_size):
+            self._roll_over()
+        if self._warcinfo_id != self._source_warcinfo_id and any(
+                headers.get_header(name) == self._source_warcinfo_id
+                for name in WARCINFO_REFERENCES):
+            self._fix_warc_data_record(record)
+            self._write_record(record)
+            return True
+
+        records.read_to_end(record)
+        offset = records.get_record_offset()
+        length = records.get_record_length()
+        position = source_handler.tell()
+        try:
+            source_handler.seek(offset)
+            if record.digest_checker.passed:
+                self.writer.copy_member(
+                    source_handler, length,
+                    index_entry(record) if self.indexer is not None
+                    else None)
+                self._advance()
+                if digest is not None:
+                    self._add_original(record, digest)
+                if self.metrics is not None:
+                    self.metrics.inc("copied_records_total")
+            else:
+                # The record has been read, so it is read again
+                record = next(iter(ArchiveIterator(
+                    fileobj=LimitReader(source_handler, length),
+                    no_record_parse=False, verify_http=False,
+                    arc2warc=False, ensure_http_headers=False)))
+                self._fix_warc_data_record(record)
+                self._write_record(record)
+        finally:
+            source_handler.seek(position)
+        return True
+
+    def _start(self, target_handler):
+        """
+        Start writing into the target, or into the part file of the last
+        checkpoint when resuming.
+
+        :target_handler: Target file handler
+        """
+        self.writer = self._create_writer(target_handler)
+        self.part = 0
+        self.repeated = 0
+        self._skip = 0
+        self._warcinfo_id = None
+        self._written = time.perf_counter()
+        if self.resume:
+            self.writer.offset = self.resume["offset"]
+            self.writer.records = self.resume["records"]
+            self.part = self.resume["part"]
+            self.repeated = self.resume["repeated"]
+            self._skip = self.resume["records"] - self.resume["repeated"]
+            self._warcinfo_id = self.resume["warcinfo_id"]
+            if self.indexer is not None:
+                self.indexer.warc_filename = os.path.basename(
+                    part_name(self.target_name, self.part))
+
+    def _read_ahead(self, source_handler):
+        """
+        Wrap the source into a reader thread in the pipeline.
+
+        :source_handler: Source file handler
+        :returns: ReadAheadReader of the source in the pipeline, otherwise
+                  the source itself, also when the gzip members of the
+                  source are copied
+        """
+        if not self.pipeline or self.passthrough:
+            return source_handler
+        return ReadAheadReader(source_handler)
+
+    def _close(self, source_handler):
+        """
+        Close the writer and the reader thread of the pipeline, so that the
+        source can be read again after a failure.
+
+        :source_handler: Source file handler from _read_ahead()
+        """
+        try:
+            self.writer.close()
+        finally:
+            if isinstance(source_handler, ReadAheadReader):
+                source_handler.close()
+
+    def _create_writer(self, target_handler):
+        """
+        Create the WARC writer of the target.
+
+        :target_handler: Target file handler
+        :returns: CompressingWARCWriter, or PipelinedWARCWriter in the
+                  pipeline
+        """
+        writer_class = CompressingWARCWriter
+        if self.pipeline:
+            writer_class = PipelinedWARCWriter
+        return writer_class(target_handler, jobs=self.jobs,
+                            level=self.compression_level,
+                            backend=self.compression_backend,
+                            spool_size=self.spool_size,
+                            indexer=self.indexer,
+                            checkpoint=self.checkpoint,
+                            warc_version="1.0")
+
+    def _roll_over(self):
+        """
+        Close the current part file and continue in the next one. The part
+        file starts with a warcinfo record of its own, and with the ARC
+        metadata record in WARC files migrated from ARC files, so that the
+        part files can be used independently.
+        """
+        records = self.writer.records
+        self.writer.close()
+        self.part += 1
+        self.writer = self._create_writer(self.open_part(self.part))
+        self.writer.records = records
+        # Checkpoints are written only after the repeated records
+        self.writer.checkpoint = None
+        if self.indexer is not None:
+            self.indexer.warc_filename = os.path.basename(
+                part_name(self.target_name, self.part))
+
+        if self.source.warcinfo_record is not None:
+            self._fix_warcinfo()
+            self.target.warcinfo_record.rec_headers.replace_header(
+                "WARC-Record-ID", _make_record_id())
+            self._write_warcinfo()
+            self.repeated += 1
+        if self.source.metadata_record is not None:
+            self._fix_metadata()
+            # The headers are shared with the metadata record of the
+            # previous part file
+            headers = self.target.metadata_record.rec_headers
+            headers.replace_header("WARC-Record-ID", _make_record_id())
+            for name in WARCINFO_REFERENCES:
+                if headers.get_header(name):
+                    headers.replace_header(name, self._warcinfo_id)
+            self._write_record(self.target.metadata_record)
+            self.repeated += 1
+
+        self.writer.checkpoint = self.checkpoint
+        if self.checkpoint is not None:
+            self.checkpoint.start_part(self.part, self.repeated)
+
+    def _write_warcinfo(self):
+        """
+        Write the fixed warcinfo record of the target or the current part
+        file, and record its ID in the checkpoint journal.
+        """
+        record_id = self.target.warcinfo_record.rec_headers.get_header(
+            "WARC-Record-ID")
+        if self._source_warcinfo_id is None:
+            self._source_warcinfo_id = record_id
+        if not self._skip:
+            self._warcinfo_id = record_id
+            if self.checkpoint is not None:
+                self.checkpoint.warcinfo_id = record_id
+        self._write_record(self.target.warcinfo_record)
+
+    def _write_record(self, record, rollover=False):
+        """
+        Write a record, unless it was already written before the migration
+        was resumed.
+
+        The references to the warcinfo record are changed to the warcinfo
+        of the current part file. The IDs of warcinfo records converted
+        from ARC files differ also between runs, so on resume the references
+        are changed to the warcinfo written before.
+
+        :record: Warcio record
+        :rollover: True to roll over to the next part file before the record
+                   if the current part file is full
+        """
+        if self._skip:
+            self._skip -= 1
+            self._written = time.perf_counter()
+            if self.dedup is not None and is_deduplicated(record):
+                # The originals written before the migration was resumed
+                # are added to the index again
+                digest = self._payload_digest(record)
+                if self.dedup.lookup(
+                        digest,
+                        record.rec_headers.get_header("WARC-Record-ID")) \
+                        is None:
+                    self._add_original(record, digest, resumed=True)
+            return
+        if rollover and self.max_size is not None and \
+                self.writer.reached(self.max_size):
+            self._roll_over()
+
+        if self._warcinfo_id != self._source_warcinfo_id:
+            headers = record.rec_headers
+            for name in WARCINFO_REFERENCES:
+                if headers.get_header(name) == self._source_warcinfo_id:
+                    headers.replace_header(name, self._warcinfo_id)
+        if self.dedup is not None and is_deduplicated(record):
+            self._deduplicate(record)
+        if isinstance(record, RawRecord):
+            self.writer.write_raw_record(record)
+            if self.metrics is not None:
+                self.metrics.inc("rewritten_records_total")
+        else:
+            self.writer.write_record(record)
+        self._advance()
+
+    def _deduplicate(self, record):
+        """
+        Turn a response record into a revisit record, if a record with the
+        same payload is in the digest index, otherwise add the record to
+        the index. The payload digest is computed first if it is missing,
+        and the payload is buffered for writing. Empty payloads are not
+        deduplicated.
+
+        :record: Fixed response record, Warcio record or RawRecord
+        """
+        digest = self._payload_digest(record)
+        original = self.dedup.lookup(
+            digest, record.rec_headers.get_header("WARC-Record-ID"))
+        if original is None:
+            self._add_original(record, digest)
+            return
+        make_revisit(record, original)
+        if self.metrics is not None:
+            self.metrics.inc("deduplicated_records_total")
+
+    def _payload_digest(self, record):
+        """
+        Compute the payload digest of a response record if it is missing.
+        The payload is buffered for writing.
+
+        :record: Fixed response record, Warcio record or RawRecord
+        :returns: Payload digest
+        """
+        if isinstance(record, RawRecord):
+            record.ensure_digests(self.spool_size, block=False)
+        else:
+            self.writer.ensure_digest(record, block=False, payload=True)
+        return record.rec_headers.get_header("WARC-Payload-Digest")
+
+    def _add_original(self, record, digest, resumed=False):
+        """
+        Add a written response record to the digest index as the original
+        record of its payload, unless the payload is empty.
+
+        :record: Response record
+        :digest: Payload digest of the record
+        :resumed: True for a record written before the migration was
+                  resumed. Its file name is known only if no part file
+                  was rolled over before the resume.
+        """
+        if digest == EMPTY_DIGEST:
+            return
+        filename = None
+        if not resumed or self.part == 0:
+            filename = os.path.basename(part_name(self.target_name,
+                                                  self.part))
+        headers = record.rec_headers
+        self.dedup.add(digest, headers.get_header("WARC-Record-ID"),
+                       headers.get_header("WARC-Target-URI"),
+                       headers.get_header("WARC-Date"), filename)
+
+    def _advance(self):
+        """
+        Count a written record in the statistics and metrics.
+        """
+        if self.stats is not None:
+            self.stats.advance()
+        if self.metrics is not None:
+            now = time.perf_counter()
+            self.metrics.observe("record_seconds", now - self._written)
+            self._written = now
+
     def _fix_warc_data_record(self, record, encode=False):
         """
         Fix WARC data record, other than warcinfo of ARC mewtadata record.
@@ -175,19 +836,21 @@ class WarcFixer:
         - If necessary, URL encode HTTP header in the record,
           otherwise leave it as it is
 
-        :record: WARC data record
+        :record: WARC data record, Warcio record or RawRecord read by
+                 rewriter.RecordReader, whose HTTP headers are left as
+                 they are
         """
         # pylint: disable=no-self-use
+        if isinstance(record, RawRecord):
+            # The version line is rewritten when the record is written
+            return
         record.rec_headers.protocol = "WARC/1.0"
         if record.http_headers:
             if encode:
-                status = record.http_headers.statusline.split(" ", 1)
-                if len(status) > 1:
-                    try:
-                        status[1].encode('ascii')
-                    except (UnicodeEncodeError, UnicodeDecodeError):
-                        record.http_headers.statusline = " ".join(
-                            [status[0], urllib.parse.quote(status[1])])
+                if non_ascii_status(record.http_headers.statusline):
+                    status = record.http_headers.statusline.split(" ", 1)
+                    record.http_headers.statusline = " ".join(
+                        [status[0], urllib.parse.quote(status[1])])
             else:
                 record.http_headers = SimpleHeader(record.http_headers)
 
@@ -219,7 +882,8 @@ class WarcFixer:
             if "WARC-Filename" in field or "WARC-Date" in field:
                 record_headers.headers.remove(field)
         record_headers.headers.append((
-            "WARC-Filename", os.path.basename(self.target_name)))
+            "WARC-Filename",
+            os.path.basename(part_name(self.target_name, self.part))))
         date = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
         record_headers.headers.append(("WARC-Date", date))
         record_headers.protocol = "WARC/1.0"
@@ -229,7 +893,7 @@ class WarcFixer:
         Change content type of metadata record containing old ARC file header
         to application/x-internet-archive
         """
-        self.target.metadata = self.source.metadata
+        self.target.metadata_chunks = self.source.metadata_chunks
         self.target.create_info_record(
             self.source.metadata_record.rec_headers, "metadata")
         self.target.metadata_record.content_type = \
@@ -252,9 +916,11 @@ class WarcFixer:
         Create warcinfo from ARC metadata in WARC metadata record.
         Supports ARC and Dublin Core (DC 1.1, DC Terms, DCMIType) metadata
         fields.
+
+        The XML metadata is read in blocks, which are collected as the
+        metadata payload and fed to the XML parser as they are read.
         """
         line = b""
-        metadata = b""
         while not line.startswith(b"<") and \
                 self.source.metadata_record.raw_stream.limit > 0:
             line = self.source.metadata_record.raw_stream.readline()
@@ -262,12 +928,18 @@ class WarcFixer:
         if not line.startswith(b"<"):
             return
 
-        metadata = line
+        # lxml is imported only for files with XML metadata
+        import lxml.etree as ET  # pylint: disable=import-outside-toplevel
+        parser = ET.XMLParser()
+        parser.feed(line)
         while self.source.metadata_record.raw_stream.limit != 0:
-            meta = self.source.metadata_record.raw_stream.read()
+            meta = self.source.metadata_record.raw_stream.read(
+                METADATA_BLOCK_SIZE)
+            if not meta:
+                break
             self.source.append_metadata(meta)
-            metadata = metadata + meta
-        xml = ET.fromstring(metadata)
+            parser.feed(meta)
+        xml = parser.close()
         nspace = {"arc": "http://archive.org/arc/1.0/",
                   "dc": "http://purl.org/dc/elements/1.1/",
                   "dcterms": "http://purl.org/dc/terms/",